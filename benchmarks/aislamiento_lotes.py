@@ -0,0 +1,106 @@
+"""Comprueba que los cambios de un lote abierto no llegan a disco antes de confirmarse.
+
+Genera datos en un directorio temporal (un nodo con todas las particiones) y,
+para cada combinación de `--durabilidad` y `--almacenamiento`, abre en un
+hilo un lote que debita la cuenta 1 y, con el lote aún abierto, confirma un
+CREDIT de la cuenta 4 (misma partición) y fuerza el guardado de la partición
+(la reescritura del `.txt` o el msync del `.dat`). El total en disco debe
+incluir el CREDIT y no el débito del lote. Después el lote se deshace y se
+repite con un lote que sí se confirma.
+
+Uso:
+    python3 benchmarks/aislamiento_lotes.py
+"""
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENERADOR = os.path.join(REPO_DIR, 'src', 'clients', 'generador_datos.py')
+sys.path.insert(0, os.path.join(REPO_DIR, 'src', 'worker_nodes'))
+
+from locks import LockManager
+from montos import format_monto
+from storage import NodeStore, configurar_particiones
+
+PARTICIONES = 3
+DEBITO = 100000 # Céntimos que debita el lote
+CREDITO = 100   # Céntimos del CREDIT confirmado con el lote abierto
+
+class Abortar(Exception):
+    pass
+
+def lote_abierto(store, confirmar):
+    """Lanza un hilo que debita la cuenta 1 dentro de un lote y lo deja abierto
+    hasta que se llame a la función devuelta, que lo confirma o lo deshace."""
+    abierto, cerrar = threading.Event(), threading.Event()
+
+    def run():
+        try:
+            with store.locks.cuentas(['1'], exclusivo=True), store.batch():
+                cuenta, _ = store.get_cuenta('1')
+                store.commit(cuentas=[cuenta._replace(saldo=cuenta.saldo - DEBITO)])
+                abierto.set()
+                cerrar.wait()
+                if not confirmar: raise Abortar()
+        except Abortar:
+            pass
+
+    hilo = threading.Thread(target=run)
+    hilo.start()
+    abierto.wait()
+    def terminar():
+        cerrar.set()
+        hilo.join()
+    return terminar
+
+def credito(store):
+    with store.locks.cuentas(['4'], exclusivo=True):
+        cuenta, _ = store.get_cuenta('4')
+        store.commit(cuentas=[cuenta._replace(saldo=cuenta.saldo + CREDITO)])
+
+def comprobar(nombre, partition, esperado):
+    partition.save() # Lo que haría un commit concurrente en `directo` o un checkpoint
+    disco = partition.disk_total()
+    if disco != esperado:
+        print(f"ERROR: {nombre}: total en disco {format_monto(disco)}, esperado {format_monto(esperado)}")
+        sys.exit(1)
+
+def probar(data_dir, durabilidad, almacenamiento):
+    store = NodeStore(data_dir, LockManager(), durabilidad, almacenamiento)
+    partition = store.cuentas[1]
+    inicial = partition.disk_total()
+
+    terminar = lote_abierto(store, confirmar=False)
+    credito(store)
+    comprobar("con el lote abierto", partition, inicial + CREDITO)
+    terminar()
+    comprobar("tras deshacer el lote", partition, inicial + CREDITO)
+
+    terminar = lote_abierto(store, confirmar=True)
+    comprobar("con un lote abierto que se confirmará", partition, inicial + CREDITO)
+    terminar()
+    comprobar("tras confirmar el lote", partition, inicial + CREDITO - DEBITO)
+    if partition.total() != inicial + CREDITO - DEBITO:
+        print(f"ERROR: total mantenido {format_monto(partition.total())} tras confirmar el lote")
+        sys.exit(1)
+
+def main():
+    configurar_particiones(PARTICIONES)
+    with tempfile.TemporaryDirectory() as work_dir:
+        subprocess.run([sys.executable, GENERADOR, '--cuentas', '3000', '--prestamos', '0', '--transacciones', '0',
+                        '--particiones', str(PARTICIONES), '--nodos', '1', '--seed', '1'],
+                       cwd=work_dir, check=True, stdout=subprocess.DEVNULL)
+        original = os.path.join(work_dir, 'data', 'nodo1')
+        for durabilidad in ('directo', 'wal'):
+            for almacenamiento in ('texto', 'mmap'):
+                data_dir = os.path.join(work_dir, f"{durabilidad}_{almacenamiento}")
+                shutil.copytree(original, data_dir)
+                probar(data_dir, durabilidad, almacenamiento)
+                print(f"OK: --durabilidad {durabilidad} --almacenamiento {almacenamiento}")
+
+if __name__ == "__main__":
+    main()
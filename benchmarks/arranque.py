@@ -0,0 +1,139 @@
+"""Tiempo de arranque de un worker con y sin los índices guardados (`.idx`, ver indices.py).
+
+Genera datos en un directorio temporal (un solo nodo con todas las
+particiones), añade a cada partición un historial sintético de
+`--historial` filas por cuenta y mide, para cada tamaño de `--cuentas`, el
+tiempo desde que se lanza `worker.py` hasta que responde a STATS:
+
+- sin índices:      `--no-indices`, se interpreta cada archivo.
+- primer arranque:  con índices pero sin `.idx`: se interpreta y se guardan.
+- con índices:      todos los `.idx` son válidos.
+- tras una caída:   después de `--cambios` DEBIT y un SIGKILL (sin guardar al
+                    detenerse): se reconstruyen los archivos de cuentas
+                    reescritos y del historial sólo se lee la cola nueva.
+
+También muestra el pico de memoria del proceso (VmHWM) y comprueba con
+`ARQUEO_CUENTAS|VERIFICAR` que el arqueo es el mismo arrancando con y sin
+índices y que, tras la caída, el total mantenido de cada partición (el que
+da el índice cargado) coincide con el de disco y con el anterior menos los
+DEBIT confirmados.
+
+Uso:
+    python3 benchmarks/arranque.py --cuentas 100000 1000000
+    python3 benchmarks/arranque.py --cuentas 10000000 --worker-args "--almacenamiento mmap" --historial 0
+"""
+import os
+import sys
+import time
+import glob
+import shlex
+import signal
+import argparse
+import tempfile
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKER = os.path.join(REPO_DIR, 'src', 'worker_nodes', 'worker.py')
+GENERADOR = os.path.join(REPO_DIR, 'src', 'clients', 'generador_datos.py')
+sys.path.insert(0, os.path.join(REPO_DIR, 'src', 'worker_nodes'))
+
+from montos import parse_monto
+from replication import enviar
+
+def generar(work_dir, cuentas, prestamos, particiones, historial, puerto):
+    subprocess.run([sys.executable, GENERADOR, '--cuentas', str(cuentas), '--prestamos', str(prestamos),
+                    '--particiones', str(particiones), '--nodos', '1', '--puerto-base', str(puerto)],
+                   cwd=work_dir, check=True, stdout=subprocess.DEVNULL)
+    node_dir = os.path.join(work_dir, 'data', 'nodo1')
+    for part_index in range(1, particiones + 1):
+        with open(os.path.join(node_dir, f"historial_part{part_index}.txt"), 'w', encoding='utf-8') as f:
+            for fila in range(historial):
+                fecha = f"2025-01-{fila % 28 + 1:02d} 10:00:00"
+                f.writelines(f"{fecha}|{id_cuenta}|DEBIT|M:1.00|100.00\n"
+                             for id_cuenta in range(part_index, cuentas + 1, particiones))
+    return node_dir
+
+def pico_memoria_mb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith('VmHWM:'): return int(line.split()[1]) // 1024
+    return 0
+
+def arrancar(work_dir, puerto, args, timeout):
+    """Lanza el worker y espera a que responda; devuelve el proceso y los segundos que tardó."""
+    start = time.perf_counter()
+    worker = subprocess.Popen([sys.executable, WORKER, '--port', str(puerto), '--node-id', '1', '--no-log-consola'] + args,
+                              cwd=work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    while True:
+        try:
+            enviar(f"localhost:{puerto}", "EXECUTE|arranque|STATS", 5.0)
+            return worker, time.perf_counter() - start
+        except OSError:
+            if worker.poll() is not None: raise RuntimeError(f"el worker terminó con código {worker.returncode}")
+            if time.perf_counter() - start > timeout: raise RuntimeError("el worker no respondió a tiempo")
+            time.sleep(0.05)
+
+def detener(worker, sig=signal.SIGTERM):
+    worker.send_signal(sig)
+    worker.wait()
+
+def arqueo(puerto):
+    """Totales de `ARQUEO_CUENTAS|VERIFICAR` en céntimos: partición -> (mantenido, en disco)."""
+    estado, datos = enviar(f"localhost:{puerto}", "EXECUTE|arranque|ARQUEO_CUENTAS|VERIFICAR", 600.0)
+    if estado != 'SUCCESS': raise RuntimeError(datos)
+    filas = [fila.split(',') for fila in datos.split('|')[2:]]
+    return {int(p): (parse_monto(mantenido), parse_monto(disco)) for p, mantenido, disco, _ in filas}
+
+def medir(cuentas, args):
+    with tempfile.TemporaryDirectory() as work_dir:
+        print(f"\n== {cuentas} cuentas ({args.historial} filas de historial por cuenta) ==")
+        start = time.perf_counter()
+        node_dir = generar(work_dir, cuentas, cuentas // 5, args.particiones, args.historial, args.puerto)
+        print(f"Datos generados en {time.perf_counter() - start:.1f} s")
+        worker_args = shlex.split(args.worker_args)
+        print(f"{'caso':<18} {'arranque s':>11} {'memoria MB':>11}")
+
+        def caso(nombre, extra, cambios=0, sig=signal.SIGTERM):
+            """Arranca, hace el arqueo y `cambios` DEBIT de 0.01, y se detiene con `sig`.
+            Devuelve el arqueo y los céntimos debitados en cada partición."""
+            worker, segundos = arrancar(work_dir, args.puerto, worker_args + extra, args.timeout)
+            memoria = pico_memoria_mb(worker.pid)
+            resultado = arqueo(args.puerto)
+            debitado = dict.fromkeys(resultado, 0)
+            for i in range(cambios):
+                id_cuenta = i * 7919 % cuentas + 1
+                estado, _ = enviar(f"localhost:{args.puerto}", f"EXECUTE|arranque{i}|DEBIT|{id_cuenta}|0.01", 30.0)
+                if estado == 'SUCCESS': debitado[(id_cuenta - 1) % args.particiones + 1] += 1
+            detener(worker, sig)
+            print(f"{nombre:<18} {segundos:>11.2f} {memoria:>11}")
+            return resultado, debitado
+
+        def error(mensaje, esperado, obtenido):
+            print(f"ERROR: {mensaje}:\n  esperado {esperado}\n  obtenido {obtenido}")
+            sys.exit(1)
+
+        referencia, _ = caso("sin índices", ['--no-indices'])
+        if glob.glob(os.path.join(node_dir, '*.idx')): raise RuntimeError("--no-indices escribió índices")
+        caso("primer arranque", [])
+        indexado, debitado = caso("con índices", [], cambios=args.cambios, sig=signal.SIGKILL)
+        if indexado != referencia: error("el arqueo con índices difiere del arqueo sin ellos", referencia, indexado)
+        recuperado, _ = caso("tras una caída", [])
+        esperado = {p: (mantenido - debitado[p],) * 2 for p, (mantenido, _) in referencia.items()}
+        if recuperado != esperado: error("el arqueo tras la caída no cuadra (¿índice desactualizado?)", esperado, recuperado)
+        print("OK: el arqueo coincide con y sin índices, y tras la caída con los DEBIT confirmados")
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiempo de arranque del worker con y sin índices guardados.")
+    parser.add_argument("--cuentas", type=int, nargs='+', default=[100000, 1000000], help="Tamaños a medir.")
+    parser.add_argument("--particiones", type=int, default=3)
+    parser.add_argument("--historial", type=int, default=1, help="Filas de historial por cuenta.")
+    parser.add_argument("--cambios", type=int, default=100, help="DEBIT antes de la caída simulada.")
+    parser.add_argument("--puerto", type=int, default=9291)
+    parser.add_argument("--worker-args", default="", help="Opciones extra de worker.py (p. ej. \"--almacenamiento mmap\").")
+    parser.add_argument("--timeout", type=float, default=1800.0, help="Segundos máximos de cada arranque.")
+    args = parser.parse_args()
+    for cuentas in args.cuentas:
+        medir(cuentas, args)
+
+if __name__ == "__main__":
+    main()
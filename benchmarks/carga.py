@@ -0,0 +1,367 @@
+"""Generador de carga y medidor de latencia para el protocolo de los workers.
+
+Habla `EXECUTE|tx_id|...` directamente con uno o más nodos `worker.py` (sin el
+Servidor Central) y mide throughput y latencias p50/p99/p999 por comando.
+
+- Mezcla configurable de comandos, p. ej. `--mezcla CONSULTAR_CUENTA=60,DEBIT=10,CREDIT=10,TRANSFERIR_CUENTA=15,CONSULTAR_HISTORIAL=5`.
+- Sesgo de cuentas calientes con una distribución Zipf (`--zipf 1.1`; 0 = uniforme).
+- Lazo cerrado (`--concurrencia 1 4 16`: N clientes que esperan cada respuesta)
+  o lazo abierto (`--tasa 500 1000`: llegadas de Poisson a la tasa dada, con la
+  latencia medida desde el instante programado para no ocultar colas).
+- Al terminar compara el arqueo final con el inicial más los cambios
+  confirmados (DEBIT, CREDIT y PAGAR_DEUDA mueven dinero; las transferencias no).
+
+Sin `--nodos` genera datos en un directorio temporal y levanta su propio nodo.
+
+Uso:
+    python3 benchmarks/carga.py --duracion 5 --concurrencia 1 4 16 64 --zipf 1.1
+    python3 benchmarks/carga.py --tasa 500 1000 2000 --worker-args "--mode async"
+    python3 benchmarks/carga.py --nodos localhost:9091 localhost:9092 localhost:9093 --datos data/nodo1
+    python3 benchmarks/carga.py --topologia data/topologia.properties --datos data/nodo1
+"""
+import os
+import sys
+import time
+import glob
+import shlex
+import random
+import socket
+import bisect
+import argparse
+import tempfile
+import threading
+import subprocess
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKER = os.path.join(REPO_DIR, 'src', 'worker_nodes', 'worker.py')
+GENERADOR = os.path.join(REPO_DIR, 'src', 'clients', 'generador_datos.py')
+sys.path.insert(0, os.path.join(REPO_DIR, 'src', 'worker_nodes'))
+
+from topologia import ARCHIVO, Topologia
+
+NUM_PARTICIONES = 3 # Lo reemplaza el de la topología
+
+MEZCLA_DEFECTO = "CONSULTAR_CUENTA=50,DEBIT=10,CREDIT=10,TRANSFERIR_CUENTA=20,CONSULTAR_HISTORIAL=5,PAGAR_DEUDA=5"
+# Comandos cuyo efecto en el total de saldos hay que contabilizar
+MUEVEN_DINERO = {"DEBIT", "CREDIT", "PAGAR_DEUDA"}
+
+def particion_de(id_cuenta):
+    return (int(id_cuenta) - 1) % NUM_PARTICIONES + 1
+
+def wait_for_port(port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('localhost', port)).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"El worker no abrió el puerto {port}")
+
+class Connection:
+    """Conexión a un nodo: una por petición o persistente (requiere `--mode async` en el worker)."""
+
+    def __init__(self, address, persistente):
+        self.address = address
+        self.persistente = persistente
+        self.sock = None
+        self.reader = None
+
+    def send(self, request):
+        if not self.persistente:
+            with socket.create_connection(self.address) as sock:
+                sock.sendall((request + '\n').encode('utf-8'))
+                return sock.makefile('rb').readline().decode('utf-8').strip()
+        if self.sock is None:
+            self.sock = socket.create_connection(self.address)
+            self.reader = self.sock.makefile('rb')
+        try:
+            self.sock.sendall((request + '\n').encode('utf-8'))
+            line = self.reader.readline()
+            if not line: raise ConnectionError("El nodo cerró la conexión")
+            return line.decode('utf-8').strip()
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = self.reader = None
+
+class Cluster:
+    """Enruta cada petición al nodo de la partición de su cuenta: el primario según
+    `primarios` (partición -> nodo) o, sin ella, el nodo k para la partición k."""
+
+    def __init__(self, nodos, persistente, primarios=None):
+        self.nodos = nodos
+        self.persistente = persistente
+        self.primarios = primarios
+        self.local = threading.local()
+
+    def node_for(self, part_index):
+        if self.primarios: return self.primarios[part_index]
+        return self.nodos[(part_index - 1) % len(self.nodos)]
+
+    def send(self, part_index, request):
+        conns = getattr(self.local, 'conns', None)
+        if conns is None:
+            conns = self.local.conns = {}
+        address = self.node_for(part_index)
+        conn = conns.get(address)
+        if conn is None:
+            conn = conns[address] = Connection(address, self.persistente)
+        return conn.send(request)
+
+    def arqueo(self):
+        total = Decimal('0.00')
+        for part_index in range(1, NUM_PARTICIONES + 1):
+            result = self.send(part_index, f"EXECUTE|arqueo{part_index}|ARQUEO_CUENTAS|{part_index}")
+            parts = result.split('|')
+            if len(parts) < 4 or parts[2] != 'SUCCESS':
+                raise RuntimeError(f"Arqueo de la partición {part_index} fallido: {result}")
+            total += Decimal(parts[3])
+        return total
+
+class Zipf:
+    """Muestreo de cuentas 1..n con probabilidad proporcional a 1/rango^s (s=0: uniforme)."""
+
+    def __init__(self, n, s, rng):
+        self.n = n
+        self.rng = rng
+        self.cdf = None
+        if s > 0:
+            weights = [1.0 / (k ** s) for k in range(1, n + 1)]
+            total, acc, self.cdf = sum(weights), 0.0, []
+            for w in weights:
+                acc += w
+                self.cdf.append(acc / total)
+            # Las cuentas calientes quedan repartidas entre las particiones
+            self.ids = list(range(1, n + 1))
+            rng.shuffle(self.ids)
+
+    def sample(self):
+        if self.cdf is None:
+            return self.rng.randint(1, self.n)
+        return self.ids[min(bisect.bisect_left(self.cdf, self.rng.random()), self.n - 1)]
+
+def load_prestamos(datos_dir):
+    """Préstamos activos `(id_cuenta, id_prestamo)` leídos de los `prestamos_partN.txt`."""
+    prestamos = []
+    for file_path in sorted(glob.glob(os.path.join(datos_dir, 'prestamos_part*.txt'))):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                campos = line.strip().split(',')
+                if len(campos) >= 5 and campos[4] == 'Activo' and campos[1].startswith('cliente_'):
+                    prestamos.append((campos[1][len('cliente_'):], campos[0]))
+    return prestamos
+
+class Workload:
+    """Genera las peticiones de la mezcla y contabiliza el dinero que entra y sale."""
+
+    def __init__(self, mezcla, cuentas, zipf, prestamos, seed):
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.zipf = Zipf(cuentas, zipf, self.rng)
+        self.cuentas = cuentas
+        self.prestamos = prestamos
+        self.commands = list(mezcla)
+        self.cum_weights = []
+        acc = 0
+        for command in self.commands:
+            acc += mezcla[command]
+            self.cum_weights.append(acc)
+        self.delta = Decimal('0.00')  # Cambio esperado del total por operaciones confirmadas
+        self.inciertas = 0            # Operaciones que mueven dinero sin respuesta conocida
+        self.seq = 0
+
+    def next(self):
+        """Devuelve `(comando, partición, petición)`."""
+        with self.lock:
+            self.seq += 1
+            command = self.rng.choices(self.commands, cum_weights=self.cum_weights)[0]
+            id_cuenta = self.zipf.sample()
+            tx_id = f"c{self.seq}"
+            if command == "TRANSFERIR_CUENTA":
+                # Destino aleatorio de la misma partición (el worker no transfiere entre particiones)
+                destino = id_cuenta
+                while destino == id_cuenta:
+                    destino = self.rng.randrange(particion_de(id_cuenta), self.cuentas + 1, NUM_PARTICIONES)
+                query = f"TRANSFERIR_CUENTA|{id_cuenta}|{destino}|1.00"
+            elif command == "PAGAR_DEUDA":
+                id_cuenta, id_prestamo = self.rng.choice(self.prestamos)
+                query = f"PAGAR_DEUDA|{id_cuenta}|{id_prestamo}|1.00"
+            elif command in ("DEBIT", "CREDIT"):
+                query = f"{command}|{id_cuenta}|1.00"
+            elif command == "CONSULTAR_HISTORIAL":
+                query = f"CONSULTAR_HISTORIAL|{id_cuenta}|20"
+            else:
+                query = f"{command}|{id_cuenta}"
+        return command, particion_de(id_cuenta), f"EXECUTE|{tx_id}|{query}"
+
+    def record(self, command, result):
+        """Contabiliza el efecto de una respuesta; devuelve si la operación tuvo éxito."""
+        ok = result is not None and '|SUCCESS|' in result
+        if command not in MUEVEN_DINERO: return ok
+        with self.lock:
+            if result is None:
+                self.inciertas += 1
+            elif ok and command == "CREDIT":
+                self.delta += Decimal('1.00')
+            elif ok and command == "DEBIT":
+                self.delta -= Decimal('1.00')
+            elif ok and command == "PAGAR_DEUDA" and 'ya ha sido cancelada' not in result:
+                # Si el pago salda la deuda se devuelve el exceso a la cuenta
+                vuelto = Decimal(result.split('Se devolvió ')[1].split(' ')[0]) if 'Se devolvió ' in result else Decimal('0.00')
+                self.delta -= Decimal('1.00') - vuelto
+        return ok
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencias = {} # comando -> [segundos]
+        self.errores = {}   # comando -> número de respuestas no SUCCESS
+
+    def add(self, command, latencia, ok):
+        with self.lock:
+            self.latencias.setdefault(command, []).append(latencia)
+            if not ok: self.errores[command] = self.errores.get(command, 0) + 1
+
+def percentil(sorted_values, p):
+    if not sorted_values: return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+def execute(cluster, workload, stats, command, part_index, request, inicio):
+    try:
+        result = cluster.send(part_index, request)
+    except OSError:
+        result = None
+    ok = workload.record(command, result)
+    stats.add(command, time.perf_counter() - inicio, ok)
+
+def run_closed(cluster, workload, concurrencia, duracion):
+    stats = Stats()
+    stop = time.perf_counter() + duracion
+
+    def client():
+        while time.perf_counter() < stop:
+            command, part_index, request = workload.next()
+            execute(cluster, workload, stats, command, part_index, request, time.perf_counter())
+
+    threads = [threading.Thread(target=client) for _ in range(concurrencia)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return stats
+
+def run_open(cluster, workload, tasa, duracion, max_hilos):
+    stats = Stats()
+    rng = random.Random(tasa)
+    with ThreadPoolExecutor(max_workers=max_hilos) as executor:
+        inicio = time.perf_counter()
+        programado = inicio
+        while programado < inicio + duracion:
+            programado += rng.expovariate(tasa)
+            espera = programado - time.perf_counter()
+            if espera > 0: time.sleep(espera)
+            command, part_index, request = workload.next()
+            # La latencia cuenta desde el instante programado, incluida la espera en la cola
+            executor.submit(execute, cluster, workload, stats, command, part_index, request, programado)
+    return stats
+
+def report(nivel, stats, duracion):
+    total = sum(len(v) for v in stats.latencias.values())
+    print(f"\n== {nivel}: {total / duracion:.1f} ops/s, {sum(stats.errores.values())} errores")
+    print(f"{'comando':<22} {'ops':>8} {'errores':>8} {'p50 ms':>9} {'p99 ms':>9} {'p999 ms':>9}")
+    for command in sorted(stats.latencias):
+        values = sorted(stats.latencias[command])
+        print(f"{command:<22} {len(values):>8} {stats.errores.get(command, 0):>8} "
+              f"{percentil(values, 0.50) * 1000:>9.2f} {percentil(values, 0.99) * 1000:>9.2f} {percentil(values, 0.999) * 1000:>9.2f}")
+
+def parse_mezcla(texto):
+    mezcla = {}
+    for item in texto.split(','):
+        command, _, peso = item.partition('=')
+        mezcla[command.strip()] = float(peso)
+    return mezcla
+
+def parse_nodo(texto):
+    host, _, port = texto.rpartition(':')
+    return (host or 'localhost', int(port))
+
+def main():
+    parser = argparse.ArgumentParser(description="Generador de carga para los nodos trabajadores.")
+    parser.add_argument("--nodos", nargs='+', help="host:puerto de los nodos; el k-ésimo atiende la partición k. Sin esta opción se levanta un nodo propio.")
+    parser.add_argument("--topologia", help="Archivo de topología: número de particiones y primario de cada una (en lugar de --nodos).")
+    parser.add_argument("--datos", help="Directorio de un nodo para leer los préstamos (PAGAR_DEUDA) con --nodos o --topologia.")
+    parser.add_argument("--port", type=int, default=9391, help="Puerto del nodo propio.")
+    parser.add_argument("--worker-args", default="", help="Opciones extra para el nodo propio, p. ej. \"--mode async --durabilidad wal\".")
+    parser.add_argument("--mezcla", default=MEZCLA_DEFECTO, help="Pesos por comando: CMD=peso,CMD=peso,...")
+    parser.add_argument("--cuentas", type=int, default=10000, help="Número de cuentas (ids 1..N); también las que se generan para el nodo propio.")
+    parser.add_argument("--zipf", type=float, default=0.0, help="Exponente Zipf de las cuentas calientes (0 = uniforme).")
+    parser.add_argument("--concurrencia", type=int, nargs='+', default=[1, 4, 16], help="Niveles de clientes en lazo cerrado.")
+    parser.add_argument("--tasa", type=float, nargs='+', help="Tasas (peticiones/s) en lazo abierto; reemplaza a --concurrencia.")
+    parser.add_argument("--max-hilos", type=int, default=256, help="Peticiones simultáneas como máximo en lazo abierto.")
+    parser.add_argument("--duracion", type=float, default=5.0, help="Segundos por nivel.")
+    parser.add_argument("--persistente", action="store_true", help="Reutilizar conexiones (nodos con --mode async).")
+    parser.add_argument("--seed", type=int, default=1, help="Semilla de la carga y de los datos del nodo propio.")
+    args = parser.parse_args()
+
+    global NUM_PARTICIONES
+    with tempfile.TemporaryDirectory() as work_dir:
+        worker, primarios = None, None
+        if args.topologia:
+            topologia = Topologia.cargar(args.topologia)
+            NUM_PARTICIONES = topologia.particiones
+            primarios = {p: parse_nodo(topologia.nodos[topologia.primario(p)]) for p in topologia.ubicacion}
+            nodos = sorted(set(primarios.values()))
+            datos_dir = args.datos
+        elif args.nodos:
+            nodos = [parse_nodo(nodo) for nodo in args.nodos]
+            datos_dir = args.datos
+        else:
+            subprocess.run([sys.executable, GENERADOR, '--cuentas', str(args.cuentas), '--seed', str(args.seed)],
+                           cwd=work_dir, check=True, stdout=subprocess.DEVNULL)
+            NUM_PARTICIONES = Topologia.cargar(os.path.join(work_dir, 'data', ARCHIVO)).particiones
+            worker = subprocess.Popen([sys.executable, WORKER, '--port', str(args.port), '--node-id', '1'] + shlex.split(args.worker_args),
+                                      cwd=work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            nodos = [('localhost', args.port)]
+            datos_dir = os.path.join(work_dir, 'data', 'nodo1')
+        try:
+            if worker is not None: wait_for_port(args.port)
+            mezcla = parse_mezcla(args.mezcla)
+            prestamos = load_prestamos(datos_dir) if datos_dir else []
+            if mezcla.get("PAGAR_DEUDA") and not prestamos:
+                print("AVISO: sin préstamos activos conocidos (use --datos); se omite PAGAR_DEUDA")
+                mezcla.pop("PAGAR_DEUDA")
+            cluster = Cluster(nodos, args.persistente, primarios)
+            workload = Workload(mezcla, args.cuentas, args.zipf, prestamos, args.seed)
+
+            total_inicial = cluster.arqueo()
+            niveles = [('tasa', t) for t in args.tasa] if args.tasa else [('clientes', c) for c in args.concurrencia]
+            for tipo, valor in niveles:
+                if tipo == 'tasa':
+                    stats = run_open(cluster, workload, valor, args.duracion, args.max_hilos)
+                else:
+                    stats = run_closed(cluster, workload, valor, args.duracion)
+                report(f"{tipo} {valor:g}", stats, args.duracion)
+
+            total_final = cluster.arqueo()
+            esperado = total_inicial + workload.delta
+            print(f"\nArqueo inicial {total_inicial:.2f}, cambios confirmados {workload.delta:+.2f}, "
+                  f"esperado {esperado:.2f}, final {total_final:.2f}")
+            if total_final == esperado:
+                print("OK: el total de saldos es consistente")
+            elif workload.inciertas:
+                print(f"AVISO: diferencia {total_final - esperado:+.2f} con {workload.inciertas} operaciones sin respuesta")
+            else:
+                print(f"ERROR: el total de saldos difiere en {total_final - esperado:+.2f}")
+                sys.exit(1)
+        finally:
+            if worker is not None:
+                worker.terminate()
+                worker.wait()
+
+if __name__ == "__main__":
+    main()
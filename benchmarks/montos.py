@@ -0,0 +1,191 @@
+"""Micro-benchmark de la aritmética de montos del worker: céntimos enteros frente a Decimal.
+
+Compara, en el mismo proceso y sin red ni disco en el camino medido:
+
+- El camino caliente de DEBIT y de PAGAR_DEUDA: interpretar el monto del
+  protocolo, calcular los saldos nuevos y formatear lo que se escribe y se responde.
+- El arqueo de una partición completa: interpretar cada línea de
+  `cuentas_partN.txt` y sumar los saldos (como `ARQUEO_CUENTAS|VERIFICAR`),
+  y la suma de los saldos ya cargados en memoria.
+
+La versión `Decimal` reproduce el código anterior (`Decimal(...).quantize` en
+cada paso y `f"{x:.2f}"` al formatear); la de céntimos usa `montos.py`. Antes
+de medir se comprueba que ambas dan los mismos resultados.
+
+Uso:
+    python3 benchmarks/montos.py --cuentas 300000 --repeticiones 5
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+from decimal import Decimal, getcontext
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENERADOR = os.path.join(REPO_DIR, 'src', 'clients', 'generador_datos.py')
+sys.path.insert(0, os.path.join(REPO_DIR, 'src', 'worker_nodes'))
+
+from montos import parse_monto, format_monto
+
+getcontext().prec = 12 # Como el worker antes de usar céntimos
+TWO_PLACES = Decimal('0.01')
+
+# --- Camino caliente de DEBIT y PAGAR_DEUDA ---
+# Mismos pasos que handle_query: interpretar el monto, comparar, calcular los
+# saldos nuevos y formatear el detalle y el saldo del historial, la línea de la
+# cuenta (format_cuenta), la operación del WAL y la respuesta. Con céntimos el
+# monto se formatea una vez y el historial reutiliza el saldo del WAL (el texto
+# que devuelve store.commit).
+
+def debit_decimal(saldos, montos):
+    salida = None
+    for i, monto_str in enumerate(montos):
+        monto = Decimal(monto_str).quantize(TWO_PLACES)
+        saldo = saldos[i % len(saldos)]
+        if saldo < monto:
+            salida = (f"M:{monto}", f"{saldo:.2f}")
+            continue
+        nuevo_saldo = (saldo - monto).quantize(TWO_PLACES)
+        saldos[i % len(saldos)] = nuevo_saldo
+        salida = (f"{i},cliente_{i},{nuevo_saldo:.2f},2024-01-01\n", f"{nuevo_saldo:.2f}",
+                  f"M:{monto}", f"{nuevo_saldo:.2f}", f"SUCCESS|Débito de {monto:.2f} completado")
+    return salida
+
+def debit_centimos(saldos, montos):
+    salida = None
+    for i, monto_str in enumerate(montos):
+        monto = parse_monto(monto_str)
+        monto_txt = format_monto(monto)
+        saldo = saldos[i % len(saldos)]
+        if saldo < monto:
+            salida = (f"M:{monto_txt}", format_monto(saldo))
+            continue
+        nuevo_saldo = saldo - monto
+        saldos[i % len(saldos)] = nuevo_saldo
+        saldo_txt = format_monto(nuevo_saldo)
+        salida = (f"{i},cliente_{i},{format_monto(nuevo_saldo)},2024-01-01\n", saldo_txt,
+                  f"M:{monto_txt}", saldo_txt, f"SUCCESS|Débito de {monto_txt} completado")
+    return salida
+
+def pago_decimal(saldos, montos):
+    salida = None
+    for i, monto_str in enumerate(montos):
+        monto_pago = Decimal(monto_str).quantize(TWO_PLACES)
+        monto_total, monto_ya_pagado = saldos[i % len(saldos)], saldos[(i + 1) % len(saldos)]
+        deuda_restante = (monto_total - monto_ya_pagado).quantize(TWO_PLACES)
+        nuevo_saldo = (monto_total - monto_pago).quantize(TWO_PLACES)
+        if monto_pago >= deuda_restante:
+            vuelto = (monto_pago - deuda_restante).quantize(TWO_PLACES)
+            nuevo_saldo = (nuevo_saldo + vuelto).quantize(TWO_PLACES)
+            salida = f"SUCCESS|Se devolvió {vuelto:.2f}|{nuevo_saldo:.2f}"
+        else:
+            nuevo_monto_pagado = (monto_ya_pagado + monto_pago).quantize(TWO_PLACES)
+            deuda_actualizada = (deuda_restante - monto_pago).quantize(TWO_PLACES)
+            salida = f"SUCCESS|Pago de {monto_pago:.2f}, deuda {deuda_actualizada:.2f}|{nuevo_monto_pagado:.2f}|{nuevo_saldo:.2f}"
+    return salida
+
+def pago_centimos(saldos, montos):
+    salida = None
+    for i, monto_str in enumerate(montos):
+        monto_pago = parse_monto(monto_str)
+        monto_total, monto_ya_pagado = saldos[i % len(saldos)], saldos[(i + 1) % len(saldos)]
+        deuda_restante = monto_total - monto_ya_pagado
+        nuevo_saldo = monto_total - monto_pago
+        if monto_pago >= deuda_restante:
+            vuelto = monto_pago - deuda_restante
+            nuevo_saldo = nuevo_saldo + vuelto
+            salida = f"SUCCESS|Se devolvió {format_monto(vuelto)}|{format_monto(nuevo_saldo)}"
+        else:
+            nuevo_monto_pagado = monto_ya_pagado + monto_pago
+            deuda_actualizada = deuda_restante - monto_pago
+            salida = (f"SUCCESS|Pago de {format_monto(monto_pago)}, deuda {format_monto(deuda_actualizada)}|"
+                      f"{format_monto(nuevo_monto_pagado)}|{format_monto(nuevo_saldo)}")
+    return salida
+
+# --- Arqueo de una partición ---
+
+def arqueo_archivo_decimal(file_path):
+    total = Decimal('0.00')
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            total += Decimal(line.strip().split(',')[2]).quantize(TWO_PLACES)
+    return total.quantize(TWO_PLACES)
+
+def arqueo_archivo_centimos(file_path):
+    total = 0
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            total += parse_monto(line.strip().split(',')[2])
+    return total
+
+def arqueo_memoria_decimal(saldos):
+    total = Decimal('0.00')
+    for saldo in saldos:
+        total += saldo
+    return total.quantize(TWO_PLACES)
+
+def arqueo_memoria_centimos(saldos):
+    return sum(saldos)
+
+def medir(fn, *args, repeticiones):
+    """Mejor tiempo de `repeticiones` ejecuciones (cada una con copias frescas de las listas)."""
+    mejor = float('inf')
+    for _ in range(repeticiones):
+        copia = [list(a) if isinstance(a, list) else a for a in args]
+        start = time.perf_counter()
+        fn(*copia)
+        mejor = min(mejor, time.perf_counter() - start)
+    return mejor
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark de montos en céntimos frente a Decimal.")
+    parser.add_argument("--cuentas", type=int, default=300000, help="Cuentas generadas (el arqueo usa la partición 1).")
+    parser.add_argument("--operaciones", type=int, default=200000, help="Operaciones del camino caliente.")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    montos = [f"{rng.uniform(1, 500):.2f}" if k % 4 else str(rng.randint(1, 500)) for k in range(args.operaciones)]
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        subprocess.run([sys.executable, GENERADOR, '--cuentas', str(args.cuentas), '--prestamos', '0',
+                        '--transacciones', '0', '--seed', str(args.seed)],
+                       cwd=work_dir, check=True, stdout=subprocess.DEVNULL)
+        file_path = os.path.join(work_dir, 'data', 'nodo1', 'cuentas_part1.txt')
+        with open(file_path, 'r', encoding='utf-8') as f:
+            textos = [line.split(',')[2] for line in f]
+        saldos_decimal = [Decimal(t).quantize(TWO_PLACES) for t in textos]
+        saldos_centimos = [parse_monto(t) for t in textos]
+
+        # Mismos resultados antes de comparar tiempos
+        for fn_decimal, fn_centimos in ((debit_decimal, debit_centimos), (pago_decimal, pago_centimos)):
+            salida_decimal = fn_decimal(list(saldos_decimal), montos)
+            salida_centimos = fn_centimos(list(saldos_centimos), montos)
+            assert salida_decimal == salida_centimos, (salida_decimal, salida_centimos)
+        total = arqueo_archivo_decimal(file_path)
+        assert f"{total:.2f}" == format_monto(arqueo_archivo_centimos(file_path))
+        assert f"{arqueo_memoria_decimal(saldos_decimal):.2f}" == format_monto(arqueo_memoria_centimos(saldos_centimos))
+
+        casos = [
+            (f"DEBIT x{args.operaciones}", debit_decimal, (saldos_decimal, montos),
+             debit_centimos, (saldos_centimos, montos)),
+            (f"PAGAR_DEUDA x{args.operaciones}", pago_decimal, (saldos_decimal, montos),
+             pago_centimos, (saldos_centimos, montos)),
+            (f"arqueo archivo ({len(textos)} cuentas)", arqueo_archivo_decimal, (file_path,),
+             arqueo_archivo_centimos, (file_path,)),
+            (f"arqueo memoria ({len(textos)} cuentas)", arqueo_memoria_decimal, (saldos_decimal,),
+             arqueo_memoria_centimos, (saldos_centimos,)),
+        ]
+        print(f"{'caso':<34} {'Decimal ms':>11} {'céntimos ms':>12} {'speedup':>8}")
+        for nombre, fn_decimal, args_decimal, fn_centimos, args_centimos in casos:
+            t_decimal = medir(fn_decimal, *args_decimal, repeticiones=args.repeticiones)
+            t_centimos = medir(fn_centimos, *args_centimos, repeticiones=args.repeticiones)
+            print(f"{nombre:<34} {t_decimal * 1e3:>11.1f} {t_centimos * 1e3:>12.1f} {t_decimal / t_centimos:>8.2f}")
+        print(f"Total de la partición: {format_monto(arqueo_archivo_centimos(file_path))}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Prueba de estrés de concurrencia del worker sobre cuentas no relacionadas.
+
+Genera un conjunto de datos en un directorio temporal, levanta un nodo
+trabajador y mide cuántas operaciones por segundo atiende a medida que crece
+el número de clientes concurrentes. Cada cliente trabaja sobre su propia cuenta,
+así que con bloqueos por cuenta el throughput debe crecer con la concurrencia
+en vez de quedar fijo como con un único bloqueo global.
+
+Uso:
+    python3 benchmarks/stress_locks.py --duracion 5 --concurrencia 1 2 4 8 16
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKER = os.path.join(REPO_DIR, 'src', 'worker_nodes', 'worker.py')
+GENERADOR = os.path.join(REPO_DIR, 'src', 'clients', 'generador_datos.py')
+
+def send(port, request):
+    with socket.create_connection(('localhost', port)) as sock:
+        sock.sendall((request + '\n').encode('utf-8'))
+        data = b''
+        while not data.endswith(b'\n'):
+            chunk = sock.recv(65536)
+            if not chunk: break
+            data += chunk
+    return data.decode('utf-8').strip()
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('localhost', port)).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"El worker no abrió el puerto {port}")
+
+def run_level(port, concurrencia, duracion):
+    counts = [0] * concurrencia
+    errors = [0] * concurrencia
+    stop = time.time() + duracion
+
+    def client(k):
+        id_cuenta = k + 1 # Cuentas distintas y repartidas entre las particiones
+        ops = [f"CONSULTAR_CUENTA|{id_cuenta}", f"CREDIT|{id_cuenta}|1.00", f"DEBIT|{id_cuenta}|1.00"]
+        i = 0
+        while time.time() < stop:
+            result = send(port, f"EXECUTE|s{k}-{i}|{ops[i % len(ops)]}")
+            if '|SUCCESS|' not in result: errors[k] += 1
+            counts[k] += 1
+            i += 1
+
+    threads = [threading.Thread(target=client, args=(k,)) for k in range(concurrencia)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return sum(counts) / duracion, sum(errors)
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de estrés de bloqueos del worker.")
+    parser.add_argument("--port", type=int, default=9391)
+    parser.add_argument("--duracion", type=float, default=5.0, help="Segundos por nivel de concurrencia.")
+    parser.add_argument("--concurrencia", type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument("--durabilidad", choices=["directo", "wal"], default="wal")
+    parser.add_argument("--almacenamiento", choices=["texto", "mmap"], default="texto")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        subprocess.run([sys.executable, GENERADOR], cwd=work_dir, check=True, stdout=subprocess.DEVNULL)
+        worker = subprocess.Popen([sys.executable, WORKER, '--port', str(args.port), '--node-id', '1',
+                                   '--durabilidad', args.durabilidad, '--almacenamiento', args.almacenamiento],
+                                  cwd=work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_port(args.port)
+            base = None
+            print(f"{'clientes':>8} {'ops/s':>10} {'speedup':>8} {'errores':>8}")
+            for concurrencia in args.concurrencia:
+                throughput, errors = run_level(args.port, concurrencia, args.duracion)
+                base = base or throughput
+                print(f"{concurrencia:>8} {throughput:>10.1f} {throughput / base:>8.2f} {errors:>8}")
+        finally:
+            worker.terminate()
+            worker.wait()
+
+if __name__ == "__main__":
+    main()
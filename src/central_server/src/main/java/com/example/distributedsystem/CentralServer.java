@@ -2,30 +2,79 @@ package com.example.distributedsystem;
 
 import java.io.*;
 import java.net.*;
+import java.nio.charset.StandardCharsets;
 import java.util.*;
 import java.util.concurrent.*;
+import java.util.concurrent.atomic.AtomicInteger;
 
 public class CentralServer {
 
     private static final int SERVER_PORT = 8080;
-    private static final int NUM_PARTITIONS = 3;
     private static final ExecutorService clientExecutor = Executors.newCachedThreadPool();
+    // Consultas que admiten servirse desde una réplica (los workers rechazan la lectura si su réplica está atrasada);
+    // son también las únicas que pasan a la réplica cuando el primario no responde
+    private static final Set<String> REPLICA_READS = new HashSet<>(Arrays.asList("CONSULTAR_CUENTA", "CONSULTAR_HISTORIAL", "ESTADO_PAGO_PRESTAMO"));
+    private static volatile boolean readFromReplicas = false;
+    private static final AtomicInteger replicaReadCounter = new AtomicInteger();
+
+    // Mapa de Topología de Datos: PartitionID -> Lista de Nodos (el primero es el primario).
+    // Se lee de data/topologia.properties (lo escriben generador_datos.py y rebalancear.py) y
+    // se vuelve a leer cuando el archivo cambia; se reemplaza entero, nunca se modifica.
+    private static volatile Map<Integer, List<String>> partitionTopology = defaultTopology();
+    private static String topologyFile = "data/topologia.properties";
+    private static long topologyModified = -1;
+
+    // Sin archivo de topología: 3 particiones, el nodo N es primario de PN y réplica de las demás
+    private static Map<Integer, List<String>> defaultTopology() {
+        Map<Integer, List<String>> topology = new HashMap<>();
+        topology.put(1, Arrays.asList("localhost:9091", "localhost:9092", "localhost:9093"));
+        topology.put(2, Arrays.asList("localhost:9092", "localhost:9093", "localhost:9091"));
+        topology.put(3, Arrays.asList("localhost:9093", "localhost:9091", "localhost:9092"));
+        return topology;
+    }
 
-    // Mapa de Topología de Datos: PartitionID -> Lista de Nodos (el primero es el primario)
-    private static final Map<Integer, List<String>> partitionTopology = new ConcurrentHashMap<>();
-
-    static {
-        // Nodo 1: Primario de P1, Réplicas de P2, P3
-        // Nodo 2: Primario de P2, Réplicas de P1, P3
-        // Nodo 3: Primario de P3, Réplicas de P1, P2
-        partitionTopology.put(1, Arrays.asList("localhost:9091", "localhost:9092", "localhost:9093"));
-        partitionTopology.put(2, Arrays.asList("localhost:9092", "localhost:9093", "localhost:9091"));
-        partitionTopology.put(3, Arrays.asList("localhost:9093", "localhost:9091", "localhost:9092"));
+    // Vuelve a leer el archivo de topología si cambió desde la última lectura. Un archivo
+    // inválido se ignora y se mantiene la topología anterior.
+    private static synchronized void refreshTopology() {
+        File file = new File(topologyFile);
+        long modified = file.lastModified(); // 0 si no existe
+        if (modified == topologyModified || modified == 0) return;
+        topologyModified = modified;
+        Properties props = new Properties();
+        try (Reader reader = new InputStreamReader(new FileInputStream(file), StandardCharsets.UTF_8)) {
+            props.load(reader);
+            int partitions = Integer.parseInt(props.getProperty("particiones", "").trim());
+            Map<Integer, List<String>> topology = new HashMap<>();
+            for (int partitionId = 1; partitionId <= partitions; partitionId++) {
+                String nodeIds = props.getProperty("particion." + partitionId);
+                if (nodeIds == null) throw new IllegalArgumentException("falta particion." + partitionId);
+                List<String> nodes = new ArrayList<>();
+                for (String nodeId : nodeIds.split(",")) {
+                    String address = props.getProperty("nodo." + nodeId.trim(), "").trim();
+                    if (address.isEmpty()) throw new IllegalArgumentException("falta la dirección del nodo " + nodeId.trim());
+                    nodes.add(address);
+                }
+                topology.put(partitionId, Collections.unmodifiableList(nodes));
+            }
+            if (topology.isEmpty()) throw new IllegalArgumentException("sin particiones");
+            partitionTopology = topology;
+            System.out.println("[SERVIDOR] Topología v" + props.getProperty("version", "1").trim() + " cargada de "
+                    + topologyFile + ": " + topology);
+        } catch (IOException | RuntimeException e) {
+            System.err.println("[SERVIDOR] Topología inválida en " + topologyFile + ": " + e.getMessage());
+        }
     }
 
     public static void main(String[] args) throws IOException {
+        // --lectura-replica: repartir las lecturas entre el primario y las réplicas de cada partición
+        readFromReplicas = Arrays.asList(args).contains("--lectura-replica");
+        // --topologia ARCHIVO: otro archivo de topología (por defecto data/topologia.properties)
+        int topologyArg = Arrays.asList(args).indexOf("--topologia");
+        if (topologyArg >= 0 && topologyArg + 1 < args.length) topologyFile = args[topologyArg + 1];
+        refreshTopology();
         try (ServerSocket serverSocket = new ServerSocket(SERVER_PORT)) {
-            System.out.println("[SERVIDOR] Servidor Central escuchando en el puerto " + SERVER_PORT);
+            System.out.println("[SERVIDOR] Servidor Central escuchando en el puerto " + SERVER_PORT
+                    + (readFromReplicas ? " (lecturas repartidas entre réplicas)" : ""));
             while (true) {
                 Socket clientSocket = serverSocket.accept();
                 clientExecutor.submit(new ClientHandler(clientSocket));
@@ -59,11 +108,18 @@ public class CentralServer {
         }
     }
 
+    // Misma asignación que los workers y generador_datos.py: la cuenta i va a la partición (i - 1) % N + 1,
+    // con N el número de particiones de la topología
+    private static int partitionOf(int accountId) {
+        return Math.floorMod(accountId - 1, partitionTopology.size()) + 1;
+    }
+
     private static String processRequest(String request) {
         String[] parts = request.split("\\|");
         if (parts.length < 3 || !parts[0].equals("QUERY")) {
             return "RESPONSE|ERROR|Formato de request inválido";
         }
+        refreshTopology();
 
         String queryType = parts[2];
 
@@ -106,7 +162,7 @@ public class CentralServer {
 
             // La lógica de pago se ejecuta en el nodo primario de la cuenta del cliente que paga
             int accountId = Integer.parseInt(idCuentaPago);
-            int partitionId = (accountId % NUM_PARTITIONS) + 1;
+            int partitionId = partitionOf(accountId);
             String primaryNode = partitionTopology.get(partitionId).get(0);
 
             String result = sendToWorker(primaryNode, workerRequest);
@@ -134,12 +190,24 @@ public class CentralServer {
             return "RESPONSE|ERROR|Parámetro de ID de cuenta inválido o faltante.";
         }
 
-        int partitionId = (accountId % NUM_PARTITIONS) + 1;
+        int partitionId = partitionOf(accountId);
         List<String> targetNodes = partitionTopology.get(partitionId);
         if (targetNodes == null) {
             return "RESPONSE|ERROR|No se encontró topología para la partición " + partitionId;
         }
 
+        if (!REPLICA_READS.contains(queryParts[2])) {
+            // Los cambios sólo los acepta el primario: una réplica los rechaza, porque no llegarían
+            // al primario y se perderían al resincronizarse con él. Con el primario caído, fallan.
+            targetNodes = targetNodes.subList(0, 1);
+        } else if (readFromReplicas) {
+            // Empezar por un nodo distinto en cada lectura; si su réplica está atrasada responde
+            // "inaccesible" y se prueba el siguiente, como con un nodo caído
+            List<String> rotated = new ArrayList<>(targetNodes);
+            Collections.rotate(rotated, -Math.floorMod(replicaReadCounter.getAndIncrement(), rotated.size()));
+            targetNodes = rotated;
+        }
+
         String txId = UUID.randomUUID().toString().substring(0, 8);
         String workerRequest = "EXECUTE|" + txId + "|" + String.join("|", Arrays.copyOfRange(queryParts, 2, queryParts.length));
 
@@ -177,8 +245,8 @@ public class CentralServer {
             int idOrigen = Integer.parseInt(idOrigenStr);
             int idDestino = Integer.parseInt(idDestinoStr);
 
-            int origenPartitionId = (idOrigen % NUM_PARTITIONS) + 1;
-            int destinoPartitionId = (idDestino % NUM_PARTITIONS) + 1;
+            int origenPartitionId = partitionOf(idOrigen);
+            int destinoPartitionId = partitionOf(idDestino);
 
             // Si es intra-partición, delegar al worker con el comando original
             if (origenPartitionId == destinoPartitionId) {
@@ -245,41 +313,51 @@ public class CentralServer {
         }
     }
 
-    private static final String[] ALL_WORKER_NODES = {"localhost:9091", "localhost:9092", "localhost:9093"};
-
     private static String handleArqueo(String[] queryParts) {
-        String txId = UUID.randomUUID().toString().substring(0, 8);
-        String workerRequest = "EXECUTE|" + txId + "|ARQUEO_CUENTAS";
-        
+        // Cada partición se suma una sola vez, en el primer nodo de su lista que responda;
+        // sumar el total de cada nodo contaría también todas sus réplicas.
         List<Future<Double>> futures = new ArrayList<>();
-        ExecutorService arqueoExecutor = Executors.newFixedThreadPool(ALL_WORKER_NODES.length);
+        Map<Integer, List<String>> topology = partitionTopology; // La misma durante todo el arqueo
+        ExecutorService arqueoExecutor = Executors.newFixedThreadPool(topology.size());
 
-        for (String nodeAddress : ALL_WORKER_NODES) {
+        for (int partitionId = 1; partitionId <= topology.size(); partitionId++) {
+            final int partition = partitionId;
             Future<Double> future = arqueoExecutor.submit(() -> {
-                try {
-                    String result = sendToWorker(nodeAddress, workerRequest);
-                    String[] resultParts = result.split("\\|"); // RESULT|tx_id|SUCCESS|partial_sum
-                    if (resultParts.length == 4 && resultParts[2].equals("SUCCESS")) {
-                        return Double.parseDouble(resultParts[3]);
+                String workerRequest = "EXECUTE|" + UUID.randomUUID().toString().substring(0, 8) + "|ARQUEO_CUENTAS|" + partition;
+                for (String nodeAddress : topology.get(partition)) {
+                    try {
+                        String result = sendToWorker(nodeAddress, workerRequest);
+                        String[] resultParts = result.split("\\|"); // RESULT|tx_id|SUCCESS|partial_sum
+                        if (resultParts.length == 4 && resultParts[2].equals("SUCCESS")) {
+                            return Double.parseDouble(resultParts[3]);
+                        }
+                    } catch (IOException | NumberFormatException e) {
+                        System.err.println("[ARQUEO] Error con el nodo " + nodeAddress + " para la partición " + partition + ": " + e.getMessage());
                     }
-                } catch (IOException | NumberFormatException e) {
-                    System.err.println("[ARQUEO] Error con el nodo " + nodeAddress + ": " + e.getMessage());
                 }
-                return 0.0; // Retornar 0 si el nodo falla
+                System.err.println("[ARQUEO] Ningún nodo respondió por la partición " + partition);
+                return null; // Sin esa partición el total sería menor que el real
             });
             futures.add(future);
         }
 
         double grandTotal = 0.0;
-        for (Future<Double> future : futures) {
+        List<Integer> missing = new ArrayList<>();
+        for (int i = 0; i < futures.size(); i++) {
+            Double partial = null;
             try {
-                grandTotal += future.get();
+                partial = futures.get(i).get();
             } catch (InterruptedException | ExecutionException e) {
                 System.err.println("[ARQUEO] Error obteniendo futuro: " + e.getMessage());
             }
+            if (partial == null) missing.add(i + 1);
+            else grandTotal += partial;
         }
         arqueoExecutor.shutdown();
 
+        if (!missing.isEmpty()) {
+            return "RESPONSE|ERROR|Arqueo incompleto: ningún nodo respondió por las particiones " + missing;
+        }
         return "RESPONSE|SUCCESS|Arqueo total de cuentas: " + String.format("%.2f", grandTotal);
     }
 
@@ -1,7 +1,14 @@
 import os
+import sys
+import errno
 import random
+import argparse
 import datetime
 import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'worker_nodes'))
+from topologia import ARCHIVO, Topologia
 
 NUM_CUENTAS = 10000
 NUM_PRESTAMOS = 5000
@@ -9,89 +16,186 @@ NUM_TRANSACCIONES = 20000
 NUM_PARTICIONES = 3
 NUM_NODOS = 3
 DATA_DIR = 'data'
+HOST = 'localhost'
+PUERTO_BASE = 9091 # El nodo k escucha en PUERTO_BASE + k - 1
 
-def generar_datos():
-    # Limpiar y crear directorio de datos principal
-    if os.path.exists(DATA_DIR):
-        shutil.rmtree(DATA_DIR)
-    os.makedirs(DATA_DIR)
-
-    print("Generando datos base...")
-    # --- Generar Datos en Memoria ---
-    cuentas = [f"{i},{f'cliente_{i}'},{round(random.uniform(0.0, 10000.0), 2)},{(datetime.date(2020, 1, 1) + datetime.timedelta(days=random.randint(0, 1825))).strftime('%Y-%m-%d')}" for i in range(1, NUM_CUENTAS + 1)]
-    prestamos = []
-    today = datetime.date.today()
-    for i in range(1, NUM_PRESTAMOS + 1):
-        cliente_id = f'cliente_{random.randint(1, NUM_CUENTAS)}'
-        monto_total = round(random.uniform(500.0, 20000.0), 2)
-        
-        # Decidir aleatoriamente si el préstamo estará total o parcialmente pagado
-        if random.random() < 0.3: # 30% de probabilidad de que esté cancelado
-            monto_pagado = monto_total
-        else:
-            # Pagar un monto aleatorio, asegurando que no sea el total
-            monto_pagado = round(random.uniform(0, monto_total * 0.9), 2)
-
-        # Generar una fecha límite aleatoria
-        # Asegurar que algunas fechas ya hayan pasado para tener préstamos vencidos
-        if random.random() < 0.3: # 30% de probabilidad de que la fecha haya vencido
-             fecha_limite_dt = datetime.date.today() - datetime.timedelta(days=random.randint(1, 365))
-        else:
-            fecha_limite_dt = datetime.date.today() + datetime.timedelta(days=random.randint(0, 730))
-
-        fecha_limite_str = fecha_limite_dt.strftime('%Y-%m-%d')
-
-        status = ''
-        if monto_total - monto_pagado <= 0.01: # Usar una pequeña tolerancia para punto flotante
-            status = 'Cancelado'
-            monto_pagado = monto_total
-        else:
-            if fecha_limite_dt >= today:
-                status = 'Activo'
+FILAS_POR_BLOQUE = 200000 # Filas de cada tarea del pool; no depende del número de procesos
+BUFFER_ESCRITURA = 1 << 20
+FICLONE = 0x40049409      # ioctl de Linux para clonar un archivo (reflink) en btrfs/XFS
+
+# --- Generación de filas ---
+# Cada bloque usa su propio generador aleatorio, sembrado con (semilla, tabla, bloque):
+# con --seed el resultado es idéntico con cualquier número de procesos.
+
+def fila_cuenta(i, rng):
+    fecha = (datetime.date(2020, 1, 1) + datetime.timedelta(days=rng.randint(0, 1825))).strftime('%Y-%m-%d')
+    return f"{i},cliente_{i},{round(rng.uniform(0.0, 10000.0), 2)},{fecha}"
+
+def fila_prestamo(i, rng, hoy, num_cuentas):
+    """Fila del préstamo `i` y el id de la cuenta de su cliente."""
+    id_cliente = rng.randint(1, num_cuentas)
+    cliente_id = f'cliente_{id_cliente}'
+    monto_total = round(rng.uniform(500.0, 20000.0), 2)
+
+    # Decidir aleatoriamente si el préstamo estará total o parcialmente pagado
+    if rng.random() < 0.3: # 30% de probabilidad de que esté cancelado
+        monto_pagado = monto_total
+    else:
+        # Pagar un monto aleatorio, asegurando que no sea el total
+        monto_pagado = round(rng.uniform(0, monto_total * 0.9), 2)
+
+    # Asegurar que algunas fechas ya hayan pasado para tener préstamos vencidos
+    if rng.random() < 0.3: # 30% de probabilidad de que la fecha haya vencido
+        fecha_limite_dt = hoy - datetime.timedelta(days=rng.randint(1, 365))
+    else:
+        fecha_limite_dt = hoy + datetime.timedelta(days=rng.randint(0, 730))
+
+    if monto_total - monto_pagado <= 0.01: # Usar una pequeña tolerancia para punto flotante
+        status = 'Cancelado'
+        monto_pagado = monto_total
+    elif fecha_limite_dt >= hoy:
+        status = 'Activo'
+    else:
+        status = 'Vencido'
+    return f"{i},{cliente_id},{monto_total},{monto_pagado},{status},{fecha_limite_dt.strftime('%Y-%m-%d')}", id_cliente
+
+def fila_transaccion(i, rng, hoy, num_cuentas):
+    ahora = datetime.datetime.combine(hoy, datetime.time())
+    fecha = (ahora - datetime.timedelta(days=rng.randint(0, 365))).strftime('%Y-%m-%d %H:%M:%S')
+    return f"{i},{rng.randint(1, num_cuentas)},{rng.choice(['Deposito', 'Retiro', 'Transferencia'])},{round(rng.uniform(10.0, 1000.0), 2)},{fecha}"
+
+def generar_bloque(tabla, inicio, fin, config):
+    """Genera las filas `inicio..fin` de una tabla en un archivo temporal por partición."""
+    seed = config['seed']
+    rng = random.Random(f"{seed}:{tabla}:{inicio}") if seed is not None else random.Random()
+    hoy = config['hoy']
+    particiones = config['particiones']
+    rutas = [bloque_path(config['temp_dir'], tabla, p, inicio) for p in range(1, particiones + 1)]
+    archivos = [open(ruta, 'w', encoding='utf-8', buffering=BUFFER_ESCRITURA) for ruta in rutas]
+    try:
+        for i in range(inicio, fin + 1):
+            # La fila i va a la partición (i - 1) % particiones + 1, como las cuentas en los workers,
+            # salvo los préstamos, que van con la cuenta de su cliente (ver particion_de_cliente)
+            id_particion = i
+            if tabla == 'cuentas':
+                linea = fila_cuenta(i, rng)
+            elif tabla == 'prestamos':
+                linea, id_particion = fila_prestamo(i, rng, hoy, config['cuentas'])
             else:
-                status = 'Vencido'
-        
-        prestamo = f"{i},{cliente_id},{monto_total},{monto_pagado},{status},{fecha_limite_str}"
-        prestamos.append(prestamo)
-    transacciones = [f"{i},{random.randint(1, NUM_CUENTAS)},{random.choice(['Deposito', 'Retiro', 'Transferencia'])},{round(random.uniform(10.0, 1000.0), 2)},{(datetime.datetime.now() - datetime.timedelta(days=random.randint(0, 365))).strftime('%Y-%m-%d %H:%M:%S')}" for i in range(1, NUM_TRANSACCIONES + 1)]
-
-    tablas = {
-        'cuentas': cuentas,
-        'prestamos': prestamos,
-        'transacciones': transacciones
-    }
-
-    # --- Crear Particiones Temporales ---
-    temp_partition_dir = os.path.join(DATA_DIR, 'temp_partitions')
-    os.makedirs(temp_partition_dir)
-
-    for nombre_tabla, datos in tablas.items():
-        for i, linea in enumerate(datos):
-            particion_index = (i % NUM_PARTICIONES) + 1
-            file_path = os.path.join(temp_partition_dir, f"{nombre_tabla}_part{particion_index}.txt")
-            with open(file_path, 'a', encoding='utf-8') as f:
-                f.write(linea + '\n')
-    
+                linea = fila_transaccion(i, rng, hoy, config['cuentas'])
+            archivos[(id_particion - 1) % particiones].write(linea + '\n')
+    finally:
+        for f in archivos: f.close()
+    return tabla, inicio
+
+def bloque_path(temp_dir, tabla, particion, inicio):
+    return os.path.join(temp_dir, f"{tabla}_part{particion}.{inicio:012d}")
+
+# --- Réplicas ---
+
+def colocar_replica(src_path, dst_path):
+    """Copia sin duplicar datos cuando el sistema de archivos lo permite: reflink, luego hardlink, luego copia.
+
+    Un hardlink es seguro porque los workers nunca modifican un `.txt` en su
+    sitio: siempre escriben un temporal y lo renombran.
+    """
+    try:
+        import fcntl
+        with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return 'reflink'
+    except (ImportError, OSError):
+        if os.path.exists(dst_path): os.remove(dst_path)
+    try:
+        os.link(src_path, dst_path)
+        return 'hardlink'
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP): raise
+    shutil.copyfile(src_path, dst_path)
+    return 'copia'
+
+# --- Orquestación ---
+
+def generar_datos(cuentas=NUM_CUENTAS, prestamos=NUM_PRESTAMOS, transacciones=NUM_TRANSACCIONES,
+                  particiones=NUM_PARTICIONES, nodos=NUM_NODOS, data_dir=DATA_DIR,
+                  seed=None, hoy=None, procesos=None, topologia=None):
+    """Genera los datos y los reparte según `topologia` (por defecto, en circular
+    sobre `nodos` nodos en localhost), que se guarda en `data_dir/topologia.properties`."""
+    if topologia is None:
+        topologia = Topologia.circular(particiones, nodos, [f"{HOST}:{PUERTO_BASE + k}" for k in range(nodos)])
+    particiones = topologia.particiones
+    # Limpiar y crear directorio de datos principal
+    if os.path.exists(data_dir):
+        shutil.rmtree(data_dir)
+    os.makedirs(data_dir)
+
+    temp_dir = os.path.join(data_dir, 'temp_partitions')
+    os.makedirs(temp_dir)
+    config = {'seed': seed, 'hoy': hoy or datetime.date.today(), 'particiones': particiones,
+              'cuentas': cuentas, 'temp_dir': temp_dir}
+    tablas = {'cuentas': cuentas, 'prestamos': prestamos, 'transacciones': transacciones}
+
+    print(f"Generando datos base ({cuentas} cuentas, {prestamos} préstamos, {transacciones} transacciones)...")
+    bloques = {tabla: [] for tabla in tablas}
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        futuros = [pool.submit(generar_bloque, tabla, inicio, min(inicio + FILAS_POR_BLOQUE - 1, total), config)
+                   for tabla, total in tablas.items()
+                   for inicio in range(1, total + 1, FILAS_POR_BLOQUE)]
+        for futuro in futuros:
+            tabla, inicio = futuro.result()
+            bloques[tabla].append(inicio)
+
+    # Unir los bloques de cada partición en orden de id
+    for tabla in tablas:
+        for p in range(1, particiones + 1):
+            with open(os.path.join(temp_dir, f"{tabla}_part{p}.txt"), 'wb') as dst:
+                for inicio in sorted(bloques[tabla]):
+                    ruta = bloque_path(temp_dir, tabla, p, inicio)
+                    with open(ruta, 'rb') as src:
+                        shutil.copyfileobj(src, dst, BUFFER_ESCRITURA)
+                    os.remove(ruta)
+
     print("Distribuyendo particiones y réplicas en los nodos...")
-    # --- Distribuir Particiones y Réplicas en Nodos ---
-    for i in range(1, NUM_NODOS + 1):
-        nodo_dir = os.path.join(DATA_DIR, f"nodo{i}")
-        os.makedirs(nodo_dir)
-        
-        for j in range(1, NUM_PARTICIONES + 1):
-            for nombre_tabla in tablas.keys():
-                part_file_name = f"{nombre_tabla}_part{j}.txt"
-                src_path = os.path.join(temp_partition_dir, part_file_name)
-                
-                # El nodo `i` es el primario para la partición `i`
-                # La distribución de réplicas sigue un patrón circular
-                if (i == j) or ((i % NUM_NODOS) + 1 == j) or ((j % NUM_NODOS) + 1 == i):
-                    shutil.copy(src_path, os.path.join(nodo_dir, part_file_name))
+    metodos = {}
+    for i in sorted(topologia.nodos):
+        os.makedirs(os.path.join(data_dir, f"nodo{i}"))
+    for p in range(1, particiones + 1):
+        for i in topologia.ubicacion[p]:
+            for tabla in tablas:
+                part_file_name = f"{tabla}_part{p}.txt"
+                metodo = colocar_replica(os.path.join(temp_dir, part_file_name), os.path.join(data_dir, f"nodo{i}", part_file_name))
+                metodos[metodo] = metodos.get(metodo, 0) + 1
 
     # Limpiar particiones temporales
-    shutil.rmtree(temp_partition_dir)
+    shutil.rmtree(temp_dir)
+    topologia.guardar(os.path.join(data_dir, ARCHIVO))
 
-    print(f"Datos generados, particionados y replicados en los directorios de nodos dentro de '{DATA_DIR}'.")
+    resumen = ', '.join(f"{n} por {metodo}" for metodo, n in sorted(metodos.items()))
+    print(f"Datos generados, particionados y replicados en los directorios de nodos dentro de '{data_dir}' ({resumen}).")
 
 if __name__ == "__main__":
-    generar_datos()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Genera las particiones y réplicas de datos de prueba.")
+    parser.add_argument("--cuentas", type=int, default=NUM_CUENTAS)
+    parser.add_argument("--prestamos", type=int, default=NUM_PRESTAMOS)
+    parser.add_argument("--transacciones", type=int, default=NUM_TRANSACCIONES)
+    parser.add_argument("--particiones", type=int, default=NUM_PARTICIONES)
+    parser.add_argument("--nodos", type=int, default=NUM_NODOS)
+    parser.add_argument("--host", default=HOST, help="Host de los nodos en la topología generada.")
+    parser.add_argument("--puerto-base", type=int, default=PUERTO_BASE, help="Puerto del nodo 1 (el nodo k usa el siguiente k - 1).")
+    parser.add_argument("--topologia", metavar="ARCHIVO",
+                        help="Topología a usar (particiones y nodos de cada una) en lugar de la circular de --particiones y --nodos.")
+    parser.add_argument("--dir", default=DATA_DIR, help="Directorio de salida (se borra si existe).")
+    parser.add_argument("--seed", type=int, help="Semilla: con la misma semilla y --hoy se generan los mismos datos.")
+    parser.add_argument("--hoy", type=datetime.date.fromisoformat, help="Fecha de referencia AAAA-MM-DD (por defecto, hoy).")
+    parser.add_argument("--procesos", type=int, help="Procesos del pool (por defecto, uno por núcleo).")
+    args = parser.parse_args()
+    if min(args.cuentas, args.particiones, args.nodos) < 1 or min(args.prestamos, args.transacciones) < 0:
+        sys.exit("Los tamaños deben ser positivos")
+
+    if args.topologia:
+        topologia = Topologia.cargar(args.topologia) # Antes de borrar --dir, por si el archivo está dentro
+    else:
+        topologia = Topologia.circular(args.particiones, args.nodos,
+                                       [f"{args.host}:{args.puerto_base + k}" for k in range(args.nodos)])
+    generar_datos(args.cuentas, args.prestamos, args.transacciones, args.particiones, args.nodos,
+                  args.dir, args.seed, args.hoy, args.procesos, topologia)
@@ -0,0 +1,34 @@
+"""Convierte las particiones `cuentas_partN.txt` de uno o más nodos a `cuentas_partN.dat`.
+
+El formato binario es el que usa el worker con `--almacenamiento mmap`. El
+worker también convierte las particiones que falten al arrancar; este script
+permite hacerlo de antemano (p. ej. justo después de generar los datos). Cada
+`.txt` convertido se borra: a partir de ahí el nodo sólo arranca con `mmap`.
+
+Uso:
+    python3 src/worker_nodes/convertir_cuentas.py data/nodo1 data/nodo2 data/nodo3
+"""
+import os
+import argparse
+
+import storage
+from storage import configurar_particiones, convertir_cuentas
+from topologia import ARCHIVO, cargar_topologia
+
+def main():
+    parser = argparse.ArgumentParser(description="Convierte las cuentas de un nodo al formato binario de ancho fijo.")
+    parser.add_argument("nodos", nargs='+', help="Directorios de datos de los nodos (ej: data/nodo1).")
+    parser.add_argument("--topologia", default=os.path.join('data', ARCHIVO), help="Archivo de topología (número de particiones).")
+    args = parser.parse_args()
+    configurar_particiones(cargar_topologia(args.topologia).particiones) # El formato depende del número de particiones
+
+    for node_data_dir in args.nodos:
+        for part_index in range(1, storage.NUM_PARTICIONES + 1):
+            txt_path = os.path.join(node_data_dir, f"cuentas_part{part_index}.txt")
+            if not os.path.exists(txt_path): continue
+            dat_path = os.path.join(node_data_dir, f"cuentas_part{part_index}.dat")
+            count = convertir_cuentas(txt_path, dat_path, part_index)
+            print(f"{dat_path}: {count} cuentas")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+import os
+import time
+import zlib
+import queue
+import logging
+import datetime
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+import indices
+from metrics import METRICS
+
+# Operaciones que se registran en el historial pero no se muestran al cliente
+OCULTAS = {'DEVOLUCION'}
+
+def time_key(fecha, fill='0'):
+    """Clave entera ordenable de una fecha: '2025-03-07 10:15:00' -> 20250307101500.
+
+    Una fecha incompleta se rellena con `fill`: con '0' marca el inicio del
+    período y con '9' cualquier instante anterior a su final.
+    """
+    digits = ''.join(c for c in fecha if c.isdigit())
+    if not digits or len(digits) > 14: raise ValueError(f"Fecha inválida: {fecha}")
+    return int(digits.ljust(14, fill))
+
+class AccountHistory:
+    """Posiciones en el archivo y claves de tiempo de las filas de una cuenta, en orden de escritura."""
+
+    __slots__ = ('offsets', 'times')
+
+    def __init__(self):
+        self.offsets = array('q')
+        self.times = array('q')
+
+    def add(self, offset, time):
+        self.offsets.append(offset)
+        self.times.append(time)
+
+class HistoryPartition:
+    """Archivo `historial_partN.txt` de sólo-añadir con un índice por cuenta.
+
+    Las filas de cada cuenta se indexan en orden de escritura, que es también
+    su orden temporal (HistoryStore.append pone la fecha al encolar, y el
+    escritor de HistoryStore es el único que añade filas), así que una consulta sólo lee del archivo las
+    filas que devuelve.
+
+    Con `con_indice`, el índice se guarda en `historial_partN.txt.idx` (ver
+    indices.py) y al arrancar sólo se leen las filas añadidas después. Las
+    cuentas del índice guardado quedan en `base` y pasan a `accounts` la
+    primera vez que se consultan o reciben una fila.
+    """
+
+    CONTROL = 4096 # Bytes finales de la parte indexada que se comparan para validar un índice guardado
+
+    def __init__(self, file_path, mutex, con_indice=False):
+        self.file_path = file_path
+        self.mutex = mutex
+        self.accounts = {} # id_cuenta -> AccountHistory
+        self.base = {}     # id_cuenta -> (inicio, cantidad) en base_offsets/base_times
+        self.base_offsets = array('q')
+        self.base_times = array('q')
+        self.con_indice = con_indice
+        self.indexado = 0  # Bytes del archivo cubiertos por el índice guardado
+        self.load()
+        self.file = open(self.file_path, 'ab')
+        self.offset = self.file.tell()
+        self.reader = os.open(self.file_path, os.O_RDONLY)
+
+    def load(self):
+        if not os.path.exists(self.file_path): return
+        offset = self.cargar_indice() if self.con_indice and os.path.getsize(self.file_path) else 0
+        with open(self.file_path, 'rb') as f:
+            f.seek(offset)
+            raw_line = b'\n' # El índice guardado acaba siempre en un fin de línea
+            for raw_line in f:
+                if raw_line.endswith(b'\n'):
+                    self.index(raw_line, offset)
+                offset += len(raw_line)
+        if offset and not raw_line.endswith(b'\n'):
+            # Cola incompleta de una escritura interrumpida: la siguiente fila empieza en otra línea
+            with open(self.file_path, 'ab') as f:
+                f.write(b'\n')
+
+    def control(self, fin):
+        """Inodo y CRC32 de los últimos bytes antes de `fin`: si coinciden, el archivo sólo ha crecido."""
+        with open(self.file_path, 'rb') as f:
+            inicio = max(0, fin - self.CONTROL)
+            f.seek(inicio)
+            data = f.read(fin - inicio)
+            return (os.fstat(f.fileno()).st_ino, len(data), zlib.crc32(data))
+
+    def cargar_indice(self):
+        """Carga el índice guardado si el archivo sólo ha crecido desde entonces; devuelve hasta dónde cubre."""
+        guardado = indices.cargar(self.file_path)
+        if guardado is not None:
+            (fin, control), (ids, cantidades, offsets, times) = guardado
+            if os.path.getsize(self.file_path) >= fin and self.control(fin) == tuple(control):
+                self.base = dict(zip(ids, zip(accumulate(cantidades, initial=0), cantidades)))
+                self.base_offsets.frombytes(offsets)
+                self.base_times.frombytes(times)
+                self.indexado = fin
+                METRICS.count('indices.cargados')
+                return fin
+        METRICS.count('indices.reconstruidos')
+        return 0
+
+    def guardar_indice(self):
+        """Guarda el índice de las filas escritas hasta ahora sin bloquear a los escritores más que
+        lo que cuesta copiar las listas de cuentas (las filas posteriores se descartan por posición)."""
+        with self.mutex:
+            fin = self.offset
+            cuentas = list(self.accounts.items())
+            base = list(self.base.items())
+        ids, cantidades = [], []
+        offsets, times = array('q'), array('q')
+        for id_cuenta, history in cuentas:
+            n = bisect_left(history.offsets, fin)
+            ids.append(id_cuenta)
+            cantidades.append(n)
+            offsets += history.offsets[:n]
+            times += history.times[:n]
+        for id_cuenta, (inicio, n) in base:
+            ids.append(id_cuenta)
+            cantidades.append(n)
+            offsets += self.base_offsets[inicio:inicio + n]
+            times += self.base_times[inicio:inicio + n]
+        indices.guardar(self.file_path, (fin, self.control(fin)), (ids, cantidades, offsets.tobytes(), times.tobytes()))
+        self.indexado = fin
+
+    def indice_al_dia(self):
+        return not self.con_indice or self.indexado == self.offset
+
+    def history(self, id_cuenta):
+        """AccountHistory de la cuenta (None si no tiene filas), sacándola de `base` si hace falta.
+        Se llama con `mutex` tomado (o durante la carga)."""
+        history = self.accounts.get(id_cuenta)
+        if history is None and id_cuenta in self.base:
+            inicio, n = self.base.pop(id_cuenta)
+            history = self.accounts[id_cuenta] = AccountHistory()
+            history.offsets = self.base_offsets[inicio:inicio + n]
+            history.times = self.base_times[inicio:inicio + n]
+        return history
+
+    def index(self, raw_line, offset):
+        parts = raw_line.split(b'|', 3)
+        if len(parts) < 4 or parts[2].decode('utf-8', 'replace') in OCULTAS: return
+        try:
+            time = time_key(parts[0].decode('utf-8'))
+            id_cuenta = parts[1].decode('utf-8')
+        except (UnicodeDecodeError, ValueError):
+            return # Ignorar líneas malformadas en el historial
+        history = self.history(id_cuenta)
+        if history is None:
+            history = self.accounts[id_cuenta] = AccountHistory()
+        history.add(offset, time)
+
+    def write(self, rows):
+        """Añade un lote de filas `(fecha, id_cuenta, comando, detalles, saldo)` con una sola escritura y las indexa (sin fsync)."""
+        raw_lines = [f"{fecha}|{id_cuenta}|{command}|{details}|{balance_str}\n".encode('utf-8')
+                     for fecha, id_cuenta, command, details, balance_str in rows]
+        data = b''.join(raw_lines)
+        start = time.perf_counter()
+        self.file.write(data)
+        self.file.flush()
+        METRICS.io('historial_escritura', time.perf_counter() - start, bytes_escritos=len(data))
+        with self.mutex:
+            for raw_line in raw_lines:
+                self.index(raw_line, self.offset)
+                self.offset += len(raw_line)
+
+    def sync(self):
+        with METRICS.timer('io.historial_fsync'):
+            os.fsync(self.file.fileno())
+
+    def lineas(self):
+        """Todas las filas escritas hasta ahora, como texto."""
+        with self.mutex:
+            end = self.offset
+        with open(self.file_path, 'rb') as f:
+            data = f.read(end)
+        return data.decode('utf-8').splitlines(keepends=True)
+
+    def close(self):
+        self.file.close()
+        os.close(self.reader)
+
+    def read_line(self, offset):
+        data = b''
+        while True:
+            chunk = os.pread(self.reader, 256, offset + len(data))
+            METRICS.count('io.bytes_leidos', len(chunk))
+            end = chunk.find(b'\n')
+            if end >= 0 or not chunk:
+                return (data + chunk[:end if end >= 0 else len(chunk)]).decode('utf-8')
+            data += chunk
+
+    def query(self, id_cuenta, limite=None, offset=0, desde=None, hasta=None):
+        """Filas de la cuenta de la más reciente a la más antigua.
+
+        `desde`/`hasta` (inclusive, 'AAAA-MM-DD' con hora opcional) acotan el
+        rango por búsqueda binaria; `offset` y `limite` paginan dentro de él.
+        """
+        if offset < 0 or (limite is not None and limite < 0):
+            raise ValueError("limite y offset no pueden ser negativos")
+        with self.mutex:
+            history = self.history(str(id_cuenta))
+            if history is None: return []
+            lo = bisect_left(history.times, time_key(desde)) if desde else 0
+            hi = bisect_right(history.times, time_key(hasta, '9')) if hasta else len(history.times)
+            hi -= offset
+            if limite is not None: lo = max(lo, hi - limite)
+            offsets = history.offsets[lo:max(lo, hi)]
+        # Las filas ya escritas no cambian: se leen sin bloquear a los escritores
+        return [self.read_line(offset) for offset in reversed(offsets)]
+
+class HistoryStore:
+    """Historial de todas las particiones de un nodo, escrito por un único hilo.
+
+    `append` sólo encola la fila en una cola acotada; el hilo escritor la
+    vacía por lotes, con una escritura por partición y lote. Cuándo se hace
+    fsync depende de `fsync`:
+      - 'lote':      tras cada lote.
+      - 'intervalo': como mucho cada `intervalo` segundos, o antes si alguien
+                     espera en una barrera.
+      - 'ninguno':   nunca (lo decide el sistema operativo).
+    Con `durable=True`, `append` no retorna hasta que la fila está escrita y,
+    salvo con 'ninguno', en disco.
+    """
+
+    MAX_LOTE = 1024
+
+    def __init__(self, node_data_dir, locks, fsync='lote', intervalo=1.0, max_cola=10000, con_indices=False):
+        self.node_data_dir = node_data_dir
+        self.locks = locks
+        self.fsync = fsync
+        self.intervalo = intervalo
+        self.con_indices = con_indices
+        self.partitions = {} # part_index -> HistoryPartition
+        self.queue = queue.Queue(max_cola)
+        self.encolado = threading.Lock()
+        self.unsynced = set()   # HistoryPartition escritas desde su último fsync
+        self.last_sync = time.monotonic()
+        METRICS.gauge('historial.cola', self.queue.qsize)
+        threading.Thread(target=self.run, name='historial', daemon=True).start()
+
+    def partition(self, part_index):
+        partition = self.partitions.get(part_index)
+        if partition is not None: return partition
+        with self.locks.historial(part_index):
+            partition = self.partitions.get(part_index)
+            if partition is None:
+                file_path = os.path.join(self.node_data_dir, f"historial_part{part_index}.txt")
+                partition = self.partitions[part_index] = HistoryPartition(file_path, self.locks.historial(part_index), self.con_indices)
+            return partition
+
+    def load(self, part_indexes):
+        for part_index in part_indexes:
+            self.partition(part_index)
+        self.guardar_indices()
+
+    def guardar_indices(self):
+        """Guarda el índice de las particiones con filas sin indexar en su índice guardado."""
+        for partition in list(self.partitions.values()):
+            if not partition.indice_al_dia(): partition.guardar_indice()
+
+    def retirar(self, part_index):
+        """Cierra el archivo de una partición que el nodo deja de tener (tras escribir lo encolado)."""
+        self.flush(sync=True)
+        with self.locks.historial(part_index):
+            partition = self.partitions.pop(part_index, None)
+        if partition is not None:
+            self.unsynced.discard(partition)
+            partition.close()
+
+    def append(self, part_index, row, durable=False, fecha=None):
+        """Encola una fila `(id_cuenta, comando, detalles, saldo)` con su fecha (por
+        defecto, la actual) y devuelve la fecha; se bloquea si la cola está llena."""
+        done = threading.Event() if durable else None
+        # Fecha y encolado juntos, para que el orden de la cola sea el de las fechas
+        with self.encolado:
+            if fecha is None: fecha = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            self.queue.put((part_index, (fecha, *row), done, True))
+        if done: done.wait()
+        return fecha
+
+    def flush(self, sync=False):
+        """Barrera: espera a que todo lo encolado antes esté escrito (y con `sync`, en disco)."""
+        done = threading.Event()
+        self.queue.put((None, None, done, sync))
+        done.wait()
+
+    def next_batch(self):
+        timeout = None
+        if self.fsync == 'intervalo' and self.unsynced:
+            timeout = max(0.0, self.last_sync + self.intervalo - time.monotonic())
+        try:
+            batch = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.MAX_LOTE:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            waiters = [(done, sync) for _, _, done, sync in batch if done is not None]
+            if batch:
+                METRICS.count('historial.lotes')
+                METRICS.count('historial.entradas', len(batch))
+            try:
+                self.write_batch(batch)
+                must_sync = self.fsync != 'ninguno' and any(sync for _, sync in waiters)
+                if self.fsync == 'lote' or must_sync or (self.fsync == 'intervalo' and time.monotonic() - self.last_sync >= self.intervalo):
+                    self.sync()
+            except Exception as e:
+                logging.error(f"Fallo al escribir en el historial: {e}")
+            for done, _ in waiters:
+                done.set()
+
+    def write_batch(self, batch):
+        rows_by_part = {}
+        for part_index, row, _, _ in batch:
+            if row is not None:
+                rows_by_part.setdefault(part_index, []).append(row)
+        for part_index, rows in rows_by_part.items():
+            partition = self.partition(part_index)
+            partition.write(rows)
+            self.unsynced.add(partition)
+
+    def sync(self):
+        for partition in self.unsynced:
+            partition.sync()
+        self.unsynced = set()
+        self.last_sync = time.monotonic()
@@ -0,0 +1,59 @@
+import os
+import time
+import zlib
+import struct
+import marshal
+
+from metrics import METRICS
+
+# Índices guardados junto a los archivos de datos, para arrancar sin volver a
+# interpretarlos. `X.idx` contiene lo que el worker construye al cargar el
+# archivo `X` (ver TextPartition, MmapAccountPartition y HistoryPartition)
+# junto con la firma que tenía `X` en ese momento. Quien lo carga compara esa
+# firma con la del archivo actual y, si no coinciden, vuelve a leer `X` y
+# reescribe el índice. El contenido va serializado con `marshal` (sólo tipos
+# básicos) y protegido con un CRC32: un índice truncado, corrupto o de otra
+# versión de Python se ignora como si no existiera.
+MAGIC = b'IDX1'
+CABECERA = struct.Struct('<4sII') # magia, versión de marshal, crc32 del contenido
+
+def ruta(file_path):
+    return file_path + '.idx'
+
+def firma(file_path):
+    """Tamaño, fecha de modificación e inodo de un archivo de texto. Cambian con
+    cada reescritura (temporal + rename) y con cada fila añadida."""
+    st = os.stat(file_path)
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+def guardar(file_path, firma, datos):
+    """Escribe el índice de `file_path` (temporal + rename, sin fsync: si se pierde
+    o queda a medias, el CRC lo invalida y sólo cuesta reconstruirlo)."""
+    start = time.perf_counter()
+    payload = marshal.dumps((firma, datos))
+    tmp_path = f"{ruta(file_path)}.{os.getpid()}.tmp" # Varios procesos pueden escribir el mismo índice
+    with open(tmp_path, 'wb') as f:
+        f.write(CABECERA.pack(MAGIC, marshal.version, zlib.crc32(payload)))
+        f.write(payload)
+    os.replace(tmp_path, ruta(file_path))
+    METRICS.io('indice_escritura', time.perf_counter() - start, bytes_escritos=len(payload))
+
+def cargar(file_path):
+    """`(firma, datos)` del índice de `file_path` con una sola lectura, o None si no hay uno válido."""
+    try:
+        with open(ruta(file_path), 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    METRICS.count('io.bytes_leidos', len(data))
+    if len(data) < CABECERA.size: return None
+    magia, version, crc = CABECERA.unpack_from(data)
+    payload = memoryview(data)[CABECERA.size:]
+    if magia != MAGIC or version != marshal.version or zlib.crc32(payload) != crc: return None
+    try:
+        return marshal.loads(payload)
+    except (EOFError, ValueError, TypeError):
+        return None
+
+def borrar(file_path):
+    if os.path.exists(ruta(file_path)): os.remove(ruta(file_path))
@@ -0,0 +1,103 @@
+import time
+import threading
+from contextlib import contextmanager, ExitStack
+
+from storage import particion_de
+from metrics import METRICS
+
+# Modos de bloqueo jerárquico:
+#   IS/IX: intención de leer/escribir cuentas individuales de la partición
+#   S:     lectura de la partición completa (checkpoint, ARQUEO_CUENTAS|VERIFICAR, estado para réplicas)
+#   X:     escritura exclusiva
+COMPATIBLE = {
+    'IS': {'IS', 'IX', 'S'},
+    'IX': {'IS', 'IX'},
+    'S':  {'IS', 'S'},
+    'X':  set(),
+}
+
+class ModeLock:
+    """Bloqueo con modos compartido/exclusivo (y de intención para particiones)."""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._held = {mode: 0 for mode in COMPATIBLE}
+
+    def _compatible(self, mode):
+        return all(count == 0 or other in COMPATIBLE[mode] for other, count in self._held.items())
+
+    def acquire(self, mode):
+        with self._cond:
+            while not self._compatible(mode):
+                self._cond.wait()
+            self._held[mode] += 1
+
+    def release(self, mode):
+        with self._cond:
+            self._held[mode] -= 1
+            self._cond.notify_all()
+
+class LockManager:
+    """Bloqueos por partición y por cuenta, siempre adquiridos en el mismo orden.
+
+    Orden global: primero las particiones (ascendente) y luego las cuentas
+    (ascendente por id numérico). Como toda operación respeta este orden, dos
+    operaciones sobre las mismas cuentas no pueden esperar la una por la otra
+    en ciclo. Los préstamos quedan protegidos por el bloqueo de la cuenta de su
+    cliente y el historial tiene un mutex propio por partición, que es siempre
+    el último en tomarse.
+
+    Un hilo que ya tiene bloqueadas unas cuentas (p. ej. todas las de un lote
+    EXECUTE_BATCH) puede volver a pedir cualquier subconjunto de ellas sin
+    esperar: la petición anidada no adquiere nada.
+    """
+
+    def __init__(self):
+        self._local = threading.local() # id_cuenta -> exclusivo, de las cuentas que tiene el hilo
+        self._mutex = threading.Lock()
+        self._partitions = {}
+        self._accounts = {}
+        self._history = {}
+
+    def _get(self, table, key, factory):
+        with self._mutex:
+            lock = table.get(key)
+            if lock is None:
+                lock = table[key] = factory()
+            return lock
+
+    def _acquire(self, stack, lock, mode, kind):
+        start = time.perf_counter()
+        lock.acquire(mode)
+        METRICS.observe(f"lock_espera.{kind}", time.perf_counter() - start)
+        stack.callback(lock.release, mode)
+
+    @contextmanager
+    def cuentas(self, ids_cuenta, exclusivo):
+        """Bloquea cuentas individuales: compartido para lecturas, exclusivo para cambios."""
+        ids = sorted({int(id_cuenta) for id_cuenta in ids_cuenta})
+        held = getattr(self._local, 'held', None)
+        if held is not None and all(id_cuenta in held and (held[id_cuenta] or not exclusivo) for id_cuenta in ids):
+            yield
+            return
+        partitions = sorted({particion_de(id_cuenta) for id_cuenta in ids})
+        with ExitStack() as stack:
+            for part_index in partitions:
+                self._acquire(stack, self._get(self._partitions, part_index, ModeLock), 'IX' if exclusivo else 'IS', 'particion')
+            for id_cuenta in ids:
+                self._acquire(stack, self._get(self._accounts, id_cuenta, ModeLock), 'X' if exclusivo else 'S', 'cuenta')
+            if held is None:
+                self._local.held = dict.fromkeys(ids, exclusivo)
+                stack.callback(delattr, self._local, 'held')
+            yield
+
+    @contextmanager
+    def particiones(self, part_indexes, exclusivo=False):
+        """Bloquea particiones completas (p. ej. para sumar todos sus saldos)."""
+        with ExitStack() as stack:
+            for part_index in sorted(set(part_indexes)):
+                self._acquire(stack, self._get(self._partitions, part_index, ModeLock), 'X' if exclusivo else 'S', 'particion')
+            yield
+
+    def historial(self, part_index):
+        return self._get(self._history, part_index, threading.Lock)
@@ -0,0 +1,95 @@
+import os
+import sys
+import time
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+from metrics import METRICS
+
+# Logger del registro de peticiones: es el único que se muestrea
+PETICIONES = logging.getLogger('worker.peticiones')
+
+class Muestreo(logging.Filter):
+    """Deja pasar 1 de cada `cada` registros por comando y como mucho
+    `max_por_seg` por comando y segundo. WARNING y superiores pasan siempre.
+
+    El comando se toma de `record.cmd` (ver `PETICIONES`).
+    """
+
+    def __init__(self, cada=1, max_por_seg=0):
+        super().__init__()
+        self.cada = max(1, cada)
+        self.max_por_seg = max_por_seg
+        self._mutex = threading.Lock()
+        self.vistos = {}   # comando -> registros vistos
+        self.ventanas = {} # comando -> [segundo, registros emitidos en ese segundo]
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING: return True
+        cmd = getattr(record, 'cmd', None)
+        with self._mutex:
+            vistos = self.vistos.get(cmd, 0)
+            self.vistos[cmd] = vistos + 1
+            emitir = vistos % self.cada == 0
+            if emitir and self.max_por_seg:
+                segundo = int(time.monotonic())
+                ventana = self.ventanas.get(cmd)
+                if ventana is None or ventana[0] != segundo:
+                    ventana = self.ventanas[cmd] = [segundo, 0]
+                emitir = ventana[1] < self.max_por_seg
+                if emitir: ventana[1] += 1
+        if not emitir: METRICS.count('logs.omitidos')
+        return emitir
+
+class ColaHandler(QueueHandler):
+    """Encola los registros sin formatearlos; el hilo del listener hace todo lo demás.
+
+    Si la cola está llena, los registros de nivel INFO o inferior se descartan
+    (`logs.descartados`) y los de WARNING o superior esperan hueco.
+    """
+
+    def prepare(self, record):
+        if record.exc_info and not record.exc_text:
+            # La traza sólo puede formatearse mientras la excepción existe
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if record.levelno >= logging.WARNING:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            METRICS.count('logs.descartados')
+
+def setup_logging(node_id, consola=True, muestreo=1, max_por_seg=0, max_cola=10000, proceso=None):
+    """Configura el logging del worker: los hilos que atienden peticiones sólo
+    encolan y un hilo en segundo plano formatea y escribe en
+    `logs/worker_N.log` (y en la consola si `consola`). Los procesos hijos del
+    modo multiproceso escriben en el mismo archivo con la etiqueta `N<id>/p<partición>`."""
+    log_dir = 'logs'
+    os.makedirs(log_dir, exist_ok=True)
+    etiqueta = f"N{node_id}" if proceso is None else f"N{node_id}/p{proceso}"
+    formatter = logging.Formatter(f'%(asctime)s {etiqueta} %(levelname).1s %(message)s')
+    handlers = [logging.FileHandler(os.path.join(log_dir, f'worker_{node_id}.log'))]
+    if consola: handlers.append(logging.StreamHandler(sys.stdout))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    cola = queue.Queue(max_cola)
+    listener = QueueListener(cola, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop) # Vacía la cola al salir
+
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.setLevel(logging.INFO)
+    root.addHandler(ColaHandler(cola))
+    PETICIONES.addFilter(Muestreo(muestreo, max_por_seg))
+    METRICS.gauge('logs.cola', cola.qsize)
+    return listener
@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+NUM_BUCKETS = 40 # Cubeta k: duraciones menores que 2^k microsegundos (la última, hasta ~6 días)
+
+class Histogram:
+    """Histograma de duraciones con cubetas de potencias de dos en microsegundos."""
+
+    __slots__ = ('buckets', 'count', 'total')
+
+    def __init__(self):
+        self.buckets = [0] * NUM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        self.buckets[min(int(seconds * 1e6).bit_length(), NUM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, p):
+        """Cota superior (en segundos) de la cubeta que contiene el percentil p."""
+        if not self.count: return 0.0
+        target, acc = p * self.count, 0
+        for k, n in enumerate(self.buckets):
+            acc += n
+            if acc >= target: return (1 << k) / 1e6
+        return (1 << (NUM_BUCKETS - 1)) / 1e6
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum_s': round(self.total, 6),
+            'p50_s': self.percentile(0.50),
+            'p99_s': self.percentile(0.99),
+            'p999_s': self.percentile(0.999),
+            # Sólo las cubetas con datos: límite superior en microsegundos -> cantidad
+            'buckets_us': {str(1 << k): n for k, n in enumerate(self.buckets) if n},
+        }
+
+class Metrics:
+    """Contadores, histogramas y medidores del nodo, seguros entre hilos.
+
+    Los nombres usan puntos como separador (`comando.CREDIT`, `lock_espera.cuenta`).
+    Los medidores (`gauge`) se leen en el momento de la instantánea y los
+    niveles (`level`) suben y bajan con cada llamada; ambos salen en `gauges`.
+    """
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self.started = time.time()
+        self.counters = {}   # nombre -> entero
+        self.histograms = {} # nombre -> Histogram
+        self.gauges = {}     # nombre -> función sin argumentos
+        self.levels = {}     # nombre -> valor que sube y baja (p. ej. peticiones en curso)
+
+    def count(self, name, n=1):
+        with self._mutex:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, seconds):
+        with self._mutex:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def io(self, kind, seconds, bytes_leidos=0, bytes_escritos=0):
+        """Registra una operación de E/S: su duración y los bytes transferidos."""
+        with self._mutex:
+            histogram = self.histograms.get(f"io.{kind}")
+            if histogram is None:
+                histogram = self.histograms[f"io.{kind}"] = Histogram()
+            histogram.add(seconds)
+            if bytes_leidos: self.counters['io.bytes_leidos'] = self.counters.get('io.bytes_leidos', 0) + bytes_leidos
+            if bytes_escritos: self.counters['io.bytes_escritos'] = self.counters.get('io.bytes_escritos', 0) + bytes_escritos
+
+    def gauge(self, name, fn):
+        self.gauges[name] = fn
+
+    def level(self, name, delta):
+        with self._mutex:
+            self.levels[name] = self.levels.get(name, 0) + delta
+
+    def snapshot(self):
+        with self._mutex:
+            counters = dict(self.counters)
+            histograms = {name: h.snapshot() for name, h in self.histograms.items()}
+            gauges = dict(self.levels)
+        for name, fn in list(self.gauges.items()):
+            try:
+                gauges[name] = fn()
+            except Exception as e:
+                gauges[name] = f"error: {e}"
+        return {'ts': round(time.time(), 3), 'uptime_s': round(time.time() - self.started, 3),
+                'counters': counters, 'gauges': gauges, 'histograms': histograms}
+
+    def start_dumper(self, file_path, intervalo):
+        """Añade periódicamente una instantánea (una línea JSON) a `file_path`."""
+        os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+        def run():
+            while True:
+                time.sleep(intervalo)
+                try:
+                    with open(file_path, 'a', encoding='utf-8') as f:
+                        f.write(json.dumps(self.snapshot()) + '\n')
+                except Exception as e:
+                    logging.error(f"Fallo al volcar las métricas: {e}")
+        threading.Thread(target=run, name='metricas', daemon=True).start()
+
+def merge_snapshots(snapshots):
+    """Combina instantáneas de varios procesos: suma contadores, medidores e histogramas."""
+    counters, gauges, histograms = {}, {}, {}
+    for snapshot in snapshots:
+        for name, n in snapshot['counters'].items():
+            counters[name] = counters.get(name, 0) + n
+        for name, value in snapshot['gauges'].items():
+            if isinstance(value, (int, float)): gauges[name] = gauges.get(name, 0) + value
+        for name, data in snapshot['histograms'].items():
+            histogram = histograms.get(name)
+            if histogram is None:
+                histogram = histograms[name] = Histogram()
+            for limit_us, n in data['buckets_us'].items():
+                histogram.buckets[int(limit_us).bit_length() - 1] += n
+            histogram.count += data['count']
+            histogram.total += data['sum_s']
+    return {'ts': round(time.time(), 3), 'uptime_s': max((s['uptime_s'] for s in snapshots), default=0.0),
+            'counters': counters, 'gauges': gauges,
+            'histograms': {name: h.snapshot() for name, h in histograms.items()}}
+
+# Métricas del proceso, compartidas por todos los módulos del worker
+METRICS = Metrics()
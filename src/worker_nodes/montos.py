@@ -0,0 +1,34 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_EVEN
+
+# Los montos se manejan como enteros de céntimos: '12.50' <-> 1250. Sólo se
+# convierten desde y hacia texto al leer el protocolo y los archivos.
+
+CENTIMOS = tuple('.%02d' % i for i in range(100)) # Sufijo de cada resto: 5 -> '.05'
+
+def parse_monto(texto):
+    """Céntimos de un monto en texto, redondeado como `Decimal(texto).quantize(Decimal('0.01'))`
+    (mitad al par). Lanza ValueError si no es un número finito."""
+    entero, punto, fraccion = texto.partition('.')
+    try:
+        # Casos habituales ('12.34', '12.5', '12'), sin pasar por Decimal
+        if len(fraccion) == 2 and fraccion.isdecimal():
+            return int(entero + fraccion)
+        if len(fraccion) == 1 and fraccion.isdecimal():
+            return int(entero + fraccion) * 10
+        if not punto:
+            return int(texto) * 100
+    except ValueError:
+        pass
+    try:
+        valor = Decimal(texto)
+    except InvalidOperation:
+        raise ValueError(f"Monto inválido: {texto!r}") from None
+    if not valor.is_finite(): raise ValueError(f"Monto inválido: {texto!r}")
+    return int(valor.scaleb(2).to_integral_value(ROUND_HALF_EVEN))
+
+def format_monto(centimos):
+    """1250 -> '12.50', -5 -> '-0.05'."""
+    if centimos >= 0:
+        return str(centimos // 100) + CENTIMOS[centimos % 100]
+    centimos = -centimos
+    return '-' + str(centimos // 100) + CENTIMOS[centimos % 100]
@@ -0,0 +1,105 @@
+import threading
+from contextlib import contextmanager
+
+from metrics import METRICS
+
+class VersionStore:
+    """Versiones confirmadas de los registros, para lecturas sin bloqueos (MVCC).
+
+    Los escritores modifican los registros de las particiones con sus cuentas
+    bloqueadas y, una vez persistido el cambio, lo publican con `publicar`: todos
+    los registros de un commit (o de un lote) reciben juntos el siguiente número
+    de versión. Un lector nunca mira el estado a medio confirmar: toma una
+    instantánea (la última versión publicada) y ve cada registro y cada total de
+    partición tal como estaban en ella, sin esperar a ningún escritor.
+
+    De cada registro modificado alguna vez se guarda una cadena inmutable
+    `(versión, registro, anterior)` con la versión más reciente primero. Sólo
+    se conservan las versiones anteriores que alguna instantánea abierta aún
+    puede necesitar. Un registro sin cadena nunca cambió desde que se cargó.
+    Las claves son `('C', id)` para cuentas, `('P', id)` para préstamos y
+    `('T', partición)` para el total de saldos de cada partición de cuentas.
+    """
+
+    def __init__(self):
+        self.mutex = threading.Lock() # Para añadir, publicar o descartar cadenas y abrir o cerrar instantáneas
+        self.version = 0
+        self.cadenas = {}  # clave -> (versión, registro, anterior)
+        self.activas = {}  # versión -> instantáneas abiertas sobre ella
+        METRICS.gauge('mvcc.version', lambda: self.version)
+        METRICS.gauge('mvcc.instantaneas', lambda: sum(self.activas.values()))
+
+    def base(self, clave, registro):
+        """Registra el valor confirmado de `clave` antes de que un escritor lo modifique
+        en la partición (debe llamarse con el registro bloqueado en modo exclusivo)."""
+        if clave not in self.cadenas:
+            with self.mutex: # Una clave nueva cambia el tamaño del diccionario que recorre `descartar`
+                self.cadenas.setdefault(clave, (0, registro, None))
+
+    def publicar(self, cambios):
+        """Publica como una nueva versión los registros de un commit, `{clave: (partición, registro)}`.
+
+        El total de cada partición de cuentas afectada se actualiza con la
+        diferencia de saldo de sus cuentas respecto a su versión anterior.
+        """
+        with self.mutex:
+            version = self.version + 1
+            deltas = {}
+            for clave, (part_index, registro) in cambios.items():
+                anterior = self.cadenas[clave]
+                if clave[0] == 'C':
+                    deltas[part_index] = deltas.get(part_index, 0) + registro.saldo - anterior[1].saldo
+                self.cadenas[clave] = (version, registro, self.podar(anterior))
+            for part_index, delta in deltas.items():
+                anterior = self.cadenas[('T', part_index)]
+                self.cadenas[('T', part_index)] = (version, anterior[1] + delta, self.podar(anterior))
+            self.version = version # Los lectores ven la versión sólo cuando está completa
+
+    def descartar(self, pertenece):
+        """Olvida las cadenas de las claves para las que `pertenece(clave, registro)` es
+        cierto (las de una partición que el nodo deja de tener)."""
+        with self.mutex:
+            for clave, cadena in list(self.cadenas.items()):
+                if pertenece(clave, cadena[1]): del self.cadenas[clave]
+
+    def podar(self, cadena):
+        """Parte de `cadena` que aún puede leer alguna instantánea abierta."""
+        if not self.activas: return None
+        minima = min(self.activas)
+        entradas = []
+        while cadena is not None:
+            entradas.append(cadena)
+            if cadena[0] <= minima: break
+            cadena = cadena[2]
+        resultado = None
+        for version, registro, _ in reversed(entradas):
+            resultado = (version, registro, resultado)
+        return resultado
+
+    def leer(self, clave, actual, version=None):
+        """Registro confirmado de `clave` en la instantánea `version` (None: la última).
+
+        `actual` es el registro leído de la partición *antes* de llamar: si la
+        clave no tiene cadena, ningún escritor la había tocado aún al leerlo.
+        """
+        cadena = self.cadenas.get(clave)
+        if cadena is None: return actual
+        if version is not None:
+            while cadena[0] > version:
+                cadena = cadena[2]
+        return cadena[1]
+
+    @contextmanager
+    def instantanea(self):
+        """Abre una instantánea sobre la última versión publicada y devuelve su número."""
+        with self.mutex:
+            version = self.version
+            self.activas[version] = self.activas.get(version, 0) + 1
+        try:
+            yield version
+        finally:
+            with self.mutex:
+                if self.activas[version] == 1:
+                    del self.activas[version]
+                else:
+                    self.activas[version] -= 1
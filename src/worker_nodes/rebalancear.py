@@ -0,0 +1,102 @@
+"""Traslada una partición de cuentas a otro nodo sin detener el sistema.
+
+Con modulo-hashing el número de particiones queda fijo al generar los datos
+(`generador_datos.py --particiones`); para repartir la carga entre más nodos
+se generan más particiones que nodos y se trasladan particiones completas.
+
+Pasos, con los nodos arrancados con replicación (`--replicar` o `--nodos`):
+
+1. El nodo destino se añade como réplica de la partición en la topología y
+   todos los nodos la recargan (`RECARGAR_TOPOLOGIA`, el destino primero).
+   El primario le envía la partición completa (cuentas, préstamos de sus
+   clientes e historial) mientras sigue atendiendo, y después sus cambios.
+2. Se espera a que el destino esté al día (`replicacion.retraso_pN` en STATS).
+3. Si el origen es el primario, `CEDER_PARTICION` hace que deje de aceptar
+   cambios en cuanto el destino tiene el último. Los cambios que lleguen entre
+   este paso y el siguiente fallan con un error que pide reintentar.
+4. El destino ocupa el lugar del origen en la topología y todos la recargan:
+   el destino pasa a ser primario y el origen borra sus archivos. El Servidor
+   Central ve el archivo nuevo en su siguiente petición.
+
+Si algo falla se vuelve a la topología inicial. Sin `--origen` sólo se añade
+la réplica (pasos 1 y 2).
+
+Uso:
+    python3 src/worker_nodes/rebalancear.py --particion 4 --origen 1 --destino 4 --direccion localhost:9094
+"""
+import os
+import sys
+import time
+import json
+import argparse
+
+from topologia import ARCHIVO, Topologia
+from replication import enviar
+
+def ejecutar(topologia, node_id, query, timeout):
+    estado, datos = enviar(topologia.nodos[node_id], f"EXECUTE|rebalancear|{query}", timeout)
+    if estado != 'SUCCESS': raise RuntimeError(f"nodo {node_id}: {datos}")
+    return datos
+
+def publicar(topologia, ruta, primero, timeout):
+    """Guarda la topología y hace que la recarguen todos sus nodos, `primero` antes que los demás."""
+    topologia.guardar(ruta)
+    for node_id in [primero] + sorted(set(topologia.nodos) - {primero}):
+        try:
+            ejecutar(topologia, node_id, "RECARGAR_TOPOLOGIA", timeout)
+        except OSError as e:
+            # Un nodo caído la leerá al arrancar
+            print(f"Aviso: el nodo {node_id} no recargó la topología ({e})")
+
+def esperar_al_dia(topologia, part_index, destino, max_retraso, timeout):
+    limite = time.monotonic() + timeout
+    while True:
+        stats = json.loads(ejecutar(topologia, destino, "STATS", timeout))
+        retraso = stats.get('gauges', {}).get(f'replicacion.retraso_p{part_index}')
+        if retraso is not None and retraso <= max_retraso: return
+        if time.monotonic() > limite:
+            raise RuntimeError(f"el nodo {destino} no se puso al día con la partición {part_index}")
+        time.sleep(0.5)
+
+def main():
+    parser = argparse.ArgumentParser(description="Traslada (o copia) una partición de cuentas a otro nodo.")
+    parser.add_argument("--particion", type=int, required=True)
+    parser.add_argument("--origen", type=int, help="Nodo que deja la partición (sin él, el destino sólo se añade como réplica).")
+    parser.add_argument("--destino", type=int, required=True)
+    parser.add_argument("--direccion", metavar="HOST:PUERTO", help="Dirección del destino, si aún no figura en la topología.")
+    parser.add_argument("--topologia", default=os.path.join('data', ARCHIVO))
+    parser.add_argument("--max-retraso", type=float, default=1.0, help="Retraso en segundos con el que el destino se considera al día.")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Segundos máximos de espera de la copia.")
+    args = parser.parse_args()
+
+    inicial = Topologia.cargar(args.topologia)
+    p = args.particion
+    if p not in inicial.ubicacion: sys.exit(f"La partición {p} no existe (hay {inicial.particiones})")
+    nodos = inicial.ubicacion[p]
+    if args.destino in nodos: sys.exit(f"El nodo {args.destino} ya contiene la partición {p}")
+    if args.origen is not None and args.origen not in nodos: sys.exit(f"El nodo {args.origen} no contiene la partición {p}")
+    if args.direccion: inicial.nodos[args.destino] = args.direccion
+    if not inicial.nodos.get(args.destino): sys.exit(f"Falta la dirección del nodo {args.destino} (--direccion)")
+
+    copia = inicial.con_ubicacion(p, nodos + [args.destino])
+    try:
+        print(f"Copiando la partición {p} al nodo {args.destino}...")
+        publicar(copia, args.topologia, args.destino, 10.0)
+        esperar_al_dia(copia, p, args.destino, args.max_retraso, args.timeout)
+        if args.origen is None:
+            print(f"El nodo {args.destino} es réplica de la partición {p} (topología v{copia.version}).")
+            return
+        if copia.primario(p) == args.origen:
+            seq = ejecutar(copia, args.origen, f"CEDER_PARTICION|{p}|{args.destino}", 60.0)
+            print(f"Nodo {args.origen} cedió la partición en el cambio {seq}")
+        final = copia.con_ubicacion(p, [args.destino if n == args.origen else n for n in nodos])
+        publicar(final, args.topologia, args.destino, 10.0)
+    except (OSError, RuntimeError, ValueError) as e:
+        print(f"Error: {e}. Volviendo a la topología inicial.")
+        inicial.version = copia.version + 1
+        publicar(inicial, args.topologia, nodos[0], 10.0)
+        sys.exit(1)
+    print(f"Partición {p}: nodos {final.ubicacion[p]} (topología v{final.version}).")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+import os
+import json
+import time
+import socket
+import logging
+import itertools
+import threading
+from collections import deque
+
+from storage import particion_de, ParticionTrasladada, EscrituraEnReplica
+from topologia import cargar_topologia
+from metrics import METRICS
+
+MAX_CAMBIOS_POR_ENVIO = 1000 # Cambios por petición REPLICAR
+MAX_OPS_POR_FRAGMENTO = 5000 # Registros por petición al enviar el estado completo de una partición
+EPOCA_NUEVA = 'nueva'        # Posición de un nodo que aún no tiene la partición (ver Replicator.posicion)
+
+def enviar(direccion, request, timeout):
+    """Envía una petición `EXECUTE|...` a otro nodo y devuelve `(estado, datos)` de su respuesta."""
+    host, port = direccion.rsplit(':', 1)
+    with socket.create_connection((host, int(port)), timeout=timeout) as sock:
+        sock.sendall((request + '\n').encode('utf-8'))
+        data = b''
+        while not data.endswith(b'\n'):
+            chunk = sock.recv(65536)
+            if not chunk: break
+            data += chunk
+    parts = data.decode('utf-8').strip().split('|', 3)
+    if len(parts) < 3 or parts[0] != 'RESULT':
+        raise OSError(f"respuesta inválida: {data[:80]!r}")
+    return parts[2], parts[3] if len(parts) > 3 else ''
+
+class ReplicationLog:
+    """Cambios confirmados de una partición de la que este nodo es primario.
+
+    Cada cambio (las operaciones de un commit o de un lote) recibe un número
+    de secuencia consecutivo. Sólo se guardan los últimos `max_cambios`: una
+    réplica que quedó más atrás recibe el estado completo de la partición.
+    La `epoca` identifica esta serie de números; cambia cada vez que el nodo
+    arranca, porque el búfer no sobrevive a un reinicio.
+    """
+
+    def __init__(self, max_cambios):
+        self.epoca = os.urandom(6).hex()
+        self.seq = 0
+        self.cambios = deque(maxlen=max_cambios) # (seq, ops)
+        self.cond = threading.Condition()
+
+    def append(self, ops):
+        with self.cond:
+            self.seq += 1
+            self.cambios.append((self.seq, ops))
+            self.cond.notify_all()
+
+    def contiene(self, epoca, seq):
+        """¿Puede continuar desde `seq` una réplica que está en la época `epoca`?"""
+        with self.cond:
+            if epoca != self.epoca or seq > self.seq: return False
+            return seq == self.seq or (bool(self.cambios) and self.cambios[0][0] <= seq + 1)
+
+    def siguientes(self, seq, timeout):
+        """Cambios posteriores a `seq` y el último número asignado, esperando
+        hasta `timeout` segundos si no hay ninguno; None si ya no están en el búfer."""
+        with self.cond:
+            if self.seq == seq:
+                self.cond.wait(timeout)
+            if self.seq == seq: return [], seq
+            primero = self.cambios[0][0] if self.cambios else self.seq + 1
+            if not primero <= seq + 1 <= self.seq: return None
+            inicio = seq + 1 - primero
+            return list(itertools.islice(self.cambios, inicio, inicio + MAX_CAMBIOS_POR_ENVIO)), self.seq
+
+class ReplicaState:
+    """Posición de este nodo como réplica de una partición: hasta qué cambio del primario tiene aplicado."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.epoca = None        # None: sin posición válida (hace falta el estado completo)
+        self.seq = 0
+        self.al_dia_desde = None # time.monotonic() de la última vez que no faltaba ningún cambio
+
+    def retraso(self):
+        """Segundos desde que la réplica estuvo al día por última vez (infinito si nunca)."""
+        if self.epoca is None or self.al_dia_desde is None: return float('inf')
+        return time.monotonic() - self.al_dia_desde
+
+class Shipper(threading.Thread):
+    """Envía a una réplica, en orden, los cambios de una partición primaria.
+
+    Al conectar pregunta la posición de la réplica y continúa desde ahí si
+    el búfer aún tiene esos cambios; si no, le envía el estado completo (o,
+    si el nodo aún no tiene la partición, sus archivos completos). Sin
+    cambios nuevos envía un latido cada `latido` segundos, para que la réplica
+    sepa que sigue al día. `pos` es el último cambio que la réplica confirmó.
+    """
+
+    def __init__(self, replicator, part_index, direccion):
+        super().__init__(name=f"replicacion-p{part_index}-{direccion}", daemon=True)
+        self.replicator = replicator
+        self.part_index = part_index
+        self.direccion = direccion
+        self.log = replicator.logs[part_index]
+        self.activo = True
+        self.pos = None
+
+    def detener(self):
+        """El hilo termina tras su envío o su espera en curso."""
+        self.activo = False
+
+    def request(self, query):
+        return enviar(self.direccion, f"EXECUTE|rep{self.part_index}|{query}", self.replicator.timeout)
+
+    def enviar_cambios(self, desde, hasta, al_dia, cambios):
+        payload = json.dumps(cambios, separators=(',', ':'))
+        estado, datos = self.request(f"REPLICAR|{self.part_index}|{self.log.epoca}|{desde}|{hasta}|{int(al_dia)}|{payload}")
+        if estado != 'SUCCESS': raise RuntimeError(datos)
+
+    def sincronizar(self):
+        """Posición desde la que continuar con la réplica, enviándole antes el estado completo si hace falta."""
+        estado, datos = self.request(f"REPLICA_POSICION|{self.part_index}")
+        if estado != 'SUCCESS': raise RuntimeError(datos)
+        epoca, seq = datos.split('|')
+        if self.log.contiene(epoca, int(seq)): return int(seq)
+        nueva = epoca == EPOCA_NUEVA
+        ops, seq = self.replicator.snapshot(self.part_index, completo=nueva)
+        fragmentos = [ops[i:i + MAX_OPS_POR_FRAGMENTO] for i in range(0, len(ops), MAX_OPS_POR_FRAGMENTO)] or [[]]
+        for k, fragmento in enumerate(fragmentos):
+            # Sólo el último fragmento fija la posición: si el envío se corta, se empieza de nuevo
+            self.enviar_cambios(0, seq if k == len(fragmentos) - 1 else -1, False, [fragmento])
+        METRICS.count('replicacion.estados_completos')
+        logging.info(f"Replicación: {'partición' if nueva else 'estado completo de la partición'} {self.part_index} "
+                     f"enviado a {self.direccion} ({len(ops)} registros, cambio {seq})")
+        return seq
+
+    def run(self):
+        fallando = False
+        while self.activo:
+            try:
+                if self.pos is None:
+                    self.pos = self.sincronizar()
+                siguientes = self.log.siguientes(self.pos, self.replicator.latido)
+                if siguientes is None:
+                    self.pos = None # La réplica quedó fuera del búfer
+                    continue
+                cambios, ultimo = siguientes
+                hasta = cambios[-1][0] if cambios else self.pos
+                self.enviar_cambios(self.pos + 1, hasta, hasta == ultimo, [ops for _, ops in cambios])
+                METRICS.count('replicacion.cambios_enviados', len(cambios))
+                self.pos = hasta
+                if fallando:
+                    logging.info(f"Replicación de la partición {self.part_index} a {self.direccion} restablecida")
+                    fallando = False
+            except (OSError, RuntimeError, ValueError) as e:
+                if not fallando:
+                    logging.warning(f"Replicación de la partición {self.part_index} a {self.direccion}: {e}; reintentando")
+                    fallando = True
+                self.pos = None
+                time.sleep(self.replicator.reintento)
+
+class Replicator:
+    """Replicación asíncrona de las particiones del nodo (primario -> réplicas).
+
+    Qué particiones contiene el nodo, y de cuáles es primario, lo dice la
+    topología (ver topologia.py), que se lee de `ruta_topologia`; `direcciones`
+    (la k-ésima es la del nodo k) reemplaza a las direcciones del archivo.
+    Como primario registra cada cambio confirmado (ver NodeStore.commit) y un
+    hilo por réplica se los envía; como réplica aplica lo que recibe con
+    REPLICAR y rechaza las lecturas de esa partición si lleva más de
+    `max_retraso` segundos sin estar al día (0 = sin límite).
+
+    `reconfigurar` aplica una topología nueva sin detener el nodo: arranca o
+    detiene los envíos, cambia de papel y retira las particiones que el nodo
+    ya no contiene. Una réplica nueva que aún no tiene la partición la recibe
+    completa (cuentas, préstamos e historial) y después sigue al día como las
+    demás; con `ceder`, el primario deja de aceptar cambios para que otro nodo
+    ocupe su lugar (ver rebalancear.py).
+    """
+
+    def __init__(self, store, node_id, ruta_topologia, direcciones=None, max_retraso=0, latido=0.5, max_cambios=100000,
+                 timeout=10.0, reintento=1.0):
+        self.store = store
+        self.node_id = node_id
+        self.ruta_topologia = ruta_topologia
+        self.direcciones = direcciones
+        self.max_retraso = max_retraso
+        self.latido = latido
+        self.max_cambios = max_cambios
+        self.timeout = timeout
+        self.reintento = reintento
+        self.mutex = threading.Lock() # Serializa las reconfiguraciones
+        self.topologia = None
+        self.logs = {}     # part_index -> ReplicationLog (particiones primarias)
+        self.shippers = {} # (part_index, dirección) -> Shipper
+        self.replicas = {} # part_index -> ReplicaState (particiones replicadas)
+        self.cedidas = {}  # part_index -> nodo al que este primario cedió la partición
+        self.local = threading.local()
+
+    def start(self, topologia):
+        self.reconfigurar(topologia)
+
+    def recargar(self):
+        """Vuelve a leer el archivo de topología y lo aplica."""
+        return self.reconfigurar(cargar_topologia(self.ruta_topologia, self.direcciones))
+
+    def reconfigurar(self, topologia):
+        with self.mutex:
+            if self.topologia is not None and topologia.particiones != self.topologia.particiones:
+                raise ValueError(f"La topología tiene {topologia.particiones} particiones y el nodo usa "
+                                 f"{self.topologia.particiones}: hay que regenerar los datos")
+            propias = {part_index for part_index in topologia.particiones_de(self.node_id)
+                       if self.store.particiones is None or part_index in self.store.particiones}
+            if self.topologia is None:
+                # Al arrancar no se borra nada: una partición fuera de la topología sólo deja de replicarse
+                for part_index in sorted(set(self.store.cuentas) - propias):
+                    logging.warning(f"Replicación: la partición {part_index} no es de este nodo según la topología")
+            for part_index in sorted((set(self.logs) | set(self.replicas)) - propias):
+                self.detener_envios(part_index)
+                self.logs.pop(part_index, None)
+                self.replicas.pop(part_index, None)
+                self.cedidas.pop(part_index, None)
+                self.store.retirar_particion(part_index)
+            for part_index in sorted(propias):
+                if topologia.primario(part_index) == self.node_id:
+                    self.ser_primario(part_index, topologia)
+                else:
+                    self.ser_replica(part_index)
+            self.topologia = topologia
+        logging.info(f"Replicación (topología v{topologia.version}): primario de {sorted(self.logs)}, "
+                     f"réplica de {sorted(self.replicas)}")
+        return f"SUCCESS|{topologia.version}"
+
+    def ser_primario(self, part_index, topologia):
+        if part_index not in self.logs:
+            if part_index not in self.store.cuentas:
+                logging.error(f"Replicación: el nodo no tiene la partición {part_index} y no puede ser su primario")
+                return
+            self.replicas.pop(part_index, None)
+            self.logs[part_index] = ReplicationLog(self.max_cambios)
+        self.cedidas.pop(part_index, None)
+        destinos = set()
+        for node_id in topologia.replicas(part_index):
+            direccion = topologia.nodos.get(node_id)
+            if direccion: destinos.add(direccion)
+            else: logging.error(f"Replicación: la topología no tiene la dirección del nodo {node_id}")
+        for (p, direccion), shipper in list(self.shippers.items()):
+            if p == part_index and direccion not in destinos:
+                shipper.detener()
+                del self.shippers[(p, direccion)]
+        for direccion in sorted(destinos):
+            if (part_index, direccion) not in self.shippers:
+                shipper = self.shippers[(part_index, direccion)] = Shipper(self, part_index, direccion)
+                shipper.start()
+
+    def ser_replica(self, part_index):
+        self.detener_envios(part_index)
+        if self.logs.pop(part_index, None) is not None:
+            self.cedidas.pop(part_index, None)
+            logging.info(f"Replicación: el nodo deja de ser primario de la partición {part_index}")
+        if part_index not in self.replicas:
+            self.replicas[part_index] = ReplicaState()
+            METRICS.gauge(f'replicacion.retraso_p{part_index}', lambda part_index=part_index: self.retraso(part_index))
+
+    def detener_envios(self, part_index):
+        for (p, direccion), shipper in list(self.shippers.items()):
+            if p == part_index:
+                shipper.detener()
+                del self.shippers[(p, direccion)]
+
+    def retraso(self, part_index):
+        """Retraso de la réplica de la partición, en segundos (None si no lo es o aún no se sincronizó)."""
+        estado = self.replicas.get(part_index)
+        if estado is None or estado.retraso() == float('inf'): return None
+        return round(estado.retraso(), 3)
+
+    # --- Primario ---
+
+    def registrar(self, part_index, ops):
+        """Registra un cambio confirmado de la partición (se llama con sus cuentas bloqueadas)."""
+        log = self.logs.get(part_index)
+        if log is not None:
+            log.append(ops)
+
+    def snapshot(self, part_index, completo=False):
+        """Estado de la partición y el número del último cambio que incluye. Con
+        `completo`, los archivos completos, para un nodo que no tiene la partición."""
+        with self.store.locks.particiones([part_index]):
+            ops = self.store.exportar_particion(part_index) if completo else self.store.replica_snapshot(part_index)
+            return ops, self.logs[part_index].seq
+
+    def verificar_escritura(self, part_index):
+        """Rechaza los cambios de una partición ya cedida o de la que el nodo es
+        réplica (se llama antes de aplicarlos). Un cambio aceptado por una réplica
+        no llegaría al primario y se perdería al resincronizarse con él."""
+        destino = self.cedidas.get(part_index)
+        if destino is not None:
+            raise ParticionTrasladada(f"La partición {part_index} se trasladó al nodo {destino}; reintente la operación")
+        if part_index in self.replicas and not getattr(self.local, 'aplicando', False):
+            raise EscrituraEnReplica(f"Este nodo es réplica de la partición {part_index}: los cambios sólo los acepta su primario")
+
+    def ceder(self, part_index, destino, timeout=30.0):
+        """Deja de aceptar cambios de la partición en cuanto el nodo `destino` los tiene todos.
+
+        Con la partición en modo S no se confirma ningún cambio mientras se
+        espera a que la réplica alcance el último; a partir de ahí los cambios
+        se rechazan con ParticionTrasladada hasta que la nueva topología llega
+        a este nodo.
+        """
+        with self.mutex:
+            log = self.logs.get(part_index)
+            if log is None: return f"ERROR|Este nodo no es primario de la partición {part_index}"
+            shipper = self.shippers.get((part_index, self.topologia.nodos.get(destino)))
+            if shipper is None: return f"ERROR|El nodo {destino} no es réplica de la partición {part_index}"
+            limite = time.monotonic() + timeout
+            with self.store.locks.particiones([part_index]):
+                while shipper.pos != log.seq:
+                    if time.monotonic() > limite:
+                        return f"ERROR|El nodo {destino} no alcanzó el cambio {log.seq} de la partición {part_index}"
+                    time.sleep(0.01)
+                self.cedidas[part_index] = destino
+        logging.info(f"Replicación: partición {part_index} cedida al nodo {destino} en el cambio {log.seq}")
+        return f"SUCCESS|{log.seq}"
+
+    # --- Réplica ---
+
+    def posicion(self, part_index):
+        estado = self.replicas.get(part_index)
+        if estado is None: return f"ERROR|Este nodo no es réplica de la partición {part_index}"
+        if part_index not in self.store.cuentas:
+            self.store.descartar_recepcion(part_index) # El primario empieza a enviarla de nuevo
+            return f"SUCCESS|{EPOCA_NUEVA}|0"
+        return f"SUCCESS|{estado.epoca or '-'}|{estado.seq}"
+
+    def aplicar(self, part_index, epoca, desde, hasta, al_dia, cambios):
+        """Aplica los cambios `desde..hasta` del primario; `desde=0` es un fragmento del estado completo."""
+        estado = self.replicas.get(part_index)
+        if estado is None: return f"ERROR|Este nodo no es réplica de la partición {part_index}"
+        with estado.lock:
+            if desde != 0 and (epoca != estado.epoca or desde != estado.seq + 1):
+                return f"ERROR|Posición de réplica inválida ({estado.epoca or '-'}, {estado.seq})"
+            ops = [op for cambio in cambios for op in cambio]
+            if desde == 0 and part_index not in self.store.cuentas:
+                # Fragmento de los archivos de una partición que el nodo aún no tiene
+                self.store.recibir_particion(part_index, ops, hasta >= 0)
+            else:
+                self.local.aplicando = True
+                try:
+                    if ops: self.store.apply_replicated(ops)
+                finally:
+                    self.local.aplicando = False
+            if desde == 0:
+                estado.epoca, estado.seq = (epoca, hasta) if hasta >= 0 else (None, 0)
+            else:
+                estado.seq = hasta
+            if al_dia: estado.al_dia_desde = time.monotonic()
+        METRICS.count('replicacion.cambios_aplicados', len(cambios))
+        return f"SUCCESS|{estado.seq}"
+
+    def es_replica(self, id_cuenta):
+        """Si la cuenta está en una partición de la que este nodo es réplica."""
+        return str(id_cuenta).isdigit() and particion_de(id_cuenta) in self.replicas
+
+    def verificar_lectura(self, id_cuenta):
+        """Motivo para no servir una lectura de la cuenta en esta réplica, o None si puede servirse."""
+        if not str(id_cuenta).isdigit(): return None
+        part_index = particion_de(id_cuenta)
+        estado = self.replicas.get(part_index)
+        if estado is None: return None
+        if part_index not in self.store.cuentas:
+            return f"Réplica inaccesible para lectura: la partición {part_index} aún se está recibiendo"
+        if not self.max_retraso: return None
+        retraso = estado.retraso()
+        if retraso <= self.max_retraso: return None
+        detalle = "sin sincronizar" if retraso == float('inf') else f"retraso de {retraso:.1f} s"
+        return f"Réplica inaccesible para lectura: {detalle} (máximo {self.max_retraso} s)"
@@ -0,0 +1,1042 @@
+import os
+import gc
+import mmap
+import time
+import zlib
+import struct
+import logging
+import threading
+from functools import partial
+from collections import namedtuple
+from contextlib import contextmanager
+
+import indices
+from wal import WriteAheadLog
+from metrics import METRICS
+from history import HistoryStore
+from montos import parse_monto, format_monto
+from mvcc import VersionStore
+from topologia import PARTICIONES_DEFECTO
+
+NUM_PARTICIONES = PARTICIONES_DEFECTO # Lo fija configurar_particiones según la topología (ver topologia.py)
+
+# Registros inmutables: las actualizaciones crean un registro nuevo con _replace.
+# Los montos (saldo, monto_total, monto_pagado) son enteros de céntimos (ver montos.py).
+Cuenta = namedtuple('Cuenta', ['id', 'cliente', 'saldo', 'fecha'])
+Prestamo = namedtuple('Prestamo', ['id', 'cliente', 'monto_total', 'monto_pagado', 'estado', 'fecha_limite'])
+
+class ParticionTrasladada(Exception):
+    """Cambio rechazado porque el nodo ya cedió la partición a su nuevo primario."""
+
+class EscrituraEnReplica(Exception):
+    """Cambio rechazado porque el nodo es réplica de la partición: sólo su primario acepta cambios."""
+
+def configurar_particiones(num_particiones):
+    """Fija el número de particiones de cuentas; debe llamarse antes de cargar ningún dato."""
+    global NUM_PARTICIONES
+    NUM_PARTICIONES = num_particiones
+
+def particion_de(id_cuenta):
+    return (int(id_cuenta) - 1) % NUM_PARTICIONES + 1
+
+def particion_de_cliente(cliente):
+    """Partición de la cuenta de un cliente (`cliente_25` -> la de la cuenta 25), o None."""
+    id_cuenta = cliente.rpartition('_')[2]
+    return particion_de(id_cuenta) if id_cuenta.isdigit() else None
+
+def particiones_de_nodo(node_data_dir):
+    """Particiones de cuentas presentes en el directorio de un nodo (en `.txt` o `.dat`)."""
+    return [i for i in range(1, NUM_PARTICIONES + 1)
+            if any(os.path.exists(os.path.join(node_data_dir, f"cuentas_part{i}.{ext}")) for ext in ('txt', 'dat'))]
+
+def format_cuenta(cuenta):
+    return f"{cuenta.id},{cuenta.cliente},{format_monto(cuenta.saldo)},{cuenta.fecha}\n"
+
+def parse_cuenta(line):
+    campos = line.strip().split(',')
+    try:
+        return Cuenta(campos[0], campos[1], parse_monto(campos[2]), campos[3])
+    except (IndexError, ValueError):
+        return None
+
+def format_prestamo(prestamo):
+    return (f"{prestamo.id},{prestamo.cliente},{format_monto(prestamo.monto_total)},{format_monto(prestamo.monto_pagado)},"
+            f"{prestamo.estado},{prestamo.fecha_limite}\n")
+
+def parse_prestamo(line):
+    campos = line.strip().split(',')
+    try:
+        return Prestamo(campos[0], campos[1], parse_monto(campos[2]), parse_monto(campos[3]), campos[4], campos[5])
+    except (IndexError, ValueError):
+        return None
+
+@contextmanager
+def sin_gc():
+    """Pausa el recolector de ciclos durante una carga masiva.
+
+    Los registros (tuplas) no forman ciclos, pero cada colección recorrería
+    todos los ya creados. Al terminar se congelan (`gc.freeze`) para que las
+    colecciones posteriores tampoco los recorran; se liberan igual por conteo
+    de referencias.
+    """
+    activo = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        gc.freeze()
+        if activo: gc.enable()
+
+def write_atomic(file_path, lines):
+    """Reescribe un archivo sin dejarlo nunca a medio escribir: temporal + fsync + rename."""
+    start = time.perf_counter()
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(tmp_path, file_path)
+    METRICS.io('reescritura', time.perf_counter() - start, bytes_escritos=size)
+
+class TextPartition:
+    """Archivo de partición `tabla_partN.txt` cargado en memoria con un índice id -> registro.
+
+    Con `con_indice`, los registros ya interpretados se guardan en
+    `tabla_partN.txt.idx` (ver indices.py) y, mientras el archivo no cambie,
+    las cargas siguientes los toman de ahí en lugar de interpretar cada línea.
+    """
+
+    parse = None
+    format = None
+    record = None # namedtuple de los registros, para reconstruirlos desde el índice guardado
+
+    def __init__(self, part_index, file_path, con_indice=False):
+        self.part_index = part_index
+        self.file_path = file_path
+        self.lines = []      # Líneas del archivo en su orden original
+        self.positions = {}  # id -> índice en self.lines
+        self.records = {}    # id -> registro
+        self.pendientes = {} # id -> última línea confirmada de un registro cambiado por un lote abierto
+        self.io_lock = threading.Lock() # Serializa las reescrituras del archivo
+        self.con_indice = con_indice
+        self.firma_indice = None # Firma del archivo descrito por el último índice guardado o cargado
+        self.load()
+
+    def load(self):
+        firma = indices.firma(self.file_path) if self.con_indice else None
+        with open(self.file_path, 'r', encoding='utf-8') as f:
+            self.lines = f.readlines()
+        if self.con_indice and self.cargar_indice(firma): return
+        for i, line in enumerate(self.lines):
+            record = type(self).parse(line)
+            if record is None: continue # Ignorar líneas malformadas
+            self.positions[record.id] = i
+            self.records[record.id] = record
+        if self.con_indice:
+            self.guardar_indice((firma, self.registros(), self.positions))
+
+    def cargar_indice(self, firma):
+        """Toma los registros del índice guardado si describe el archivo recién leído (`firma`)."""
+        guardado = indices.cargar(self.file_path)
+        if guardado is None or tuple(guardado[0]) != firma or indices.firma(self.file_path) != firma:
+            METRICS.count('indices.reconstruidos')
+            return False
+        columnas, posiciones = guardado[1]
+        ids = columnas[0]
+        self.records = dict(zip(ids, map(partial(tuple.__new__, type(self).record), zip(*columnas))))
+        self.positions = dict(zip(ids, posiciones))
+        self.firma_indice = firma
+        METRICS.count('indices.cargados')
+        return True
+
+    def toma_indice(self):
+        """Firma del archivo y copia de los registros si el archivo cambió desde el último índice, o None.
+        Se llama con la partición bloqueada y sin cambios pendientes de persistir."""
+        firma = indices.firma(self.file_path)
+        if firma == self.firma_indice: return None
+        return firma, self.registros(), dict(self.positions)
+
+    def guardar_indice(self, toma):
+        """Guarda por columnas (con las posiciones de sus líneas) los registros de `toma_indice`."""
+        firma, registros, positions = toma
+        columnas = tuple(zip(*registros)) or ((),) * len(type(self).record._fields)
+        indices.guardar(self.file_path, firma, (columnas, tuple(map(positions.__getitem__, columnas[0]))))
+        self.firma_indice = firma
+
+    def get(self, item_id):
+        return self.records.get(str(item_id))
+
+    def put(self, record):
+        """Reemplaza un registro existente en memoria (sin persistir)."""
+        self.records[record.id] = record
+        self.lines[self.positions[record.id]] = type(self).format(record)
+
+    def agregar(self, record):
+        """Reemplaza el registro o, si no existe, lo añade al final (sin persistir)."""
+        if record.id not in self.positions:
+            self.positions[record.id] = len(self.lines)
+            self.lines.append(type(self).format(record))
+        self.put(record)
+
+    def pendiente(self, item_id):
+        """Marca un registro que un lote va a cambiar: hasta `confirmada`, los
+        guardados escriben su línea confirmada y no la del lote."""
+        self.pendientes.setdefault(item_id, self.lines[self.positions[item_id]])
+
+    def confirmada(self, item_id):
+        """El registro en memoria vuelve a ser el confirmado (lote persistido o deshecho)."""
+        self.pendientes.pop(item_id, None)
+
+    def registros(self):
+        return list(self.records.values())
+
+    def __len__(self):
+        return len(self.records)
+
+    def save(self):
+        with self.io_lock:
+            self.persist(self.snapshot())
+
+    def snapshot(self):
+        """Copia del contenido confirmado, sin los cambios de lotes abiertos de otros hilos."""
+        lines = list(self.lines) # Antes que `pendientes`: `pendiente` marca antes de que cambie la línea
+        for item_id, line in list(self.pendientes.items()):
+            lines[self.positions[item_id]] = line
+        return lines
+
+    def persist(self, snapshot):
+        write_atomic(self.file_path, snapshot)
+
+    def close(self):
+        pass # El archivo sólo se abre para leerlo o reescribirlo
+
+class AccountPartition(TextPartition):
+    """Partición de cuentas con la suma de sus saldos mantenida en cada cambio."""
+
+    parse = parse_cuenta
+    format = format_cuenta
+    record = Cuenta
+
+    def load(self):
+        super().load()
+        self.total_lock = threading.Lock() # Cambios concurrentes de cuentas distintas (modo IX)
+        self.saldo_total = self.sum_records()
+
+    def put(self, record):
+        with self.total_lock:
+            self.saldo_total += record.saldo - self.records[record.id].saldo
+            super().put(record)
+
+    def total(self):
+        return self.saldo_total
+
+    def saldos(self):
+        """Pares (id, saldo) de todas las cuentas de la partición."""
+        return [(cuenta.id, cuenta.saldo) for cuenta in self.records.values()]
+
+    def sum_records(self):
+        return sum(cuenta.saldo for cuenta in self.records.values())
+
+    def disk_total(self):
+        """Suma los saldos leyendo el archivo de la partición."""
+        total = 0
+        with open(self.file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                cuenta = parse_cuenta(line)
+                if cuenta is not None: total += cuenta.saldo
+        return total
+
+# --- Almacenamiento binario de ancho fijo para cuentas ---
+#
+# `cuentas_partN.dat` = cabecera + un registro de ancho fijo por id. Los ids son
+# enteros densos repartidos en round-robin entre particiones, así que la cuenta
+# `id` ocupa el hueco `(id - 1) // NUM_PARTICIONES` de su partición y su
+# posición en el archivo se calcula sin buscarla. El saldo se guarda en
+# céntimos (int64); un hueco con id 0 está vacío.
+MMAP_MAGIC = b'CTAS'
+MMAP_HEADER = struct.Struct('<4sIII')      # magia, tamaño de registro, número de particiones, partición
+MMAP_RECORD = struct.Struct('<Iq24s10s')   # id, saldo en céntimos, cliente, fecha
+MMAP_SALDO = struct.Struct('<q')
+MMAP_SALDO_OFFSET = 4
+
+def slot_de(id_cuenta):
+    return (int(id_cuenta) - 1) // NUM_PARTICIONES
+
+def pack_cuenta(cuenta):
+    return MMAP_RECORD.pack(int(cuenta.id), cuenta.saldo,
+                            cuenta.cliente.encode('utf-8'), cuenta.fecha.encode('utf-8'))
+
+def convertir_cuentas(txt_path, dat_path, part_index):
+    """Convierte `cuentas_partN.txt` al formato binario de ancho fijo, línea a línea.
+
+    Devuelve el número de cuentas escritas. Los huecos sin cuenta quedan a cero.
+    Con el `.dat` ya en disco borra el `.txt` (y su índice guardado): desde
+    entonces los cambios sólo van al `.dat`, y un `.txt` que quedara se
+    desactualizaría.
+    """
+    tmp_path = dat_path + '.tmp'
+    count = 0
+    with open(txt_path, 'r', encoding='utf-8') as src, open(tmp_path, 'wb') as dst:
+        dst.write(MMAP_HEADER.pack(MMAP_MAGIC, MMAP_RECORD.size, NUM_PARTICIONES, part_index))
+        for line in src:
+            cuenta = parse_cuenta(line)
+            if cuenta is None: continue # Ignorar líneas malformadas
+            if particion_de(cuenta.id) != part_index or len(cuenta.cliente.encode('utf-8')) > 24:
+                raise ValueError(f"{txt_path}: la cuenta {cuenta.id} no cabe en el formato binario de la partición {part_index}")
+            dst.seek(MMAP_HEADER.size + slot_de(cuenta.id) * MMAP_RECORD.size)
+            dst.write(pack_cuenta(cuenta))
+            count += 1
+        dst.flush()
+        os.fsync(dst.fileno())
+    os.replace(tmp_path, dat_path)
+    os.remove(txt_path)
+    indices.borrar(txt_path)
+    return count
+
+class MmapAccountPartition:
+    """Partición `cuentas_partN.dat` accedida con mmap: O(1) por id y escrituras in situ.
+
+    Un cambio de saldo escribe los 8 bytes del saldo dentro del mapeo; `save`
+    pide al sistema (msync) que lleve a disco las páginas modificadas. Los
+    saldos que cambia un lote abierto quedan en `pendientes` y no llegan al
+    mapeo (ni, por tanto, al archivo) hasta que el lote se confirma.
+
+    Con `con_indice`, el número de cuentas y la suma de saldos se guardan en
+    `cuentas_partN.dat.idx` (ver indices.py) y se reutilizan mientras el CRC32
+    del archivo coincida, sin recorrer sus registros.
+    """
+
+    def __init__(self, part_index, file_path, con_indice=False):
+        self.part_index = part_index
+        self.file_path = file_path
+        self.io_lock = threading.Lock()
+        self.file = open(self.file_path, 'r+b')
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+        magic, record_size, num_particiones, file_part = MMAP_HEADER.unpack_from(self.mm, 0)
+        if (magic, record_size, num_particiones, file_part) != (MMAP_MAGIC, MMAP_RECORD.size, NUM_PARTICIONES, part_index):
+            raise ValueError(f"{self.file_path}: cabecera incompatible con la partición {part_index}")
+        self.total_lock = threading.Lock() # Cambios concurrentes de cuentas distintas (modo IX)
+        self.cambios = 0 # Saldos escritos desde la apertura (cada put lo incrementa antes de escribir)
+        self.cambios_indice = None # Valor de `cambios` cuando se guardó o cargó el índice
+        self.pendientes = {} # id -> saldo de una cuenta cambiada por un lote abierto
+        guardado = indices.cargar(self.file_path) if con_indice else None
+        if guardado is not None and tuple(guardado[0]) == self.firma():
+            self.count, self.saldo_total = guardado[1]
+            self.cambios_indice = 0
+            METRICS.count('indices.cargados')
+            return
+        self.count = sum(1 for rec_id, *_ in self._iter_records() if rec_id)
+        self.saldo_total = self.sum_records()
+        if con_indice:
+            METRICS.count('indices.reconstruidos')
+            self.guardar_indice((0, self.count, self.saldo_total))
+
+    def firma(self):
+        """Tamaño y CRC32 del mapeo: las escrituras in situ no cambian de forma fiable la fecha del archivo."""
+        return (len(self.mm), zlib.crc32(self.mm))
+
+    def toma_indice(self):
+        """Número de cuentas y suma de saldos si hubo cambios desde el último índice, o None.
+        Se llama con la partición bloqueada; el CRC lo calcula después guardar_indice, sin bloquearla."""
+        if self.cambios == self.cambios_indice: return None
+        return self.cambios, self.count, self.saldo_total
+
+    def guardar_indice(self, toma):
+        """Guarda el índice de `toma` si ningún saldo cambió mientras se calculaba el CRC del mapeo
+        (si cambió, el índice se guardará en el siguiente intento)."""
+        cambios, count, saldo_total = toma
+        firma = self.firma()
+        if self.cambios != cambios: return
+        indices.guardar(self.file_path, firma, (count, saldo_total))
+        self.cambios_indice = cambios
+
+    def _iter_records(self):
+        slots = (len(self.mm) - MMAP_HEADER.size) // MMAP_RECORD.size
+        return MMAP_RECORD.iter_unpack(memoryview(self.mm)[MMAP_HEADER.size:MMAP_HEADER.size + slots * MMAP_RECORD.size])
+
+    def _offset(self, item_id):
+        """Posición del registro de `item_id`, o None si no puede estar en esta partición."""
+        try:
+            id_num = int(item_id)
+        except ValueError:
+            return None
+        if id_num < 1 or particion_de(id_num) != self.part_index: return None
+        offset = MMAP_HEADER.size + slot_de(id_num) * MMAP_RECORD.size
+        if offset + MMAP_RECORD.size > len(self.mm): return None
+        return offset
+
+    def get(self, item_id):
+        offset = self._offset(item_id)
+        if offset is None: return None
+        rec_id, saldo, cliente, fecha = MMAP_RECORD.unpack_from(self.mm, offset)
+        if rec_id != int(item_id): return None
+        saldo = self.pendientes.get(str(rec_id), saldo)
+        return Cuenta(str(rec_id), cliente.rstrip(b'\0').decode('utf-8'), saldo, fecha.decode('utf-8'))
+
+    def put(self, record):
+        """Reemplaza el saldo de una cuenta existente en el mapeo (sin forzarlo a disco)
+        o, si la cambió un lote abierto, en `pendientes`."""
+        with self.total_lock:
+            if record.id in self.pendientes:
+                self.saldo_total += record.saldo - self.pendientes[record.id]
+                self.pendientes[record.id] = record.saldo
+                return
+            offset = self._offset(record.id) + MMAP_SALDO_OFFSET
+            self.saldo_total += record.saldo - MMAP_SALDO.unpack_from(self.mm, offset)[0]
+            self.escribir(offset, record.saldo)
+
+    def escribir(self, offset, saldo):
+        self.cambios += 1 # Antes de escribir: guardar_indice descarta un CRC calculado durante el cambio
+        MMAP_SALDO.pack_into(self.mm, offset, saldo)
+
+    def __len__(self):
+        return self.count
+
+    def total(self):
+        return self.saldo_total
+
+    def saldos(self):
+        return [(str(rec_id), saldo) for rec_id, saldo, _, _ in self._iter_records() if rec_id]
+
+    def registros(self):
+        return [Cuenta(str(rec_id), cliente.rstrip(b'\0').decode('utf-8'), saldo, fecha.decode('utf-8'))
+                for rec_id, saldo, cliente, fecha in self._iter_records() if rec_id]
+
+    def sum_records(self):
+        return sum(saldo for rec_id, saldo, _, _ in self._iter_records() if rec_id)
+
+    def disk_total(self):
+        """Suma los saldos leyendo el archivo `.dat` (no el mapeo)."""
+        total = 0
+        with open(self.file_path, 'rb') as f:
+            f.seek(MMAP_HEADER.size)
+            while True:
+                chunk = f.read(MMAP_RECORD.size * 4096)
+                chunk = chunk[:len(chunk) - len(chunk) % MMAP_RECORD.size]
+                if not chunk: break
+                total += sum(saldo for rec_id, saldo, _, _ in MMAP_RECORD.iter_unpack(chunk) if rec_id)
+        return total
+
+    def pendiente(self, item_id):
+        """Marca una cuenta que un lote va a cambiar: hasta `confirmada`, sus saldos no se escriben en el mapeo."""
+        with self.total_lock:
+            if item_id not in self.pendientes:
+                self.pendientes[item_id] = MMAP_SALDO.unpack_from(self.mm, self._offset(item_id) + MMAP_SALDO_OFFSET)[0]
+
+    def confirmada(self, item_id):
+        """Escribe en el mapeo el saldo pendiente de la cuenta (el del lote, o el anterior si se deshizo)."""
+        with self.total_lock:
+            saldo = self.pendientes.pop(item_id, None)
+            if saldo is not None: self.escribir(self._offset(item_id) + MMAP_SALDO_OFFSET, saldo)
+
+    def save(self):
+        with self.io_lock, METRICS.timer('io.msync'):
+            self.mm.flush()
+
+    def snapshot(self):
+        return None # Las páginas del mapeo ya contienen el estado
+
+    def persist(self, snapshot):
+        self.save()
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+class LoanPartition(TextPartition):
+    parse = parse_prestamo
+    format = format_prestamo
+    record = Prestamo
+
+class SharedLoanPartition(LoanPartition):
+    """Partición de préstamos cuyo archivo comparten varios procesos del nodo.
+
+    Cada proceso sólo carga los préstamos de los clientes de sus particiones
+    de cuentas (`propio(cliente)`), que son los únicos que modifica. Al
+    persistir vuelve a leer el archivo bajo un `flock` y reemplaza sólo esas
+    líneas, así que conserva lo que hayan escrito los demás procesos.
+    """
+
+    def __init__(self, part_index, file_path, propio, con_indice=False):
+        self.propio = propio
+        super().__init__(part_index, file_path, con_indice)
+
+    def load(self):
+        super().load()
+        for id_prestamo, prestamo in list(self.records.items()):
+            if not self.propio(prestamo.cliente):
+                del self.records[id_prestamo]
+                del self.positions[id_prestamo]
+
+    def toma_indice(self):
+        return None # Sólo tiene los préstamos propios: el índice lo guarda la carga, con el archivo completo
+
+    def snapshot(self):
+        lines = super().snapshot()
+        return {id_prestamo: lines[i] for id_prestamo, i in self.positions.items()}
+
+    def persist(self, snapshot):
+        import fcntl
+        with open(self.file_path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX) # Se libera al cerrar el archivo
+            with open(self.file_path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+            for i, line in enumerate(lines):
+                own_line = snapshot.get(line.split(',', 1)[0])
+                if own_line is not None: lines[i] = own_line
+            write_atomic(self.file_path, lines)
+
+class Batch:
+    """Cambios de un lote aplicados en memoria y pendientes de persistir (ver NodeStore.batch)."""
+
+    def __init__(self):
+        self.ops = {}        # part_index -> operaciones para el WAL de esa partición
+        self.partitions = {} # particiones modificadas (dict usado como conjunto ordenado)
+        self.undo = []       # (partición, registro anterior) en orden de aplicación
+        self.history = []    # (part_index, fila, durable, fecha) para el historial
+        self.publicar = {}   # clave -> (part_index, registro) a publicar como versión (ver VersionStore)
+
+    def rollback(self):
+        """Deshace en memoria todo lo aplicado y descarta lo pendiente."""
+        for partition, record in reversed(self.undo):
+            partition.put(record)
+        self.confirmar()
+        self.__init__()
+
+    def confirmar(self):
+        """Deja que los guardados de las particiones incluyan lo aplicado (ver TextPartition.pendiente)."""
+        for partition, record in self.undo:
+            partition.confirmada(record.id)
+
+class NodeStore:
+    """Índices en memoria de todas las particiones que contiene un nodo.
+
+    Con `durabilidad='directo'` cada commit reescribe (de forma atómica) los
+    archivos afectados, o con `almacenamiento='mmap'` lleva a disco las páginas
+    de las cuentas modificadas. Con `durabilidad='wal'` cada commit añade un único
+    registro al WAL de la partición y un checkpoint en segundo plano vuelca
+    periódicamente el estado compactado a los archivos `.txt`.
+
+    Con `particiones` el almacén sólo carga esas particiones de cuentas (con
+    su historial y su WAL) y los préstamos de sus clientes; es el caso de cada
+    proceso hijo del modo multiproceso del worker.
+
+    Los registros de las particiones son el estado de trabajo de los escritores.
+    Cada commit confirmado se publica además como una versión en `versiones`, y
+    las lecturas `leer_*` (fuera de un lote de cambios) sólo ven versiones
+    publicadas, sin tomar bloqueos.
+
+    Con `con_indices` cada archivo de datos tiene al lado un índice guardado
+    (`.idx`, ver indices.py) con lo que se construye al cargarlo: al arrancar
+    sólo se vuelven a leer los archivos que cambiaron desde que se guardó.
+    `guardar_indices` los pone al día (periódicamente y al detener el nodo).
+    """
+
+    def __init__(self, node_data_dir, locks, durabilidad='directo', almacenamiento='texto',
+                 historial_fsync='lote', historial_intervalo=1.0, particiones=None, con_indices=False):
+        self.node_data_dir = node_data_dir
+        self.locks = locks
+        self.particiones = particiones # None: todas las del directorio
+        self.durabilidad = durabilidad
+        self.almacenamiento = almacenamiento
+        self.con_indices = con_indices
+        self.indices_lock = threading.Lock() # Un solo guardado de índices a la vez
+        self.cuentas = {}   # part_index -> AccountPartition
+        self.prestamos = {} # part_index -> LoanPartition
+        self.loan_location = {}    # id_prestamo -> part_index
+        self.loans_by_client = {}  # cliente -> [id_prestamo] en el orden de las particiones
+        self.wals = {}      # part_index -> WriteAheadLog
+        self.dirty = set()  # TextPartition pendientes de checkpoint
+        self.batches = threading.local() # Lote activo del hilo actual, si hay
+        self.replicacion = None # replication.Replicator, si el nodo replica sus particiones
+        self.versiones = VersionStore()
+        self.lecturas = threading.local() # Instantánea abierta por el hilo actual, si hay
+        self.recepciones = {} # part_index -> préstamos de una partición que se está recibiendo (ver recibir_particion)
+        start = time.perf_counter()
+        with sin_gc():
+            for i in range(1, NUM_PARTICIONES + 1):
+                propia = particiones is None or i in particiones
+                if propia and self.almacenamiento == 'mmap':
+                    self.load_mmap_partition(i)
+                elif propia and os.path.exists(self.table_path('cuentas', i, 'dat')):
+                    raise ValueError(f"{self.table_path('cuentas', i, 'dat')}: la partición {i} está en formato binario; "
+                                     f"arranque el nodo con --almacenamiento mmap")
+                elif propia and os.path.exists(self.table_path('cuentas', i)):
+                    self.cuentas[i] = AccountPartition(i, self.table_path('cuentas', i), con_indices)
+                if not os.path.exists(self.table_path('prestamos', i)):
+                    continue
+                if particiones is None:
+                    self.prestamos[i] = LoanPartition(i, self.table_path('prestamos', i), con_indices)
+                else:
+                    self.prestamos[i] = SharedLoanPartition(i, self.table_path('prestamos', i),
+                                                            lambda cliente: particion_de_cliente(cliente) in particiones, con_indices)
+            self.index_prestamos()
+            self.historial = HistoryStore(node_data_dir, locks, historial_fsync, historial_intervalo, con_indices=con_indices)
+            self.historial.load(self.cuentas)
+            if self.durabilidad == 'wal':
+                self.recover()
+        for part_index, partition in self.cuentas.items():
+            self.versiones.base(('T', part_index), partition.total())
+        logging.info(f"Índice de cuentas cargado: {sum(len(p) for p in self.cuentas.values())} cuentas en particiones {sorted(self.cuentas)}"
+                     f" en {time.perf_counter() - start:.2f} s")
+
+    def table_path(self, tabla, part_index, ext='txt'):
+        return os.path.join(self.node_data_dir, f"{tabla}_part{part_index}.{ext}")
+
+    def load_mmap_partition(self, part_index):
+        """Abre `cuentas_partN.dat`, generándolo a partir del `.txt` la primera vez."""
+        dat_path = self.table_path('cuentas', part_index, 'dat')
+        txt_path = self.table_path('cuentas', part_index)
+        if not os.path.exists(dat_path):
+            if not os.path.exists(txt_path): return
+            count = convertir_cuentas(txt_path, dat_path, part_index)
+            logging.info(f"Convertido {txt_path} a formato binario: {count} cuentas")
+        self.cuentas[part_index] = MmapAccountPartition(part_index, dat_path, self.con_indices)
+
+    def partition_for(self, id_cuenta):
+        part_index = particion_de(id_cuenta)
+        partition = self.cuentas.get(part_index)
+        if partition is None:
+            ext = 'dat' if self.almacenamiento == 'mmap' else 'txt'
+            return None, f"Archivo no encontrado: {self.table_path('cuentas', part_index, ext)}"
+        return partition, None
+
+    def get_cuenta(self, id_cuenta):
+        partition, err = self.partition_for(id_cuenta)
+        if err: return None, err
+        cuenta = partition.get(id_cuenta)
+        if cuenta is None: return None, "ID no encontrado"
+        return cuenta, None
+
+    def index_prestamos(self):
+        """Índices secundarios de préstamos: ubicación por id y lista de ids por cliente.
+
+        Sólo guardan ids, así que no se desactualizan cuando un pago reemplaza
+        el registro; el cliente y la partición de un préstamo no cambian nunca.
+        """
+        for part_index in sorted(self.prestamos):
+            for prestamo in self.prestamos[part_index].records.values():
+                self.loan_location[prestamo.id] = part_index
+                self.loans_by_client.setdefault(prestamo.cliente, []).append(prestamo.id)
+
+    def get_prestamo(self, id_prestamo):
+        part_index = self.loan_location.get(str(id_prestamo))
+        if part_index is None: return None
+        return self.prestamos[part_index].get(id_prestamo)
+
+    def prestamos_de(self, cliente):
+        """Préstamos actuales de un cliente, sin recorrer los de los demás."""
+        return [self.get_prestamo(id_prestamo) for id_prestamo in self.loans_by_client.get(cliente, ())]
+
+    # --- Lecturas sin bloqueos ---
+    # Dentro de un lote de cambios se lee el estado de trabajo (el lote ya tiene
+    # sus cuentas bloqueadas y debe ver sus propios cambios); fuera, la última
+    # versión publicada o la de la instantánea abierta por el hilo.
+
+    @contextmanager
+    def instantanea(self):
+        """Hace que todas las lecturas `leer_*` del hilo vean una misma versión."""
+        if self.current_batch() is not None or getattr(self.lecturas, 'version', None) is not None:
+            yield
+            return
+        with self.versiones.instantanea() as version:
+            self.lecturas.version = version
+            try:
+                yield
+            finally:
+                self.lecturas.version = None
+
+    def leer_cuenta(self, id_cuenta):
+        if self.current_batch() is not None: return self.get_cuenta(id_cuenta)
+        cuenta, err = self.get_cuenta(id_cuenta)
+        if err: return None, err
+        return self.versiones.leer(('C', cuenta.id), cuenta, getattr(self.lecturas, 'version', None)), None
+
+    def leer_prestamos_de(self, cliente):
+        if self.current_batch() is not None: return self.prestamos_de(cliente)
+        version = getattr(self.lecturas, 'version', None)
+        return [self.versiones.leer(('P', prestamo.id), prestamo, version) for prestamo in self.prestamos_de(cliente)]
+
+    def leer_total(self, part_index):
+        """Suma de saldos de la partición."""
+        if self.current_batch() is not None: return self.cuentas[part_index].total()
+        return self.versiones.leer(('T', part_index), None, getattr(self.lecturas, 'version', None))
+
+    # --- Persistencia ---
+
+    def commit(self, cuentas=(), prestamos=()):
+        """Aplica y persiste los registros modificados por una operación.
+
+        Todas las cuentas de una operación pertenecen a la misma partición (la
+        de la cuenta que la origina), así que el cambio completo ocupa un solo
+        registro del WAL de esa partición (y una sola entrada del registro de
+        replicación). Debe llamarse con las cuentas afectadas bloqueadas en
+        modo exclusivo. Devuelve el saldo formateado de cada cuenta (id ->
+        texto) para que el historial no vuelva a formatearlo.
+        """
+        touched = [(self.cuentas[particion_de(c.id)], ('C', c.id), c) for c in cuentas]
+        touched += [(self.prestamos[self.loan_partition_index(p.id)], ('P', p.id), p) for p in prestamos]
+        batch = self.current_batch()
+        part_index = particion_de(cuentas[0].id) if cuentas else self.loan_partition_index(prestamos[0].id)
+        if self.replicacion is not None:
+            self.replicacion.verificar_escritura(part_index)
+
+        saldos = {c.id: format_monto(c.saldo) for c in cuentas}
+        ops = None
+        if self.durabilidad == 'wal' or self.replicacion is not None:
+            ops = [('C', particion_de(c.id), c.id, saldos[c.id]) for c in cuentas]
+            ops += [('P', self.loan_partition_index(p.id), p.id, format_monto(p.monto_pagado), p.estado) for p in prestamos]
+        if batch is not None:
+            batch.ops.setdefault(part_index, []).extend(ops or ())
+        elif self.durabilidad == 'wal':
+            # El WAL se escribe antes de tocar la memoria: si falla, la operación no ocurrió
+            self.wal_for(part_index).append(ops)
+        if batch is not None:
+            batch.undo += [(partition, partition.get(record.id)) for partition, _, record in touched]
+            for partition, _, record in touched:
+                partition.pendiente(record.id)
+        for partition, clave, record in touched:
+            self.versiones.base(clave, partition.get(record.id))
+            partition.put(record)
+        partitions = dict.fromkeys(partition for partition, _, _ in touched)
+        cambios = {clave: (partition.part_index, record) for partition, clave, record in touched}
+        if batch is not None:
+            batch.partitions.update(partitions)
+            batch.publicar.update(cambios)
+            return saldos
+        if self.durabilidad == 'wal':
+            self.dirty.update(partitions)
+        else:
+            for partition in partitions:
+                partition.save()
+        self.versiones.publicar(cambios)
+        if self.replicacion is not None:
+            self.replicacion.registrar(part_index, ops)
+        return saldos
+
+    def append_history(self, part_index, row, durable=False, fecha=None):
+        """Encola una fila del historial (en el lote activo, si hay) y la pasa, con
+        su fecha, al registro de replicación. `fecha` es la del primario en las
+        filas replicadas; si falta, se usa la actual."""
+        batch = self.current_batch()
+        if batch is not None:
+            batch.history.append((part_index, row, durable, fecha)) # Se escribe al confirmar el lote
+            return
+        fecha = self.historial.append(part_index, row, durable, fecha)
+        if self.replicacion is not None:
+            self.replicacion.registrar(part_index, [('H', fecha, *row)])
+
+    def current_batch(self):
+        return getattr(self.batches, 'batch', None)
+
+    @contextmanager
+    def batch(self):
+        """Agrupa los commits del hilo actual y los persiste una sola vez al salir.
+
+        Dentro del bloque cada commit se aplica en memoria y sus operaciones se
+        acumulan: al salir se añade un único registro al WAL por partición (o se
+        reescribe una vez cada archivo modificado) y se encolan las filas del
+        historial. `Batch.rollback` deshace lo aplicado hasta ese momento; una
+        excepción deshace el lote completo. Debe usarse con todas las cuentas
+        del lote ya bloqueadas en modo exclusivo.
+        """
+        batch = self.batches.batch = Batch()
+        try:
+            yield batch
+        except BaseException:
+            batch.rollback()
+            raise
+        finally:
+            self.batches.batch = None
+        try:
+            if self.durabilidad == 'wal':
+                for part_index, ops in batch.ops.items():
+                    self.wal_for(part_index).append(ops)
+                batch.confirmar() # Después del WAL: con mmap, el sistema puede llevar el mapeo a disco en cualquier momento
+                self.dirty.update(batch.partitions)
+            else:
+                batch.confirmar()
+                for partition in batch.partitions:
+                    partition.save()
+        except BaseException:
+            batch.rollback()
+            raise
+        if batch.publicar:
+            self.versiones.publicar(batch.publicar)
+        filas = [(part_index, self.historial.append(part_index, row, fecha=fecha), row)
+                 for part_index, row, _, fecha in batch.history]
+        if self.replicacion is not None:
+            cambios = {part_index: list(ops) for part_index, ops in batch.ops.items()}
+            for part_index, fecha, row in filas:
+                cambios.setdefault(part_index, []).append(('H', fecha, *row))
+            for part_index, ops in cambios.items():
+                if ops: self.replicacion.registrar(part_index, ops)
+        if any(durable for _, _, durable, _ in batch.history):
+            self.historial.flush(sync=True)
+
+    def loan_partition_index(self, id_prestamo):
+        return self.loan_location[id_prestamo]
+
+    def wal_for(self, part_index):
+        wal = self.wals.get(part_index)
+        if wal is None:
+            wal = WriteAheadLog(os.path.join(self.node_data_dir, f"wal_part{part_index}.log"))
+            self.wals[part_index] = wal
+        return wal
+
+    def apply_op(self, op):
+        """Reaplica una operación del WAL. Los valores son absolutos: reaplicar es idempotente."""
+        if op[0] == 'C':
+            _, part_index, id_cuenta, saldo = op
+            partition = self.cuentas[int(part_index)]
+            cuenta = partition.get(id_cuenta)
+            if cuenta is not None:
+                partition.put(cuenta._replace(saldo=parse_monto(saldo)))
+                self.dirty.add(partition)
+        elif op[0] == 'P':
+            _, part_index, id_prestamo, monto_pagado, estado = op
+            partition = self.prestamos[int(part_index)]
+            prestamo = partition.get(id_prestamo)
+            if prestamo is not None:
+                partition.put(prestamo._replace(monto_pagado=parse_monto(monto_pagado), estado=estado))
+                self.dirty.add(partition)
+
+    def recover(self):
+        """Reaplica los WAL existentes sobre los archivos y compacta el resultado."""
+        replayed = 0
+        for part_index in sorted(self.cuentas):
+            wal = self.wal_for(part_index)
+            for ops in wal.replay():
+                for op in ops:
+                    self.apply_op(op)
+                replayed += 1
+        if replayed:
+            logging.info(f"Recuperación: {replayed} registros del WAL reaplicados")
+        self.checkpoint()
+
+    def checkpoint(self):
+        """Vuelca las particiones modificadas a disco y descarta el WAL ya aplicado."""
+        # Con todas las particiones en modo S no hay ningún commit a medias
+        with self.locks.particiones(self.cuentas):
+            if not self.dirty: return
+            snapshot = [(p, p.snapshot()) for p in self.dirty]
+            offsets = {part_index: wal.size() for part_index, wal in self.wals.items()}
+            self.dirty = set()
+        # La escritura de los archivos se hace sin bloquear a las operaciones
+        try:
+            for partition, contents in snapshot:
+                partition.persist(contents)
+        except OSError:
+            self.dirty.update(partition for partition, _ in snapshot)
+            raise
+        for part_index, offset in offsets.items():
+            wal = self.wals.get(part_index)
+            if wal is not None: wal.truncate_before(offset) # Salvo que la partición se haya retirado
+
+    def apply_replicated(self, ops):
+        """Aplica y persiste operaciones recibidas del nodo primario.
+
+        Son las mismas del WAL (valores absolutos, así que reaplicarlas no
+        cambia nada) más las filas del historial (`H`), que conservan la fecha
+        que les puso el primario. Todo se aplica como un único lote, con las
+        cuentas afectadas bloqueadas.
+        """
+        cuentas, prestamos, filas = {}, {}, []
+        for op in ops:
+            if op[0] == 'C':
+                cuenta, err = self.get_cuenta(op[2])
+                if not err: cuentas[cuenta.id] = cuenta._replace(saldo=parse_monto(op[3]))
+            elif op[0] == 'P':
+                prestamo = self.get_prestamo(op[2])
+                if prestamo is not None:
+                    prestamos[prestamo.id] = prestamo._replace(monto_pagado=parse_monto(op[3]), estado=op[4])
+            elif op[0] == 'H':
+                filas.append((particion_de(op[2]), op[1], tuple(op[2:])))
+        ids = set(cuentas) | {p.cliente.rpartition('_')[2] for p in prestamos.values()}
+        with self.locks.cuentas([id_cuenta for id_cuenta in ids if id_cuenta.isdigit()], exclusivo=True), self.batch():
+            for cuenta in cuentas.values():
+                self.commit(cuentas=[cuenta])
+            for prestamo in prestamos.values():
+                self.commit(prestamos=[prestamo])
+            for part_index, fecha, row in filas:
+                self.append_history(part_index, row, fecha=fecha)
+
+    def replica_snapshot(self, part_index):
+        """Operaciones que reconstruyen una partición en una réplica: el saldo de
+        cada cuenta y el estado de los préstamos de sus clientes. Debe llamarse
+        con la partición bloqueada."""
+        ops = [('C', part_index, id_cuenta, format_monto(saldo)) for id_cuenta, saldo in self.cuentas[part_index].saldos()]
+        for loan_part, partition in self.prestamos.items():
+            ops += [('P', loan_part, p.id, format_monto(p.monto_pagado), p.estado)
+                    for p in partition.records.values() if particion_de_cliente(p.cliente) == part_index]
+        return ops
+
+    # --- Traslado de particiones ---
+    # Un nodo que no tiene una partición la recibe completa de su primario
+    # (exportar_particion -> recibir_particion) y sigue al día con la
+    # replicación; el que la deja la retira (retirar_particion).
+
+    def exportar_particion(self, part_index):
+        """Operaciones que instalan la partición en un nodo que no la tiene: las líneas
+        de sus cuentas (`A`), las de los préstamos de sus clientes (`L`) y las de su
+        historial (`R`). Debe llamarse con la partición bloqueada."""
+        ops = [('A', format_cuenta(cuenta)) for cuenta in self.cuentas[part_index].registros()]
+        for loan_part, partition in self.prestamos.items():
+            ops += [('L', loan_part, format_prestamo(p))
+                    for p in partition.records.values() if particion_de_cliente(p.cliente) == part_index]
+        self.historial.flush()
+        ops += [('R', line) for line in self.historial.partition(part_index).lineas()]
+        return ops
+
+    def recibir_particion(self, part_index, ops, final):
+        """Añade un fragmento de `exportar_particion` a los archivos `.recibiendo` de la
+        partición y, con el último (`final`), la pone en servicio."""
+        prestamos = self.recepciones.get(part_index)
+        if prestamos is None:
+            prestamos = self.recepciones[part_index] = {}
+            for tabla in ('cuentas', 'historial'):
+                open(self.table_path(tabla, part_index) + '.recibiendo', 'w').close()
+        lineas = {'A': [], 'R': []}
+        for op in ops:
+            if op[0] == 'L':
+                prestamos.setdefault(int(op[1]), []).append(op[2])
+            else:
+                lineas[op[0]].append(op[1])
+        for tabla, tipo in (('cuentas', 'A'), ('historial', 'R')):
+            with open(self.table_path(tabla, part_index) + '.recibiendo', 'a', encoding='utf-8') as f:
+                f.writelines(lineas[tipo])
+        if final:
+            del self.recepciones[part_index]
+            self.instalar_particion(part_index, prestamos)
+
+    def descartar_recepcion(self, part_index):
+        """Olvida una recepción a medias (el primario vuelve a empezar)."""
+        self.recepciones.pop(part_index, None)
+        for tabla in ('cuentas', 'historial'):
+            tmp_path = self.table_path(tabla, part_index) + '.recibiendo'
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+
+    def instalar_particion(self, part_index, prestamos):
+        txt_path = self.table_path('cuentas', part_index)
+        for tabla in ('cuentas', 'historial'):
+            os.replace(self.table_path(tabla, part_index) + '.recibiendo', self.table_path(tabla, part_index))
+        # Restos de una época anterior en la que el nodo tuvo la partición
+        for file_path in (self.table_path('cuentas', part_index, 'dat'), os.path.join(self.node_data_dir, f"wal_part{part_index}.log")):
+            if os.path.exists(file_path): os.remove(file_path)
+        self.historial.retirar(part_index)
+        self.historial.load([part_index])
+        # Los préstamos se añaden a los archivos de préstamos del nodo (o a uno nuevo)
+        for loan_part, lineas in sorted(prestamos.items()):
+            recibidos = [p for p in map(parse_prestamo, lineas) if p is not None]
+            partition = self.prestamos.get(loan_part)
+            if partition is None:
+                write_atomic(self.table_path('prestamos', loan_part), lineas)
+                partition = self.prestamos[loan_part] = LoanPartition(loan_part, self.table_path('prestamos', loan_part), self.con_indices)
+            else:
+                for prestamo in recibidos:
+                    partition.agregar(prestamo)
+                partition.save()
+            for prestamo in recibidos:
+                if prestamo.id not in self.loan_location:
+                    self.loan_location[prestamo.id] = loan_part
+                    self.loans_by_client.setdefault(prestamo.cliente, []).append(prestamo.id)
+        if self.almacenamiento == 'mmap':
+            dat_path = self.table_path('cuentas', part_index, 'dat')
+            convertir_cuentas(txt_path, dat_path, part_index)
+            partition = MmapAccountPartition(part_index, dat_path, self.con_indices)
+        else:
+            partition = AccountPartition(part_index, txt_path, self.con_indices)
+        self.versiones.base(('T', part_index), partition.total())
+        self.cuentas[part_index] = partition # A partir de aquí el nodo sirve la partición
+        logging.info(f"Partición {part_index} instalada: {len(partition)} cuentas")
+
+    def retirar_particion(self, part_index):
+        """Deja de servir una partición que ya no le corresponde al nodo y borra sus archivos.
+
+        Los préstamos de sus clientes siguen en los archivos de préstamos, que
+        comparte con otras particiones, pero salen de los índices: el nodo ya no los consulta.
+        """
+        self.descartar_recepcion(part_index)
+        if part_index not in self.cuentas: return
+        if self.durabilidad == 'wal':
+            self.checkpoint() # Lleva a los archivos de préstamos los cambios que sólo están en el WAL
+        with self.locks.particiones([part_index], exclusivo=True):
+            partition = self.cuentas.pop(part_index)
+            self.dirty.discard(partition)
+            wal = self.wals.pop(part_index, None)
+            for cliente in [c for c in self.loans_by_client if particion_de_cliente(c) == part_index]:
+                for id_prestamo in self.loans_by_client.pop(cliente):
+                    self.loan_location.pop(id_prestamo, None)
+        partition.close()
+        if wal is not None: wal.close()
+        self.historial.retirar(part_index)
+        self.versiones.descartar(lambda clave, registro: clave == ('T', part_index)
+                                 or (clave[0] == 'C' and particion_de(clave[1]) == part_index)
+                                 or (clave[0] == 'P' and particion_de_cliente(registro.cliente) == part_index))
+        for file_path in (self.table_path('cuentas', part_index), self.table_path('cuentas', part_index, 'dat'),
+                          self.table_path('historial', part_index), os.path.join(self.node_data_dir, f"wal_part{part_index}.log")):
+            if os.path.exists(file_path): os.remove(file_path)
+            indices.borrar(file_path)
+        logging.info(f"Partición {part_index} retirada del nodo")
+
+    def verify_totals(self, part_indexes):
+        """Compara el total mantenido de cada partición con el recalculado desde disco.
+
+        Con las particiones en modo S no hay cambios en curso; antes de leer los
+        archivos se hace el checkpoint del WAL pendiente para que el
+        disco refleje el estado confirmado (el `.dat` se lee a través de la
+        caché de páginas, que ya comparte con el mapeo). Devuelve `(part_index, mantenido, en disco)`.
+        """
+        with self.locks.particiones(part_indexes):
+            if self.durabilidad == 'wal':
+                self.checkpoint()
+            results = []
+            for part_index in sorted(part_indexes):
+                partition = self.cuentas[part_index]
+                results.append((part_index, partition.total(), partition.disk_total()))
+        return results
+
+    def guardar_indices(self):
+        """Reescribe los índices guardados de los archivos que cambiaron desde el último.
+
+        Los índices describen los archivos, así que con el WAL se hace antes un
+        checkpoint y se omiten las particiones que vuelvan a tener cambios sin
+        volcar. Bajo bloqueo sólo se copian los índices en memoria (sin commits
+        a medias): cada partición de cuentas en modo S por separado y, para los
+        préstamos, todas a la vez. Las firmas y los archivos se calculan y
+        escriben sin bloquear a las operaciones.
+        """
+        if not self.con_indices: return
+        with self.indices_lock:
+            if self.durabilidad == 'wal':
+                self.checkpoint()
+            tomas = []
+            for part_index, partition in list(self.cuentas.items()):
+                with self.locks.particiones([part_index]):
+                    if partition not in self.dirty: tomas.append((partition, partition.toma_indice()))
+            with self.locks.particiones(self.cuentas):
+                tomas += [(p, p.toma_indice()) for p in list(self.prestamos.values()) if p not in self.dirty]
+            for partition, toma in tomas:
+                if toma is not None: partition.guardar_indice(toma)
+            self.historial.guardar_indices()
+
+    def start_indices(self, intervalo):
+        def run():
+            while True:
+                time.sleep(intervalo)
+                try:
+                    self.guardar_indices()
+                except Exception as e:
+                    logging.error(f"Fallo al guardar los índices: {e}")
+        threading.Thread(target=run, name='indices', daemon=True).start()
+
+    def start_checkpointer(self, intervalo):
+        def run():
+            while True:
+                time.sleep(intervalo)
+                try:
+                    self.checkpoint()
+                except Exception as e:
+                    logging.error(f"Fallo en el checkpoint del WAL: {e}")
+        threading.Thread(target=run, name='checkpointer', daemon=True).start()
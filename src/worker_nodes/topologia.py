@@ -0,0 +1,113 @@
+import os
+
+ARCHIVO = 'topologia.properties'   # Dentro del directorio de datos (data/)
+PARTICIONES_DEFECTO = 3            # Datos generados antes de que existiera el archivo de topología
+
+class Topologia:
+    """Número de particiones de cuentas y nodos que contienen cada una.
+
+    La cuenta `i` pertenece a la partición `(i - 1) % particiones + 1`. De cada
+    partición, `ubicacion` da los nodos que la contienen: el primero es el
+    primario y los demás, sus réplicas. `nodos` da la dirección `host:puerto`
+    de cada nodo.
+
+    Se guarda en `data/topologia.properties`, en el formato de
+    `java.util.Properties` para que también lo lea el Servidor Central:
+
+        version=1
+        particiones=3
+        nodo.1=localhost:9091
+        particion.1=1,2,3
+
+    La escriben generador_datos.py y rebalancear.py; los workers la leen al
+    arrancar y con RECARGAR_TOPOLOGIA.
+    """
+
+    def __init__(self, particiones, nodos, ubicacion, version=1):
+        self.particiones = particiones
+        self.nodos = nodos          # id de nodo -> 'host:puerto'
+        self.ubicacion = ubicacion  # partición -> [ids de nodo], el primario primero
+        self.version = version
+
+    @classmethod
+    def circular(cls, particiones, num_nodos, direcciones=None):
+        """El primario de la partición j es el nodo `(j - 1) % num_nodos + 1` y las réplicas son sus dos vecinos."""
+        ubicacion = {}
+        for part_index in range(1, particiones + 1):
+            primario = (part_index - 1) % num_nodos + 1
+            ubicacion[part_index] = list(dict.fromkeys([primario, primario % num_nodos + 1, (primario - 2) % num_nodos + 1]))
+        nodos = {node_id: direcciones[node_id - 1] if direcciones else '' for node_id in range(1, num_nodos + 1)}
+        return cls(particiones, nodos, ubicacion)
+
+    @classmethod
+    def cargar(cls, file_path):
+        valores = {}
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line[0] in '#!': continue
+                clave, _, valor = line.partition('=')
+                valores[clave.strip()] = valor.strip()
+        try:
+            particiones = int(valores['particiones'])
+            nodos, ubicacion = {}, {}
+            for clave, valor in valores.items():
+                tipo, _, numero = clave.partition('.')
+                if tipo == 'nodo':
+                    nodos[int(numero)] = valor
+                elif tipo == 'particion':
+                    ubicacion[int(numero)] = [int(node_id) for node_id in valor.split(',')]
+            topologia = cls(particiones, nodos, ubicacion, int(valores.get('version', 1)))
+        except (KeyError, ValueError) as e:
+            raise ValueError(f"{file_path}: topología inválida ({e})") from None
+        topologia.validar(file_path)
+        return topologia
+
+    def validar(self, origen):
+        if self.particiones < 1 or set(self.ubicacion) != set(range(1, self.particiones + 1)):
+            raise ValueError(f"{origen}: cada partición 1..{self.particiones} debe tener su línea particion.N")
+        for part_index, nodos in self.ubicacion.items():
+            if not nodos or len(set(nodos)) != len(nodos):
+                raise ValueError(f"{origen}: la partición {part_index} debe tener nodos distintos")
+
+    def guardar(self, file_path):
+        """Escribe el archivo de forma atómica (temporal + rename): quien lo lea nunca lo ve a medias."""
+        lines = ["# Topología del sistema: el primer nodo de cada partición es su primario\n",
+                 f"version={self.version}\n", f"particiones={self.particiones}\n"]
+        lines += [f"nodo.{node_id}={self.nodos[node_id]}\n" for node_id in sorted(self.nodos)]
+        lines += [f"particion.{part_index}={','.join(map(str, self.ubicacion[part_index]))}\n"
+                  for part_index in sorted(self.ubicacion)]
+        tmp_path = file_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+
+    def primario(self, part_index):
+        return self.ubicacion[part_index][0]
+
+    def replicas(self, part_index):
+        return self.ubicacion[part_index][1:]
+
+    def particiones_de(self, node_id):
+        """Particiones que contiene el nodo, como primario o como réplica."""
+        return [part_index for part_index in sorted(self.ubicacion) if node_id in self.ubicacion[part_index]]
+
+    def con_ubicacion(self, part_index, nodos):
+        """Copia con otra lista de nodos para la partición y la versión siguiente."""
+        ubicacion = dict(self.ubicacion)
+        ubicacion[part_index] = list(nodos)
+        return Topologia(self.particiones, dict(self.nodos), ubicacion, self.version + 1)
+
+def cargar_topologia(file_path, direcciones=None):
+    """Topología de `file_path` o, si el archivo no existe, la de siempre: tres
+    particiones en circular sobre los nodos de `direcciones` (o tres nodos).
+    `direcciones` (la k-ésima es la del nodo k) reemplaza a las del archivo."""
+    if os.path.exists(file_path):
+        topologia = Topologia.cargar(file_path)
+    else:
+        topologia = Topologia.circular(PARTICIONES_DEFECTO, len(direcciones) if direcciones else 3)
+    for node_id, direccion in enumerate(direcciones or (), 1):
+        topologia.nodos[node_id] = direccion
+    return topologia
@@ -1,299 +1,220 @@
+import sys
 import socket
+import signal
+import asyncio
 import threading
 import os
 import argparse
 import time
 import logging
 import datetime
-from decimal import Decimal, getcontext
-
-# --- Configuración de Precisión Decimal ---
-getcontext().prec = 12 # Precisión suficiente para cálculos financieros
-TWO_PLACES = Decimal('0.01')
-
-# --- Configuración de Logging ---
-def setup_logging(node_id):
-    log_dir = 'logs'
-    os.makedirs(log_dir, exist_ok=True)
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - [NODO %(node_id)s] - %(message)s',
-        handlers=[
-            logging.FileHandler(os.path.join(log_dir, f'worker_{node_id}.log')),
-            logging.StreamHandler()
-        ]
-    )
-    # Añadir el ID del nodo al logger para formato
-    old_factory = logging.getLogRecordFactory()
-    def record_factory(*args, **kwargs):
-        record = old_factory(*args, **kwargs)
-        record.node_id = node_id
-        return record
-    logging.setLogRecordFactory(record_factory)
+import json
+import shutil
+import tempfile
+import itertools
+import multiprocessing
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import NodeStore, ParticionTrasladada, EscrituraEnReplica, particion_de, particiones_de_nodo, configurar_particiones
+from locks import LockManager
+from metrics import METRICS, merge_snapshots
+from logqueue import setup_logging, PETICIONES
+from montos import parse_monto, format_monto
+from replication import Replicator
+from topologia import ARCHIVO, cargar_topologia
 
 # --- Lógica de Sincronización y Archivos ---
-FILE_LOCK = threading.RLock()
+# Bloqueos por partición y por cuenta (ver locks.LockManager)
+LOCKS = LockManager()
 
-def get_current_balance(id_cuenta, node_data_dir):
-    part_index = (int(id_cuenta) - 1) % 3 + 1
-    file_path = os.path.join(node_data_dir, f"cuentas_part{part_index}.txt")
-    lines, err = read_all_lines(file_path)
-    if err: return None
-    _, linea, err = find_line_and_index(lines, id_cuenta)
+MAX_LINEA = 1 << 24 # Longitud máxima de una línea en los servidores asyncio (el estado completo de REPLICAR es largo)
+ESPERA_RESTO = 1.0  # Segundos que se espera el resto de una petición que llegó sin fin de línea
+
+def get_current_balance(id_cuenta, store):
+    cuenta, err = store.leer_cuenta(id_cuenta)
     if err: return None
-    try:
-        return Decimal(linea.split(',')[2]).quantize(TWO_PLACES)
-    except (IndexError, ValueError):
-        return None
+    return cuenta.saldo
 
-def log_history(id_cuenta, command, details, balance, node_data_dir):
+def log_history(id_cuenta, command, details, balance, store, durable=False):
+    """Encola una fila del historial. `balance` es un saldo en céntimos o el
+    texto que ya devolvió `store.commit`. Los cambios confirmados usan
+    `durable=True` para no responder al cliente antes de que su fila esté en disco."""
     try:
-        part_index = (int(id_cuenta) - 1) % 3 + 1
-        hist_file = os.path.join(node_data_dir, f"historial_part{part_index}.txt")
-        fecha = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        balance_str = f'{balance:.2f}' if balance is not None else 'N/A'
+        if balance is None: balance_str = 'N/A'
+        elif isinstance(balance, str): balance_str = balance
+        else: balance_str = format_monto(balance)
         details_cleaned = str(details).replace('\n', ' ').replace('|', ' ')
-        log_line = f"{fecha}|{id_cuenta}|{command}|{details_cleaned}|{balance_str}\n"
-        
-        with FILE_LOCK:
-            with open(hist_file, 'a', encoding='utf-8') as f:
-                f.write(log_line)
+        store.append_history(particion_de(id_cuenta), (id_cuenta, command, details_cleaned, balance_str), durable)
     except Exception as e:
         logging.error(f"Fallo al escribir en el historial: {e}")
 
-def read_all_lines(file_path):
-    with FILE_LOCK:
-        if not os.path.exists(file_path):
-            return None, f"Archivo no encontrado: {file_path}"
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return f.readlines(), None
-
-def write_all_lines(file_path, lines):
-    with FILE_LOCK:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.writelines(lines)
-
-def find_line_and_index(lines, item_id):
-    for i, line in enumerate(lines):
-        try:
-            if line.strip().split(',')[0] == str(item_id):
-                return i, line.strip(), None
-        except IndexError:
-            continue
-    return -1, None, "ID no encontrado"
-
-def handle_atomic_transfer(params, node_data_dir, file_path):
+def handle_atomic_transfer(params, node_data_dir, store, partition):
     id_origen, id_destino, monto_str = params
-    monto = Decimal(monto_str).quantize(TWO_PLACES)
-
-    with FILE_LOCK:
-        lines, err = read_all_lines(file_path)
-        if err: return f"ERROR|{err}"
+    monto = parse_monto(monto_str)
+    monto_txt = format_monto(monto)
 
-        idx_origen, linea_origen, err = find_line_and_index(lines, id_origen)
-        if err: return f"ERROR|Cuenta de origen {id_origen} no encontrada"
+    with LOCKS.cuentas([id_origen, id_destino], exclusivo=True):
+        cuenta_origen = partition.get(id_origen)
+        if cuenta_origen is None: return f"ERROR|Cuenta de origen {id_origen} no encontrada"
         
-        idx_destino, linea_destino, err = find_line_and_index(lines, id_destino)
-        if err: return f"ERROR|Cuenta de destino {id_destino} no encontrada"
+        cuenta_destino = partition.get(id_destino)
+        if cuenta_destino is None: return f"ERROR|Cuenta de destino {id_destino} no encontrada"
 
-        campos_origen = linea_origen.split(',')
-        saldo_origen = Decimal(campos_origen[2]).quantize(TWO_PLACES)
+        saldo_origen = cuenta_origen.saldo
         if saldo_origen < monto:
-            log_history(id_origen, "TRANSFERIR_CUENTA", f"A:{id_destino} M:{monto}", saldo_origen, node_data_dir)
+            log_history(id_origen, "TRANSFERIR_CUENTA", f"A:{id_destino} M:{monto_txt}", saldo_origen, store)
             return "ERROR|Fondos insuficientes"
         
-        campos_destino = linea_destino.split(',')
-        saldo_destino = Decimal(campos_destino[2]).quantize(TWO_PLACES)
+        saldo_destino = cuenta_destino.saldo
 
-        nuevo_saldo_origen = (saldo_origen - monto).quantize(TWO_PLACES)
-        nuevo_saldo_destino = (saldo_destino + monto).quantize(TWO_PLACES)
+        nuevo_saldo_origen = saldo_origen - monto
+        nuevo_saldo_destino = saldo_destino + monto
 
-        campos_origen[2] = f"{nuevo_saldo_origen:.2f}"
-        lines[idx_origen] = ",".join(campos_origen) + '\n'
-
-        campos_destino[2] = f"{nuevo_saldo_destino:.2f}"
-        lines[idx_destino] = ",".join(campos_destino) + '\n'
-        
-        write_all_lines(file_path, lines)
-        log_history(id_origen, "TRANSFERENCIA_ENVIADA", f"A:{id_destino} M:{monto}", nuevo_saldo_origen, node_data_dir)
-        log_history(id_destino, "TRANSFERENCIA_RECIBIDA", f"DE:{id_origen} M:{monto}", nuevo_saldo_destino, node_data_dir)
+        saldos = store.commit(cuentas=[cuenta_origen._replace(saldo=nuevo_saldo_origen), cuenta_destino._replace(saldo=nuevo_saldo_destino)])
+        log_history(id_origen, "TRANSFERENCIA_ENVIADA", f"A:{id_destino} M:{monto_txt}", saldos[id_origen], store)
+        log_history(id_destino, "TRANSFERENCIA_RECIBIDA", f"DE:{id_origen} M:{monto_txt}", saldos[id_destino], store, durable=True)
 
     return "SUCCESS|Transferencia completada"
 
 # --- Lógica de Queries ---
-def handle_query(query_parts, node_data_dir):
+def handle_query(query_parts, node_data_dir, store):
     query_type = query_parts[0]
     params = query_parts[1:]
-    logging.info(f"Procesando query: {query_type} con params: {params}")
+    # Formateado por el hilo de logging, y sólo si el registro pasa el muestreo
+    PETICIONES.info("query=%s params=%.300s", query_type, params, extra={'cmd': query_type})
+    # Una réplica no anota en su historial las lecturas que sirve: esas filas no
+    # llegarían al primario, y el historial de la partición es el del primario
+    anotar_lectura = True
+    if query_type in BATCH_LECTURAS and params and store.replicacion is not None:
+        err = store.replicacion.verificar_lectura(params[0])
+        if err: return f"ERROR|{err}"
+        anotar_lectura = not store.replicacion.es_replica(params[0])
 
     try:
+        if query_type in BATCH_CAMBIOS and params and params[0].isdigit() and store.replicacion is not None:
+            # Antes de bloquear nada o anotar en el historial un intento fallido
+            store.replicacion.verificar_escritura(particion_de(params[0]))
         if query_type == "CONSULTAR_CUENTA":
             if len(params) != 1: return "ERROR|Parámetros incorrectos"
             id_cuenta = params[0]
-            part_index = (int(id_cuenta) - 1) % 3 + 1
-            file_path = os.path.join(node_data_dir, f"cuentas_part{part_index}.txt")
-            lines, err = read_all_lines(file_path)
+            # Última versión confirmada, sin esperar a los escritores de la cuenta
+            cuenta, err = store.leer_cuenta(id_cuenta)
             if err: return f"ERROR|{err}"
-            _, linea, err = find_line_and_index(lines, id_cuenta)
-            if err: return f"ERROR|{err}"
-            campos = linea.split(',')
-            saldo_actual = Decimal(campos[2]).quantize(TWO_PLACES)
-            log_history(id_cuenta, query_type, "", saldo_actual, node_data_dir)
-            datos_cuenta = ",".join([campos[0], campos[1], f"{saldo_actual:.2f}", campos[3]])
+            saldo_actual = cuenta.saldo
+            if anotar_lectura: log_history(id_cuenta, query_type, "", saldo_actual, store)
+            datos_cuenta = ",".join([cuenta.id, cuenta.cliente, format_monto(saldo_actual), cuenta.fecha])
             return f"SUCCESS|TABLE_DATA|ID Cuenta,ID Cliente,Saldo,Fecha Apertura|{datos_cuenta}"
 
         elif query_type == "TRANSFERIR_CUENTA":
             if len(params) != 3: return "ERROR|Parámetros incorrectos"
             id_origen, id_destino, monto_str = params
             if id_origen == id_destino: return "ERROR|Cuentas de origen y destino no pueden ser la misma."
-            part_origen_idx = (int(id_origen) - 1) % 3 + 1
-            file_origen = os.path.join(node_data_dir, f"cuentas_part{part_origen_idx}.txt")
-            part_destino_idx = (int(id_destino) - 1) % 3 + 1
-            file_destino = os.path.join(node_data_dir, f"cuentas_part{part_destino_idx}.txt")
-            if file_origen != file_destino: return "ERROR|TRANSFERIR_CUENTA solo soporta transferencias en la misma partición"
-            return handle_atomic_transfer(params, node_data_dir, file_origen)
+            if particion_de(id_origen) != particion_de(id_destino): return "ERROR|TRANSFERIR_CUENTA solo soporta transferencias en la misma partición"
+            partition, err = store.partition_for(id_origen)
+            if err: return f"ERROR|{err}"
+            return handle_atomic_transfer(params, node_data_dir, store, partition)
 
         elif query_type == "DEBIT":
             if len(params) < 2: return "ERROR|Parámetros incorrectos para DEBIT"
             id_cuenta, monto_str = params[0], params[1]
             description = params[2] if len(params) > 2 else "DEBIT"
-            monto = Decimal(monto_str).quantize(TWO_PLACES)
-            with FILE_LOCK:
-                part_index = (int(id_cuenta) - 1) % 3 + 1
-                file_path = os.path.join(node_data_dir, f"cuentas_part{part_index}.txt")
-                lines, err = read_all_lines(file_path)
+            monto = parse_monto(monto_str)
+            monto_txt = format_monto(monto)
+            with LOCKS.cuentas([id_cuenta], exclusivo=True):
+                partition, err = store.partition_for(id_cuenta)
                 if err: return f"ERROR|{err}"
-                idx, linea, err = find_line_and_index(lines, id_cuenta)
-                if err: return f"ERROR|Cuenta {id_cuenta} no encontrada"
-                campos = linea.split(',')
-                saldo = Decimal(campos[2]).quantize(TWO_PLACES)
+                cuenta = partition.get(id_cuenta)
+                if cuenta is None: return f"ERROR|Cuenta {id_cuenta} no encontrada"
+                saldo = cuenta.saldo
                 if saldo < monto: 
-                    log_history(id_cuenta, description, f"M:{monto}", saldo, node_data_dir)
+                    log_history(id_cuenta, description, f"M:{monto_txt}", saldo, store)
                     return "ERROR|Fondos insuficientes"
-                nuevo_saldo = (saldo - monto).quantize(TWO_PLACES)
-                campos[2] = f"{nuevo_saldo:.2f}"
-                lines[idx] = ",".join(campos) + '\n'
-                write_all_lines(file_path, lines)
-                log_history(id_cuenta, description, f"M:{monto}", nuevo_saldo, node_data_dir)
-                return f"SUCCESS|Débito de {monto:.2f} completado"
+                saldos = store.commit(cuentas=[cuenta._replace(saldo=saldo - monto)])
+                log_history(id_cuenta, description, f"M:{monto_txt}", saldos[id_cuenta], store, durable=True)
+                return f"SUCCESS|Débito de {monto_txt} completado"
 
         elif query_type == "CREDIT":
             if len(params) < 2: return "ERROR|Parámetros incorrectos para CREDIT"
             id_cuenta, monto_str = params[0], params[1]
             description = params[2] if len(params) > 2 else "CREDIT"
-            monto = Decimal(monto_str).quantize(TWO_PLACES)
-            with FILE_LOCK:
-                part_index = (int(id_cuenta) - 1) % 3 + 1
-                file_path = os.path.join(node_data_dir, f"cuentas_part{part_index}.txt")
-                lines, err = read_all_lines(file_path)
+            monto = parse_monto(monto_str)
+            monto_txt = format_monto(monto)
+            with LOCKS.cuentas([id_cuenta], exclusivo=True):
+                partition, err = store.partition_for(id_cuenta)
                 if err: return f"ERROR|{err}"
-                idx, linea, err = find_line_and_index(lines, id_cuenta)
-                if err: return f"ERROR|Cuenta {id_cuenta} no encontrada"
-                campos = linea.split(',')
-                saldo_actual = Decimal(campos[2]).quantize(TWO_PLACES)
-                nuevo_saldo = (saldo_actual + monto).quantize(TWO_PLACES)
-                campos[2] = f"{nuevo_saldo:.2f}"
-                lines[idx] = ",".join(campos) + '\n'
-                write_all_lines(file_path, lines)
-                log_history(id_cuenta, description, f"M:{monto}", nuevo_saldo, node_data_dir)
-                return f"SUCCESS|Crédito de {monto:.2f} completado"
+                cuenta = partition.get(id_cuenta)
+                if cuenta is None: return f"ERROR|Cuenta {id_cuenta} no encontrada"
+                saldos = store.commit(cuentas=[cuenta._replace(saldo=cuenta.saldo + monto)])
+                log_history(id_cuenta, description, f"M:{monto_txt}", saldos[id_cuenta], store, durable=True)
+                return f"SUCCESS|Crédito de {monto_txt} completado"
 
         elif query_type == "PAGAR_DEUDA":
             if len(params) != 3: return "ERROR|Parámetros incorrectos para PAGAR_DEUDA"
             id_cuenta, id_prestamo, monto_pago_str = params
-            monto_pago = Decimal(monto_pago_str).quantize(TWO_PLACES)
+            monto_pago = parse_monto(monto_pago_str)
+            monto_pago_txt = format_monto(monto_pago)
             if monto_pago <= 0:
                 return "ERROR|El monto a pagar debe ser positivo."
             id_cliente_str = f"cliente_{id_cuenta}"
-            with FILE_LOCK:
-                prestamo_encontrado = False
-                prestamos_file_path, lines_prestamos, idx_prestamo, linea_prestamo = None, None, -1, None
-                for i in range(1, 4):
-                    temp_path = os.path.join(node_data_dir, f"prestamos_part{i}.txt")
-                    if not os.path.exists(temp_path): continue
-                    temp_lines, err = read_all_lines(temp_path)
-                    if err or not temp_lines: continue
-                    for j, linea in enumerate(temp_lines):
-                        campos_prestamo = linea.strip().split(',')
-                        if campos_prestamo[0] == id_prestamo and campos_prestamo[1] == id_cliente_str:
-                            prestamos_file_path, lines_prestamos, idx_prestamo, linea_prestamo = temp_path, temp_lines, j, linea.strip()
-                            prestamo_encontrado = True
-                            break
-                    if prestamo_encontrado: break
-                if not prestamo_encontrado: return "ERROR|El préstamo no existe o no le pertenece."
+            # El préstamo queda protegido por el bloqueo de la cuenta de su cliente
+            with LOCKS.cuentas([id_cuenta], exclusivo=True):
+                prestamo = store.get_prestamo(id_prestamo)
+                if prestamo is None or prestamo.cliente != id_cliente_str: return "ERROR|El préstamo no existe o no le pertenece."
                 
-                campos_prestamo = linea_prestamo.split(',')
-                monto_total_prestamo = Decimal(campos_prestamo[2]).quantize(TWO_PLACES)
-                monto_ya_pagado = Decimal(campos_prestamo[3]).quantize(TWO_PLACES)
-                deuda_restante = (monto_total_prestamo - monto_ya_pagado).quantize(TWO_PLACES)
-                fecha_limite = datetime.datetime.strptime(campos_prestamo[5], '%Y-%m-%d').date()
+                monto_total_prestamo = prestamo.monto_total
+                monto_ya_pagado = prestamo.monto_pagado
+                deuda_restante = monto_total_prestamo - monto_ya_pagado
+                fecha_limite = datetime.datetime.strptime(prestamo.fecha_limite, '%Y-%m-%d').date()
                 
                 if deuda_restante <= 0:
                     return "SUCCESS|Esta deuda ya ha sido cancelada."
                 if fecha_limite < datetime.date.today():
-                    log_history(id_cuenta, query_type, f"P:{id_prestamo} M:{monto_pago}", get_current_balance(id_cuenta, node_data_dir), node_data_dir)
+                    log_history(id_cuenta, query_type, f"P:{id_prestamo} M:{monto_pago_txt}", get_current_balance(id_cuenta, store), store)
                     return "ERROR|Su deuda está vencida. Por favor, contacte al banco para recibir ayuda."
                 
-                saldo_cuenta = get_current_balance(id_cuenta, node_data_dir)
-                if saldo_cuenta is None:
+                cuentas_partition, err = store.partition_for(id_cuenta)
+                cuenta = cuentas_partition.get(id_cuenta) if not err else None
+                if cuenta is None:
                     return "ERROR|No se pudo obtener el saldo de la cuenta."
-                saldo_cuenta = saldo_cuenta.quantize(TWO_PLACES)
+                saldo_cuenta = cuenta.saldo
                 if saldo_cuenta < monto_pago:
-                    log_history(id_cuenta, query_type, f"P:{id_prestamo} M:{monto_pago}", saldo_cuenta, node_data_dir)
-                    return f"ERROR|Fondos insuficientes. Necesita {monto_pago:.2f} pero solo tiene {saldo_cuenta:.2f}"
+                    log_history(id_cuenta, query_type, f"P:{id_prestamo} M:{monto_pago_txt}", saldo_cuenta, store)
+                    return f"ERROR|Fondos insuficientes. Necesita {monto_pago_txt} pero solo tiene {format_monto(saldo_cuenta)}"
                 
-                part_cuenta_idx = (int(id_cuenta) - 1) % 3 + 1
-                cuentas_file_path = os.path.join(node_data_dir, f"cuentas_part{part_cuenta_idx}.txt")
-                lines_cuentas, _ = read_all_lines(cuentas_file_path)
-                idx_cuenta, _, _ = find_line_and_index(lines_cuentas, id_cuenta)
-                campos_cuenta = lines_cuentas[idx_cuenta].strip().split(',')
-                
-                nuevo_saldo_cuenta = (saldo_cuenta - monto_pago).quantize(TWO_PLACES)
+                nuevo_saldo_cuenta = saldo_cuenta - monto_pago
                 
                 response = ""
+                estado_prestamo = prestamo.estado
                 if monto_pago >= deuda_restante:
-                    vuelto = (monto_pago - deuda_restante).quantize(TWO_PLACES)
+                    vuelto = monto_pago - deuda_restante
                     nuevo_monto_pagado = monto_total_prestamo
-                    nuevo_saldo_cuenta = (nuevo_saldo_cuenta + vuelto).quantize(TWO_PLACES)
-                    campos_prestamo[4] = 'Cancelado'
-                    response = f"SUCCESS|Deuda del préstamo {id_prestamo} saldada. Se devolvió {vuelto:.2f} a su cuenta."
+                    nuevo_saldo_cuenta = nuevo_saldo_cuenta + vuelto
+                    estado_prestamo = 'Cancelado'
+                    response = f"SUCCESS|Deuda del préstamo {id_prestamo} saldada. Se devolvió {format_monto(vuelto)} a su cuenta."
                 else:
-                    nuevo_monto_pagado = (monto_ya_pagado + monto_pago).quantize(TWO_PLACES)
-                    deuda_actualizada = (deuda_restante - monto_pago).quantize(TWO_PLACES)
-                    response = f"SUCCESS|Pago de {monto_pago:.2f} recibido. Su nueva deuda para el préstamo {id_prestamo} es {deuda_actualizada:.2f}"
-                
-                campos_cuenta[2] = f"{nuevo_saldo_cuenta:.2f}"
-                lines_cuentas[idx_cuenta] = ",".join(campos_cuenta) + '\n'
-                
-                campos_prestamo[3] = f"{nuevo_monto_pagado:.2f}"
-                lines_prestamos[idx_prestamo] = ",".join(campos_prestamo) + '\n'
+                    nuevo_monto_pagado = monto_ya_pagado + monto_pago
+                    deuda_actualizada = deuda_restante - monto_pago
+                    response = f"SUCCESS|Pago de {monto_pago_txt} recibido. Su nueva deuda para el préstamo {id_prestamo} es {format_monto(deuda_actualizada)}"
                 
-                write_all_lines(cuentas_file_path, lines_cuentas)
-                write_all_lines(prestamos_file_path, lines_prestamos)
-                log_history(id_cuenta, query_type, f"P:{id_prestamo} M:{monto_pago}", nuevo_saldo_cuenta, node_data_dir)
+                saldos = store.commit(cuentas=[cuenta._replace(saldo=nuevo_saldo_cuenta)],
+                                      prestamos=[prestamo._replace(monto_pagado=nuevo_monto_pagado, estado=estado_prestamo)])
+                log_history(id_cuenta, query_type, f"P:{id_prestamo} M:{monto_pago_txt}", saldos[id_cuenta], store, durable=True)
                 return response
 
         elif query_type == "CONSULTAR_HISTORIAL":
-            if len(params) != 1: return "ERROR|Parámetros incorrectos"
-            id_cuenta = params[0]
-            historial = []
-            for i in range(1, 4):
-                file_path = os.path.join(node_data_dir, f"historial_part{i}.txt")
-                if not os.path.exists(file_path): continue
-                lines, err = read_all_lines(file_path)
-                if err or not lines: continue
-                for line in lines:
-                    try:
-                        parts = line.strip().split('|')
-                        if len(parts) > 2 and parts[1] == id_cuenta:
-                            operacion = parts[2]
-                            if operacion != "DEVOLUCION":
-                                historial.append(line.strip().replace('|', ','))
-                    except IndexError:
-                        continue # Ignorar líneas malformadas en el historial
-            if not historial: return "SUCCESS|No hay historial para esta cuenta."
+            # CONSULTAR_HISTORIAL|id_cuenta[|limite[|offset[|desde[|hasta]]]] (parámetros vacíos = sin filtro)
+            if not 1 <= len(params) <= 5: return "ERROR|Parámetros incorrectos"
+            id_cuenta, limite, offset, desde, hasta = (params + [''] * 4)[:5]
+            store.historial.flush() # Incluir las filas que aún estén en la cola
+            try:
+                rows = store.historial.partition(particion_de(id_cuenta)).query(
+                    id_cuenta, int(limite) if limite else None, int(offset) if offset else 0, desde or None, hasta or None)
+            except ValueError as e:
+                return f"ERROR|Parámetros incorrectos: {e}"
+            if not rows: return "SUCCESS|No hay historial para esta cuenta."
             headers = "Fecha,ID Cuenta,Operación,Detalles,Saldo en ese Instante"
-            table_rows = sorted(historial, key=lambda x: x.split(',')[0], reverse=True)
+            table_rows = [row.replace('|', ',') for row in rows]
             return f"SUCCESS|TABLE_DATA|{headers}|{'|'.join(table_rows)}"
 
         elif query_type == "ESTADO_PAGO_PRESTAMO":
@@ -302,119 +223,644 @@ def handle_query(query_parts, node_data_dir):
             id_cliente_str = f"cliente_{id_cuenta}"
             resultados = []
             today = datetime.date.today()
-            for i in range(1, 4):
-                file_path = os.path.join(node_data_dir, f"prestamos_part{i}.txt")
-                if not os.path.exists(file_path): continue
-                lines, err = read_all_lines(file_path)
-                if err or not lines: continue
-                for line in lines:
+            with store.instantanea(): # Préstamos y saldo de una misma versión confirmada
+                for prestamo in store.leer_prestamos_de(id_cliente_str):
                     try:
-                        campos = line.strip().split(',')
-                        if campos[1] == id_cliente_str:
-                            monto_total = Decimal(campos[2]).quantize(TWO_PLACES)
-                            monto_pagado = Decimal(campos[3]).quantize(TWO_PLACES)
-                            fecha_limite_str = campos[5]
-                            
-                            monto_pendiente = (monto_total - monto_pagado).quantize(TWO_PLACES)
-
-                            if monto_pendiente <= 0: estado_actual = "Cancelado"
-                            elif datetime.datetime.strptime(fecha_limite_str, '%Y-%m-%d').date() < today: estado_actual = "Vencido"
-                            else: estado_actual = "Activo"
-                            
-                            linea_formateada = f"{campos[0]},{monto_total:.2f},{monto_pagado:.2f},{monto_pendiente:.2f},{estado_actual},{fecha_limite_str}"
-                            resultados.append(linea_formateada)
-                    except (IndexError, ValueError): continue
-            if not resultados: 
-                response = "SUCCESS|Usted no tiene préstamos."
-            else:
-                headers = "ID Préstamo,Monto Total,Monto Pagado,Monto Pendiente,Estado Actual,Fecha Límite"
-                response = f"SUCCESS|TABLE_DATA|{headers}|{'|'.join(resultados)}"
-            log_history(id_cuenta, query_type, "", get_current_balance(id_cuenta, node_data_dir), node_data_dir)
+                        monto_total = prestamo.monto_total
+                        monto_pagado = prestamo.monto_pagado
+                        fecha_limite_str = prestamo.fecha_limite
+                    
+                        monto_pendiente = monto_total - monto_pagado
+
+                        if monto_pendiente <= 0: estado_actual = "Cancelado"
+                        elif datetime.datetime.strptime(fecha_limite_str, '%Y-%m-%d').date() < today: estado_actual = "Vencido"
+                        else: estado_actual = "Activo"
+                    
+                        linea_formateada = f"{prestamo.id},{format_monto(monto_total)},{format_monto(monto_pagado)},{format_monto(monto_pendiente)},{estado_actual},{fecha_limite_str}"
+                        resultados.append(linea_formateada)
+                    except ValueError: continue
+                if not resultados: 
+                    response = "SUCCESS|Usted no tiene préstamos."
+                else:
+                    headers = "ID Préstamo,Monto Total,Monto Pagado,Monto Pendiente,Estado Actual,Fecha Límite"
+                    response = f"SUCCESS|TABLE_DATA|{headers}|{'|'.join(resultados)}"
+                if anotar_lectura: log_history(id_cuenta, query_type, "", get_current_balance(id_cuenta, store), store)
             return response
 
+        elif query_type == "REPLICA_POSICION":
+            # Lo pide el primario antes de enviar cambios: SUCCESS|epoca|último cambio aplicado
+            if len(params) != 1: return "ERROR|Parámetros incorrectos"
+            if store.replicacion is None: return "ERROR|Replicación no configurada en este nodo"
+            return store.replicacion.posicion(int(params[0]))
+
+        elif query_type == "REPLICAR":
+            # REPLICAR|particion|epoca|desde|hasta|al_dia|[[op,...],...] (ver replication.Shipper)
+            if len(params) < 6: return "ERROR|Parámetros incorrectos"
+            if store.replicacion is None: return "ERROR|Replicación no configurada en este nodo"
+            part_index, epoca, desde, hasta, al_dia = params[:5]
+            payload = '|'.join(params[5:]) # Las filas del historial de una partición trasladada contienen '|'
+            return store.replicacion.aplicar(int(part_index), epoca, int(desde), int(hasta), al_dia == '1', json.loads(payload))
+
+        elif query_type == "RECARGAR_TOPOLOGIA":
+            # Vuelve a leer el archivo de topología (ver rebalancear.py): SUCCESS|versión
+            if params: return "ERROR|Parámetros incorrectos"
+            if store.replicacion is None: return "ERROR|Replicación no configurada en este nodo"
+            try:
+                return store.replicacion.recargar()
+            except (OSError, ValueError) as e:
+                return f"ERROR|No se pudo aplicar la topología: {e}"
+
+        elif query_type == "CEDER_PARTICION":
+            # CEDER_PARTICION|particion|nodo: el primario deja de aceptar cambios cuando el nodo los tiene todos
+            if len(params) != 2 or not all(p.isdigit() for p in params): return "ERROR|Parámetros incorrectos"
+            if store.replicacion is None: return "ERROR|Replicación no configurada en este nodo"
+            return store.replicacion.ceder(int(params[0]), int(params[1]))
+
+        elif query_type == "STATS":
+            # Instantánea de métricas del nodo en JSON (una sola línea, sin '|')
+            return f"SUCCESS|{json.dumps(METRICS.snapshot(), separators=(',', ':'))}"
+
         elif query_type == "ARQUEO_CUENTAS":
-            total_sum = Decimal('0.00').quantize(TWO_PLACES)
-            for i in range(1, 4):
-                file_path = os.path.join(node_data_dir, f"cuentas_part{i}.txt")
-                if not os.path.exists(file_path): continue
-                lines, err = read_all_lines(file_path)
-                if err or not lines: continue
-                for line in lines:
-                    try: total_sum = (total_sum + Decimal(line.strip().split(',')[2])).quantize(TWO_PLACES)
-                    except (IndexError, ValueError): continue
-            return f"SUCCESS|{total_sum:.2f}"
+            # ARQUEO_CUENTAS[|VERIFICAR][|particion...]: sin particiones, todas las del nodo
+            verificar = bool(params) and params[0] == "VERIFICAR"
+            if verificar: params = params[1:]
+            try:
+                part_indexes = sorted({int(p) for p in params}) if params else sorted(store.cuentas)
+            except ValueError:
+                return "ERROR|Parámetros incorrectos para ARQUEO_CUENTAS"
+            faltantes = [p for p in part_indexes if p not in store.cuentas]
+            if faltantes: return f"ERROR|Partición {faltantes[0]} no disponible en este nodo"
+            if verificar:
+                filas = []
+                for part_index, mantenido, en_disco in store.verify_totals(part_indexes):
+                    if mantenido != en_disco:
+                        logging.warning(f"Arqueo: la partición {part_index} tiene {format_monto(mantenido)} en memoria y {format_monto(en_disco)} en disco")
+                    filas.append(f"{part_index},{format_monto(mantenido)},{format_monto(en_disco)},{format_monto(mantenido - en_disco)}")
+                return f"SUCCESS|TABLE_DATA|Partición,Total Mantenido,Total en Disco,Diferencia|{'|'.join(filas)}"
+            # Totales de todas las particiones en una misma versión, sin detener los cambios
+            with store.instantanea():
+                total_sum = sum(store.leer_total(part_index) for part_index in part_indexes)
+            return f"SUCCESS|{format_monto(total_sum)}"
 
         else:
             return f"ERROR|Query '{query_type}' no soportada"
 
+    except (ParticionTrasladada, EscrituraEnReplica) as e:
+        return f"ERROR|{e}"
     except Exception as e:
         logging.error(f"Error inesperado procesando query '{query_type}': {e}")
         return f"ERROR|Error interno del worker: {e}"
 
 
+# --- Lotes ---
+BATCH_LECTURAS = {"CONSULTAR_CUENTA", "ESTADO_PAGO_PRESTAMO", "CONSULTAR_HISTORIAL"}
+BATCH_CAMBIOS = {"DEBIT", "CREDIT", "TRANSFERIR_CUENTA", "PAGAR_DEUDA"}
+
+def batch_accounts(items):
+    """Cuentas que bloquean las operaciones de un lote (las mismas que bloquearía cada una)."""
+    ids = set()
+    for query_type, *params in items:
+        if query_type == "CONSULTAR_HISTORIAL": continue
+        for id_cuenta in params[:2] if query_type == "TRANSFERIR_CUENTA" else params[:1]:
+            if id_cuenta.isdigit(): ids.add(int(id_cuenta))
+    return ids
+
+def handle_batch(modo, body, node_data_dir, store):
+    """Ejecuta varias operaciones `CMD|params` separadas por ';' con un solo bloqueo y un solo commit.
+
+    INDEPENDIENTE: cada operación tiene su propio resultado, en el mismo orden.
+    ATOMICO: si una operación falla no se aplica ninguna; sólo admite cuentas
+    de una misma partición, cuyo cambio completo ocupa un único registro del WAL.
+    """
+    if modo not in ("INDEPENDIENTE", "ATOMICO"): return f"ERROR|Modo de lote '{modo}' inválido (INDEPENDIENTE o ATOMICO)"
+    items = [item.split('|') for item in body.split(';') if item]
+    if not items: return "ERROR|Lote vacío"
+    for query_type, *_ in items:
+        if query_type not in BATCH_LECTURAS | BATCH_CAMBIOS: return f"ERROR|Query '{query_type}' no soportada en lotes"
+    ids = batch_accounts(items)
+    if modo == "ATOMICO" and len({particion_de(id_cuenta) for id_cuenta in ids}) > 1:
+        return "ERROR|Un lote ATOMICO solo puede usar cuentas de una misma partición"
+    exclusivo = any(query_type in BATCH_CAMBIOS for query_type, *_ in items)
+
+    results = []
+    with ExitStack() as stack:
+        if exclusivo:
+            stack.enter_context(LOCKS.cuentas(ids, exclusivo))
+            batch = stack.enter_context(store.batch())
+        else:
+            # Sólo lecturas: todas ven una misma versión confirmada, sin bloquear cuentas
+            stack.enter_context(store.instantanea())
+            batch = None
+        for k, item in enumerate(items, 1):
+            result = handle_query(item, node_data_dir, store)
+            if modo == "ATOMICO" and result.startswith("ERROR|"):
+                if batch is not None: batch.rollback()
+                return f"ERROR|Lote abortado en la operación {k}: {result[len('ERROR|'):]}"
+            results.append(result.replace(';', ','))
+    return f"SUCCESS|{';'.join(results)}"
+
 # --- Servidor TCP Concurrente ---
 
+def process_request(request, node_data_dir, store):
+    """Atiende una línea `EXECUTE|tx_id|QUERY|...` o `EXECUTE_BATCH|tx_id|MODO|CMD|...;CMD|...`
+    y devuelve la línea de respuesta (sin salto)."""
+    start = time.perf_counter()
+    METRICS.level('peticiones.en_curso', 1)
+    command = 'INVALIDO'
+    try:
+        if request.startswith('EXECUTE_BATCH|'):
+            parts = request.split('|', 3)
+            if len(parts) < 4: return "ERROR|Formato inválido"
+            command = 'EXECUTE_BATCH'
+            query_result = handle_batch(parts[2], parts[3], node_data_dir, store)
+        else:
+            parts = request.split('|')
+            if len(parts) < 3 or parts[0] != 'EXECUTE':
+                return "ERROR|Formato inválido"
+            command = parts[2]
+            query_result = handle_query(parts[2:], node_data_dir, store)
+        if query_result.startswith('ERROR|'): METRICS.count(f"errores.{command}")
+        return f"RESULT|{parts[1]}|{query_result}"
+    finally:
+        METRICS.level('peticiones.en_curso', -1)
+        METRICS.count(f"peticiones.{command}")
+        METRICS.observe(f"comando.{command}", time.perf_counter() - start)
+
 class ThreadedTCPRequestHandler(threading.Thread):
     # ... (sin cambios)
-    def __init__(self, client_socket, addr, node_data_dir):
+    def __init__(self, client_socket, addr, node_data_dir, store):
         super().__init__()
         self.client_socket = client_socket
         self.addr = addr
         self.node_data_dir = node_data_dir
+        self.store = store
 
     def run(self):
         try:
-            data = self.client_socket.recv(1024)
+            # Leer hasta el fin de línea: un lote puede ocupar varios segmentos TCP.
+            # Un cliente que no termina la petición con '\n' ni cierra su lado
+            # no la deja esperando: pasado ESPERA_RESTO se procesa lo recibido.
+            data = self.client_socket.recv(65536)
+            self.client_socket.settimeout(ESPERA_RESTO)
+            while data and not data.endswith(b'\n'):
+                try:
+                    chunk = self.client_socket.recv(65536)
+                except socket.timeout:
+                    break
+                if not chunk: break
+                data += chunk
+            self.client_socket.settimeout(None)
             request = data.decode('utf-8').strip()
-            
-            parts = request.split('|')
-            if len(parts) < 3 or parts[0] != 'EXECUTE':
-                response = "ERROR|Formato inválido"
-            else:
-                tx_id = parts[1]
-                query_result = handle_query(parts[2:], self.node_data_dir)
-                response = f"RESULT|{tx_id}|{query_result}"
-
+            response = process_request(request, self.node_data_dir, self.store)
             self.client_socket.sendall(response.encode('utf-8'))
         except Exception as e:
             logging.error(f"Error en conexión con {self.addr}: {e}")
         finally:
             self.client_socket.close()
 
+def tcp_socket(host, port):
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind((host, port))
+    return server_socket
+
 class WorkerServer:
     # ... (sin cambios)
-    def __init__(self, host, port, node_id):
+    def __init__(self, host, port, node_id, durabilidad='directo', checkpoint_intervalo=5.0, almacenamiento='texto',
+                 historial_fsync='lote', historial_intervalo=1.0, particiones=None, topologia=None, nodos=None, replicar=False,
+                 max_retraso=0, latido=0.5, indices=True, indices_intervalo=60.0):
         self.host = host
         self.port = port
         self.node_id = node_id
         self.node_data_dir = os.path.join('data', f"nodo{node_id}")
         if not os.path.exists(self.node_data_dir):
             raise FileNotFoundError(f"El directorio de datos {self.node_data_dir} no existe.")
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # Número de particiones y nodos de cada una (ver topologia.py)
+        ruta_topologia = topologia or os.path.join('data', ARCHIVO)
+        self.topologia = cargar_topologia(ruta_topologia, nodos)
+        configurar_particiones(self.topologia.particiones)
+        # Cargar las particiones del nodo (o sólo `particiones`) en un índice en memoria
+        self.store = NodeStore(self.node_data_dir, LOCKS, durabilidad, almacenamiento, historial_fsync, historial_intervalo,
+                               particiones, con_indices=indices)
+        if durabilidad == 'wal':
+            self.store.start_checkpointer(checkpoint_intervalo)
+        if indices and indices_intervalo > 0:
+            self.store.start_indices(indices_intervalo)
+        if replicar or nodos:
+            self.store.replicacion = Replicator(self.store, node_id, ruta_topologia, nodos, max_retraso, latido)
+            self.store.replicacion.start(self.topologia)
 
     def start(self):
-        self.server_socket.bind((self.host, self.port))
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0)) # Detenerse de forma ordenada (ver detener)
+        self.server_socket = tcp_socket(self.host, self.port)
         self.server_socket.listen(10)
         logging.info(f"escuchando en {self.host}:{self.port}")
 
         try:
             while True:
                 client_sock, address = self.server_socket.accept()
-                handler_thread = ThreadedTCPRequestHandler(client_sock, address, self.node_data_dir)
+                handler_thread = ThreadedTCPRequestHandler(client_sock, address, self.node_data_dir, self.store)
                 handler_thread.start()
         except KeyboardInterrupt:
             logging.info("detenido.")
         finally:
             self.server_socket.close()
+            self.detener()
+
+    def detener(self):
+        """Deja al día los índices guardados para que el próximo arranque no tenga que reconstruirlos."""
+        try:
+            self.store.guardar_indices()
+        except Exception as e:
+            logging.error(f"Fallo al guardar los índices: {e}")
+
+class PipelinedConnections:
+    """Conexiones persistentes con peticiones en paralelo por conexión.
+
+    Cada línea recibida es una petición y cada respuesta es una línea que
+    empieza por `RESULT|tx_id|`, así que las respuestas pueden volver en otro
+    orden y el cliente las empareja por `tx_id`. Un cliente de una sola
+    petición (enviar una línea, leer una línea) sigue funcionando igual.
+
+    Como mucho `max_en_vuelo` peticiones están pendientes a la vez: al llegar
+    al límite el servidor deja de leer de los sockets y TCP frena a los
+    clientes. Las subclases definen `responder(request)`.
+    """
+
+    async def execute(self, request, writer, write_lock):
+        try:
+            try:
+                response = await self.responder(request)
+            except Exception as e:
+                # El cliente espera una línea por petición: sin ella se quedaría esperando
+                logging.error(f"Error atendiendo {request[:200]!r}: {e}")
+                parts = request.split('|', 2)
+                error = f"ERROR|Error interno del worker: {e}".replace('\n', ' ')
+                response = f"RESULT|{parts[1]}|{error}" if len(parts) > 2 else error
+            async with write_lock:
+                if not writer.is_closing():
+                    writer.write((response + '\n').encode('utf-8'))
+                    await writer.drain()
+        except (ConnectionError, OSError) as e:
+            logging.error(f"Error respondiendo a {writer.get_extra_info('peername')}: {e}")
+        finally:
+            self.en_vuelo.release()
+
+    async def handle_connection(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        write_lock = asyncio.Lock()
+        pending = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ConnectionError, asyncio.LimitOverrunError, ValueError) as e:
+                    logging.error(f"Error en conexión con {addr}: {e}")
+                    break
+                if not line: break
+                request = line.decode('utf-8', 'replace').strip()
+                if not request: continue
+                await self.en_vuelo.acquire() # Contrapresión: no leer más si el nodo está saturado
+                task = asyncio.create_task(self.execute(request, writer, write_lock))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+        finally:
+            writer.close()
+
+class AsyncWorkerServer(PipelinedConnections, WorkerServer):
+    """Servidor asyncio con conexiones persistentes (ver PipelinedConnections).
+
+    Las consultas se ejecutan en un pool fijo de `hilos`.
+    """
+
+    def __init__(self, *args, hilos=32, max_en_vuelo=1024, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.executor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix='query')
+        self.max_en_vuelo = max_en_vuelo
+
+    async def responder(self, request):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, process_request, request, self.node_data_dir, self.store)
+
+    async def listen(self):
+        server = await asyncio.start_server(self.handle_connection, sock=tcp_socket(self.host, self.port), backlog=1024, limit=MAX_LINEA)
+        logging.info(f"escuchando en {self.host}:{self.port} (async)")
+        return server
+
+    async def serve(self):
+        self.en_vuelo = asyncio.Semaphore(self.max_en_vuelo)
+        server = await self.listen()
+        async with server:
+            await server.serve_forever()
+
+    def start(self):
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0)) # Detenerse de forma ordenada (ver detener)
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            logging.info("detenido.")
+        finally:
+            self.executor.shutdown(wait=False)
+            self.detener()
+
+# --- Modo multiproceso ---
+
+class PartitionProcessServer(AsyncWorkerServer):
+    """Proceso hijo del modo multiproceso: atiende las peticiones de sus particiones en un socket Unix.
+
+    Su único cliente es el acceptor; cuando esa conexión se cierra (el
+    acceptor terminó, de forma ordenada o no) el proceso también termina.
+    """
+
+    def __init__(self, socket_path, listo, *args, **kwargs):
+        super().__init__(None, None, *args, **kwargs)
+        self.socket_path = socket_path
+        self.listo = listo
+
+    async def handle_connection(self, reader, writer):
+        await super().handle_connection(reader, writer)
+        self.acceptor_cerrado.set()
+
+    async def serve(self):
+        self.en_vuelo = asyncio.Semaphore(self.max_en_vuelo)
+        self.acceptor_cerrado = asyncio.Event()
+        server = await self.listen()
+        async with server:
+            await self.acceptor_cerrado.wait()
+        logging.info("el acceptor cerró la conexión: detenido.")
+
+    async def listen(self):
+        server = await asyncio.start_unix_server(self.handle_connection, path=self.socket_path, limit=MAX_LINEA)
+        logging.info(f"escuchando en {self.socket_path} (particiones {sorted(self.store.cuentas)})")
+        self.listo.send(True)
+        self.listo.close()
+        return server
+
+def run_partition_process(socket_path, listo, node_id, particiones, opciones, log_opciones, stats_intervalo, hilos, max_en_vuelo):
+    """Punto de entrada de cada proceso hijo (se lanza con 'spawn')."""
+    setup_logging(node_id, proceso=particiones[0], **log_opciones)
+    METRICS.gauge('hilos.activos', threading.active_count)
+    if stats_intervalo > 0:
+        METRICS.start_dumper(os.path.join('logs', f'stats_worker_{node_id}_p{particiones[0]}.jsonl'), stats_intervalo)
+    PartitionProcessServer(socket_path, listo, node_id, particiones=particiones, hilos=hilos, max_en_vuelo=max_en_vuelo,
+                           **opciones).start()
+
+class MultiProcessWorkerServer(PipelinedConnections):
+    """Nodo con un proceso hijo por partición de cuentas y este proceso como acceptor.
+
+    Cada hijo carga sólo su partición (con su historial, su WAL y los
+    préstamos de sus clientes) y ejecuta las consultas con su propio
+    intérprete, así que el nodo usa tantos núcleos como particiones tiene.
+    El acceptor atiende a los clientes igual que el modo async y reenvía cada
+    petición, por una conexión persistente, al hijo dueño de la cuenta de su
+    primer parámetro. ARQUEO_CUENTAS y STATS se reparten entre los hijos y se
+    combinan aquí; un EXECUTE_BATCH INDEPENDIENTE con cuentas de varias
+    particiones se divide en un sublote por hijo. Si un hijo termina, el
+    nodo entero se detiene para que el Servidor Central use las réplicas.
+    """
+
+    def __init__(self, host, port, node_id, opciones, log_opciones, stats_intervalo=0, hilos=32, max_en_vuelo=1024):
+        self.host = host
+        self.port = port
+        self.node_id = node_id
+        self.node_data_dir = os.path.join('data', f"nodo{node_id}")
+        if not os.path.exists(self.node_data_dir):
+            raise FileNotFoundError(f"El directorio de datos {self.node_data_dir} no existe.")
+        topologia = cargar_topologia(opciones.get('topologia') or os.path.join('data', ARCHIVO), opciones.get('nodos'))
+        configurar_particiones(topologia.particiones) # Los hijos la cargan por su cuenta
+        self.particiones = particiones_de_nodo(self.node_data_dir)
+        if not self.particiones:
+            raise FileNotFoundError(f"No hay particiones de cuentas en {self.node_data_dir}.")
+        self.child_args = (node_id, opciones, log_opciones, stats_intervalo, hilos, max_en_vuelo)
+        self.max_en_vuelo = max_en_vuelo
+        self.socket_dir = tempfile.mkdtemp(prefix=f'worker{node_id}_')
+        self.procesos = {}    # part_index -> multiprocessing.Process
+        self.conexiones = {}  # part_index -> (StreamWriter, asyncio.Lock)
+        self.pendientes = {}  # seq -> (part_index, Future con el resultado)
+        self.seq = itertools.count(1)
+        self.lectores = []    # Tareas que leen las respuestas de cada hijo
+
+    def socket_path(self, part_index):
+        return os.path.join(self.socket_dir, f"particion{part_index}.sock")
+
+    def start_children(self):
+        ctx = multiprocessing.get_context('spawn')
+        listos = {}
+        for part_index in self.particiones:
+            listo_recv, listo_send = ctx.Pipe(duplex=False)
+            proceso = ctx.Process(target=run_partition_process, name=f"particion{part_index}", daemon=True,
+                                  args=(self.socket_path(part_index), listo_send, self.child_args[0], [part_index], *self.child_args[1:]))
+            proceso.start()
+            listo_send.close() # Si el hijo muere antes de estar listo, recv() lanza EOFError
+            self.procesos[part_index] = proceso
+            listos[part_index] = listo_recv
+        for part_index, listo in listos.items():
+            try:
+                listo.recv()
+            except EOFError:
+                raise RuntimeError(f"El proceso de la partición {part_index} no pudo iniciarse") from None
+
+    async def enviar(self, part_index, tipo, cuerpo):
+        """Reenvía `tipo|seq|cuerpo` al hijo de la partición y devuelve su resultado (sin `RESULT|seq|`)."""
+        seq = next(self.seq)
+        future = asyncio.get_running_loop().create_future()
+        self.pendientes[seq] = (part_index, future)
+        writer, write_lock = self.conexiones[part_index]
+        async with write_lock:
+            writer.write(f"{tipo}|{seq}|{cuerpo}\n".encode('utf-8'))
+            await writer.drain()
+        return await future
+
+    async def leer_respuestas(self, part_index, reader):
+        while True:
+            try:
+                line = await reader.readline()
+            except (ConnectionError, ValueError) as e:
+                logging.error(f"Error leyendo del proceso de la partición {part_index}: {e}")
+                break
+            if not line: break
+            _, seq, result = line.decode('utf-8').rstrip('\n').split('|', 2)
+            _, future = self.pendientes.pop(int(seq), (None, None))
+            if future is not None and not future.done():
+                future.set_result(result)
+        for seq, (owner, future) in list(self.pendientes.items()):
+            if owner == part_index:
+                del self.pendientes[seq]
+                future.set_result(f"ERROR|El proceso de la partición {part_index} no está disponible")
+        if not self.caida.done():
+            self.caida.set_result(f"El proceso de la partición {part_index} terminó")
+
+    def ruta(self, params):
+        """Partición que atiende una petición: la de la cuenta de su primer parámetro.
+
+        Sin cuenta válida (o si el nodo no tiene esa partición) la atiende el
+        primer hijo, que responde el mismo error que un nodo de un solo proceso.
+        """
+        id_cuenta = params.split('|', 1)[0]
+        if id_cuenta.isdigit() and particion_de(id_cuenta) in self.conexiones:
+            return particion_de(id_cuenta)
+        return self.particiones[0]
+
+    async def responder(self, request):
+        start = time.perf_counter()
+        try:
+            parts = request.split('|', 3)
+            if parts[0] == 'EXECUTE_BATCH':
+                if len(parts) < 4: return "ERROR|Formato inválido"
+                result = await self.lote(parts[2], parts[3])
+            else:
+                if len(parts) < 3 or parts[0] != 'EXECUTE': return "ERROR|Formato inválido"
+                query_type, params = parts[2], parts[3] if len(parts) > 3 else ''
+                if query_type == "ARQUEO_CUENTAS":
+                    result = await self.arqueo(params.split('|') if params else [])
+                elif query_type == "STATS":
+                    result = await self.stats()
+                elif query_type == "RECARGAR_TOPOLOGIA":
+                    # Cada hijo aplica la topología a su partición
+                    results = await asyncio.gather(*(self.enviar(p, 'EXECUTE', query_type) for p in self.particiones))
+                    result = next((r for r in results if not r.startswith('SUCCESS|')), results[0])
+                elif query_type in ("REPLICAR", "REPLICA_POSICION", "CEDER_PARTICION"):
+                    # Su primer parámetro es la partición, no una cuenta
+                    part_index = params.split('|', 1)[0]
+                    part_index = int(part_index) if part_index.isdigit() else None
+                    result = await self.enviar(part_index if part_index in self.conexiones else self.particiones[0],
+                                               'EXECUTE', request.split('|', 2)[2])
+                else:
+                    result = await self.enviar(self.ruta(params), 'EXECUTE', request.split('|', 2)[2])
+            return f"RESULT|{parts[1]}|{result}"
+        finally:
+            METRICS.observe('acceptor.peticion', time.perf_counter() - start)
+
+    async def lote(self, modo, body):
+        items = [item for item in body.split(';') if item]
+        grupos = {} # part_index -> posiciones de sus operaciones en el lote
+        for k, item in enumerate(items):
+            grupos.setdefault(self.ruta(item.partition('|')[2]), []).append(k)
+        validos = modo in ("INDEPENDIENTE", "ATOMICO") and items and all(
+            item.split('|', 1)[0] in BATCH_LECTURAS | BATCH_CAMBIOS for item in items)
+        if len(grupos) <= 1 or not validos:
+            # Una sola partición, o un lote que el hijo rechazará con el error correspondiente
+            return await self.enviar(next(iter(grupos), self.particiones[0]), 'EXECUTE_BATCH', f"{modo}|{body}")
+        if modo == "ATOMICO":
+            return "ERROR|Un lote ATOMICO solo puede usar cuentas de una misma partición"
+        part_indexes = list(grupos)
+        results = await asyncio.gather(*(
+            self.enviar(p, 'EXECUTE_BATCH', f"INDEPENDIENTE|{';'.join(items[k] for k in grupos[p])}") for p in part_indexes))
+        combined = [None] * len(items)
+        for part_index, result in zip(part_indexes, results):
+            if not result.startswith('SUCCESS|'): return result
+            for k, item_result in zip(grupos[part_index], result[len('SUCCESS|'):].split(';')):
+                combined[k] = item_result
+        return f"SUCCESS|{';'.join(combined)}"
+
+    async def arqueo(self, params):
+        verificar = bool(params) and params[0] == "VERIFICAR"
+        if verificar: params = params[1:]
+        try:
+            part_indexes = sorted({int(p) for p in params}) if params else self.particiones
+        except ValueError:
+            return "ERROR|Parámetros incorrectos para ARQUEO_CUENTAS"
+        faltantes = [p for p in part_indexes if p not in self.conexiones]
+        if faltantes: return f"ERROR|Partición {faltantes[0]} no disponible en este nodo"
+        query = "ARQUEO_CUENTAS|VERIFICAR" if verificar else "ARQUEO_CUENTAS"
+        results = await asyncio.gather(*(self.enviar(p, 'EXECUTE', f"{query}|{p}") for p in part_indexes))
+        for result in results:
+            if not result.startswith('SUCCESS|'): return result
+        if verificar:
+            # SUCCESS|TABLE_DATA|encabezados|fila: se conservan los encabezados y se unen las filas
+            encabezado = results[0].split('|', 3)[:3]
+            return '|'.join(encabezado + [result.split('|', 3)[3] for result in results])
+        total_sum = sum(parse_monto(result.split('|', 1)[1]) for result in results)
+        return f"SUCCESS|{format_monto(total_sum)}"
+
+    async def stats(self):
+        results = await asyncio.gather(*(self.enviar(p, 'EXECUTE', "STATS") for p in self.particiones))
+        snapshots = [json.loads(result.split('|', 1)[1]) for result in results if result.startswith('SUCCESS|')]
+        snapshots.append(METRICS.snapshot())
+        return f"SUCCESS|{json.dumps(merge_snapshots(snapshots), separators=(',', ':'))}"
+
+    async def serve(self):
+        self.en_vuelo = asyncio.Semaphore(self.max_en_vuelo)
+        self.caida = asyncio.get_running_loop().create_future()
+        for part_index in self.particiones:
+            reader, writer = await asyncio.open_unix_connection(self.socket_path(part_index), limit=MAX_LINEA)
+            self.conexiones[part_index] = (writer, asyncio.Lock())
+            self.lectores.append(asyncio.create_task(self.leer_respuestas(part_index, reader)))
+        server = await asyncio.start_server(self.handle_connection, sock=tcp_socket(self.host, self.port), backlog=1024, limit=MAX_LINEA)
+        logging.info(f"escuchando en {self.host}:{self.port} (procesos: particiones {self.particiones})")
+        async with server:
+            motivo = await self.caida
+        logging.error(f"{motivo}: deteniendo el nodo.")
+        raise SystemExit(1)
+
+    def start(self):
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0)) # Terminar también a los hijos
+        try:
+            self.start_children()
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            logging.info("detenido.")
+        finally:
+            for proceso in self.procesos.values():
+                if proceso.is_alive(): proceso.terminate()
+            for proceso in self.procesos.values():
+                proceso.join()
+            shutil.rmtree(self.socket_dir, ignore_errors=True)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Nodo Trabajador del Sistema Distribuido.")
     parser.add_argument("--host", type=str, default="localhost", help="Host del nodo.")
     parser.add_argument("--port", type=int, required=True, help="Puerto del nodo.")
     parser.add_argument("--node-id", type=int, required=True, help="ID del nodo (ej: 1)")
+    parser.add_argument("--durabilidad", choices=["directo", "wal"], default="directo",
+                        help="directo: reescribe la partición en cada cambio; wal: registro de sólo-añadir con checkpoints.")
+    parser.add_argument("--checkpoint-intervalo", type=float, default=5.0, help="Segundos entre checkpoints del WAL.")
+    parser.add_argument("--almacenamiento", choices=["texto", "mmap"], default="texto",
+                        help="texto: cuentas_partN.txt en memoria; mmap: cuentas_partN.dat binario de ancho fijo.")
+    parser.add_argument("--historial-fsync", choices=["lote", "intervalo", "ninguno"], default="lote",
+                        help="Cuándo forzar a disco el historial: tras cada lote, cada --historial-intervalo segundos o nunca.")
+    parser.add_argument("--historial-intervalo", type=float, default=1.0, help="Segundos entre fsync del historial con --historial-fsync intervalo.")
+    parser.add_argument("--mode", choices=["hilos", "async", "procesos"], default="hilos",
+                        help="hilos: un hilo y una conexión por petición; async: conexiones persistentes con peticiones en paralelo; "
+                             "procesos: como async, con un proceso por partición de cuentas.")
+    parser.add_argument("--hilos", type=int, default=32, help="Hilos que ejecutan consultas en modo async (por proceso en modo procesos).")
+    parser.add_argument("--max-en-vuelo", type=int, default=1024, help="Peticiones pendientes como máximo en modo async.")
+    parser.add_argument("--log-consola", action=argparse.BooleanOptionalAction, default=True,
+                        help="Repetir el log en la salida estándar además de en logs/worker_N.log.")
+    parser.add_argument("--log-muestreo", type=int, default=1, help="Registrar 1 de cada N peticiones de cada comando.")
+    parser.add_argument("--log-max-por-seg", type=int, default=0, help="Peticiones registradas por comando y segundo como máximo (0 = sin límite).")
+    parser.add_argument("--topologia", type=str, default=os.path.join('data', ARCHIVO),
+                        help="Archivo con el número de particiones y los nodos de cada una (lo escribe generador_datos.py).")
+    parser.add_argument("--replicar", action="store_true",
+                        help="Replicar las particiones entre los nodos según la topología.")
+    parser.add_argument("--nodos", nargs='+', metavar="HOST:PUERTO",
+                        help="Direcciones de todos los nodos, en orden (la k-ésima es la del nodo k); reemplazan a las de la topología. Activa la replicación.")
+    parser.add_argument("--max-retraso", type=float, default=0,
+                        help="Segundos sin estar al día tras los que una réplica rechaza lecturas (0 = sin límite).")
+    parser.add_argument("--latido", type=float, default=0.5, help="Segundos entre latidos del primario a sus réplicas.")
+    parser.add_argument("--stats-intervalo", type=float, default=0, help="Segundos entre volcados de STATS a logs/stats_worker_N.jsonl (0 = nunca).")
+    parser.add_argument("--indices", action=argparse.BooleanOptionalAction, default=True,
+                        help="Guardar junto a cada archivo de datos su índice (.idx) y reutilizarlo al arrancar si el archivo no cambió.")
+    parser.add_argument("--indices-intervalo", type=float, default=60.0,
+                        help="Segundos entre actualizaciones de los índices guardados (0 = sólo al arrancar y al detenerse).")
     args = parser.parse_args()
 
-    setup_logging(args.node_id)
-    worker = WorkerServer(args.host, args.port, args.node_id)
+    log_opciones = dict(consola=args.log_consola, muestreo=args.log_muestreo, max_por_seg=args.log_max_por_seg)
+    setup_logging(args.node_id, **log_opciones)
+    METRICS.gauge('hilos.activos', threading.active_count)
+    if args.stats_intervalo > 0:
+        METRICS.start_dumper(os.path.join('logs', f'stats_worker_{args.node_id}.jsonl'), args.stats_intervalo)
+    opciones = dict(durabilidad=args.durabilidad, checkpoint_intervalo=args.checkpoint_intervalo, almacenamiento=args.almacenamiento,
+                    historial_fsync=args.historial_fsync, historial_intervalo=args.historial_intervalo,
+                    topologia=args.topologia, nodos=args.nodos, replicar=args.replicar,
+                    max_retraso=args.max_retraso, latido=args.latido, indices=args.indices, indices_intervalo=args.indices_intervalo)
+    if args.mode == 'procesos':
+        worker = MultiProcessWorkerServer(args.host, args.port, args.node_id, opciones, log_opciones, args.stats_intervalo,
+                                          hilos=args.hilos, max_en_vuelo=args.max_en_vuelo)
+    elif args.mode == 'async':
+        worker = AsyncWorkerServer(args.host, args.port, args.node_id, hilos=args.hilos, max_en_vuelo=args.max_en_vuelo, **opciones)
+    else:
+        worker = WorkerServer(args.host, args.port, args.node_id, **opciones)
     worker.start()
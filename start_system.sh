@@ -38,9 +38,11 @@ java -cp out com.example.distributedsystem.CentralServer > logs/server.log 2>&1
 sleep 2
 
 echo "INFO: Iniciando los Nodos Trabajadores..."
-python3 src/worker_nodes/worker.py --port 9091 --node-id 1 > logs/worker1.log 2>&1 &
-python3 src/worker_nodes/worker.py --port 9092 --node-id 2 > logs/worker2.log 2>&1 &
-python3 src/worker_nodes/worker.py --port 9093 --node-id 3 > logs/worker3.log 2>&1 &
+# Cada nodo replica sus particiones primarias en los demás (ver --nodos en usar.md)
+NODOS="localhost:9091 localhost:9092 localhost:9093"
+python3 src/worker_nodes/worker.py --port 9091 --node-id 1 --no-log-consola --nodos $NODOS --max-retraso 2 > logs/worker1.log 2>&1 &
+python3 src/worker_nodes/worker.py --port 9092 --node-id 2 --no-log-consola --nodos $NODOS --max-retraso 2 > logs/worker2.log 2>&1 &
+python3 src/worker_nodes/worker.py --port 9093 --node-id 3 --no-log-consola --nodos $NODOS --max-retraso 2 > logs/worker3.log 2>&1 &
 
 sleep 1
 